@@ -0,0 +1,382 @@
+import hashlib
+import io
+import json
+import random
+import re
+import socket
+import tarfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ENTITY_TYPES = ["PIPELINE", "INPUTSET", "TEMPLATE", "SERVICE", "ENV", "INFRA"]
+
+
+class FakeConfig:
+    """Shape and behaviour of the stand-in Harness and GitHub servers."""
+
+    def __init__(self, entities=100, children_per_parent=1, repos=5, inline_ratio=0.0, max_page_size=100,
+                 harness_latency_ms=0.0, github_latency_ms=0.0, harness_error_rate=0.0, harness_rate_limit=0,
+                 github_rate_limit=0, github_secondary_every=0, seed=1):
+        self.entities = entities  # Pipelines, templates, services and environments of the scope
+        self.children_per_parent = children_per_parent  # Input sets per pipeline, infras per environment
+        self.repos = repos
+        self.inline_ratio = inline_ratio
+        self.max_page_size = max_page_size
+        self.harness_latency_ms = harness_latency_ms
+        self.github_latency_ms = github_latency_ms
+        self.harness_error_rate = harness_error_rate  # Share of Harness calls answered with a 503
+        self.harness_rate_limit = harness_rate_limit  # Harness calls per second before 429, 0 for no limit
+        self.github_rate_limit = github_rate_limit  # GitHub calls per minute before the primary limit, 0 for no limit
+        self.github_secondary_every = github_secondary_every  # Every Nth GitHub write hits a secondary limit
+        self.seed = seed
+
+
+class FakeState:
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.random = random.Random(config.seed)
+        self.requests = {}
+        self.injected = {"harness_503": 0, "harness_429": 0, "github_primary": 0, "github_secondary": 0}
+        self.harness_window = (0, 0)  # (second, calls in that second)
+        self.github_window = (0.0, 0)  # (window start, calls in the window)
+        self.github_writes = 0
+        # What the tool achieved, checked by the benchmark runner so that a failing run can't pass for a fast one
+        self.files_written = 0
+        self.repos_written = set()
+        self.repos_with_pull_request = set()
+        self.updates = 0
+
+    def count(self, method, path):
+        # Identifiers are folded so that the stats stay one line per endpoint
+        endpoint = re.sub(r"/(p|t|s|e|i|f|repo)\d+", r"/{\1}", path)
+        with self.lock:
+            self.requests[f"{method} {endpoint}"] = self.requests.get(f"{method} {endpoint}", 0) + 1
+
+    def stats(self):
+        with self.lock:
+            return {"requests": dict(self.requests), "total_requests": sum(self.requests.values()),
+                    "injected": dict(self.injected), "files_written": self.files_written,
+                    "repos_written": sorted(self.repos_written),
+                    "repos_with_pull_request": sorted(self.repos_with_pull_request), "updates": self.updates}
+
+    def record_files(self, repo, files):
+        with self.lock:
+            self.files_written += files
+            self.repos_written.add(repo)
+
+    def record_pull_request(self, repo):
+        with self.lock:
+            self.repos_with_pull_request.add(repo)
+
+    def record_update(self):
+        with self.lock:
+            self.updates += 1
+
+
+def is_remote(config, index):
+    return index >= config.entities * config.inline_ratio
+
+
+def git_details(config, kind, index, file_path, with_repo_url):
+    repo = f"repo{index % config.repos}"
+    details = {"repoName": repo, "filePath": file_path, "branch": "main",
+               "fileUrl": f"https://github.com/bench/{repo}/blob/main/{file_path}"}
+    if with_repo_url:
+        details["repoUrl"] = f"https://github.com/bench/{repo}"
+    return {kind: details}
+
+
+def source_path(kind, identifier):
+    return f"legacy/{kind}/{identifier}.yaml"
+
+
+def source_yaml(kind, identifier):
+    # About the size of a small real pipeline
+    steps = "".join(f"        - step:\n            name: step{i}\n            type: ShellScript\n" for i in range(12))
+    return f"{kind}:\n  identifier: {identifier}\n  name: {identifier}\n  stages:\n{steps}"
+
+
+def parent_entity(config, kind, index):
+    identifier = {"pipeline": "p", "template": "t", "service": "s", "environment": "e"}[kind] + str(index)
+    store_type = "REMOTE" if is_remote(config, index) else "INLINE"
+    entity = {"identifier": identifier, "name": identifier, "storeType": store_type}
+    details_key = "gitDetails" if kind in ("pipeline", "template") else "entityGitDetails"
+    if store_type == "REMOTE":
+        entity.update(git_details(config, details_key, index, source_path(kind, identifier), kind in ("pipeline", "template")))
+    if kind == "template":
+        entity["versionLabel"] = "v1"
+    if kind == "environment":
+        entity["type"] = "PreProduction"
+    return entity
+
+
+def child_entity(config, kind, parent_index, child_index):
+    index = parent_index * config.children_per_parent + child_index
+    identifier = ("i" if kind == "inputset" else "f") + str(index)
+    store_type = "REMOTE" if is_remote(config, parent_index) else "INLINE"
+    entity = {"identifier": identifier, "name": identifier, "storeType": store_type}
+    if store_type == "REMOTE":
+        entity.update(git_details(config, "gitDetails" if kind == "inputset" else "entityGitDetails", parent_index,
+                                  source_path(kind, identifier), False))
+    return entity
+
+
+def page(config, items, params, page_param, size_param):
+    # Like Harness, the requested page size is capped by the server
+    size = max(1, min(int(params.get(size_param, ["100"])[0]), config.max_page_size))
+    index = int(params.get(page_param, ["0"])[0])
+    total_pages = (len(items) + size - 1) // size
+    return {"status": "SUCCESS", "data": {"content": items[index * size:(index + 1) * size], "totalPages": total_pages,
+                                          "totalItems": len(items), "pageSize": size, "pageIndex": index}}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def setup(self):
+        super().setup()
+        # Headers and body are written separately, without this every keep-alive response waits for a delayed ACK
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def do_PUT(self):
+        self.dispatch("PUT")
+
+    def do_PATCH(self):
+        self.dispatch("PATCH")
+
+    def reply(self, status, body, headers=None, raw=None):
+        data = raw if raw is not None else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream" if raw is not None else "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def dispatch(self, method):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"null") if length else None
+        state = self.state
+        if url.path == "/__stats":
+            return self.reply(200, state.stats())
+        state.count(method, url.path)
+        if url.path.startswith("/gateway/"):
+            time.sleep(state.config.harness_latency_ms / 1000)
+            if self.harness_fault():
+                return
+            return self.harness(method, url.path[len("/gateway"):], params)
+        if url.path.startswith("/api/v3/repos/"):
+            time.sleep(state.config.github_latency_ms / 1000)
+            if self.github_fault(method):
+                return
+            return self.github(method, url.path[len("/api/v3/repos/"):], params, body)
+        self.reply(404, {"message": "Not Found"})
+
+    def harness_fault(self):
+        state = self.state
+        config = state.config
+        with state.lock:
+            if config.harness_rate_limit:
+                second = int(time.time())
+                window, calls = state.harness_window
+                calls = calls + 1 if window == second else 1
+                state.harness_window = (second, calls)
+                if calls > config.harness_rate_limit:
+                    state.injected["harness_429"] += 1
+                    self.reply(429, {"message": "Too many requests"}, {"Retry-After": 1})
+                    return True
+            if config.harness_error_rate and state.random.random() < config.harness_error_rate:
+                state.injected["harness_503"] += 1
+                self.reply(503, {"message": "Service unavailable"})
+                return True
+        return False
+
+    def github_fault(self, method):
+        state = self.state
+        config = state.config
+        with state.lock:
+            headers = {}
+            if config.github_rate_limit:
+                now = time.time()
+                window, calls = state.github_window
+                if now - window >= 60:
+                    window, calls = now, 0
+                calls += 1
+                state.github_window = (window, calls)
+                headers = {"X-RateLimit-Limit": config.github_rate_limit,
+                           "X-RateLimit-Remaining": max(0, config.github_rate_limit - calls),
+                           "X-RateLimit-Reset": int(window + 60)}
+                if calls > config.github_rate_limit:
+                    state.injected["github_primary"] += 1
+                    self.reply(403, {"message": "API rate limit exceeded"}, headers)
+                    return True
+            if method != "GET" and config.github_secondary_every:
+                state.github_writes += 1
+                if state.github_writes % config.github_secondary_every == 0:
+                    state.injected["github_secondary"] += 1
+                    self.reply(403, {"message": "You have exceeded a secondary rate limit"},
+                               dict(headers, **{"Retry-After": 1}))
+                    return True
+        self.rate_limit_headers = headers
+        return False
+
+    def harness(self, method, path, params):
+        config = self.state.config
+        n = config.entities
+        children = config.children_per_parent
+        match = re.match(r"/(pipeline|template|ng)/api/([^/]+)(?:/([^/]+))?(?:/(.*))?$", path)
+        if match is None:
+            return self.reply(404, {"message": "Not Found"})
+        resource, identifier = match.group(2), match.group(3)
+
+        if path.endswith("update-git-metadata") or resource == "templates" and identifier == "update":
+            self.state.record_update()
+            return self.reply(200, {"status": "SUCCESS", "data": {"identifier": identifier}})
+        if resource == "organizations":
+            return self.reply(200, page(config, [{"organization": {"identifier": "default"}}], params, "pageIndex", "pageSize"))
+        if resource == "projects":
+            return self.reply(200, page(config, [{"project": {"identifier": "bench"}}], params, "pageIndex", "pageSize"))
+        if resource == "pipelines" and identifier == "list":
+            items = [parent_entity(config, "pipeline", i) for i in range(n)]
+            return self.reply(200, page(config, items, params, "page", "size"))
+        if resource == "pipelines":
+            pipeline = parent_entity(config, "pipeline", int(identifier[1:]))
+            data = dict(pipeline, yamlPipeline=source_yaml("pipeline", identifier))
+            return self.reply(200, {"status": "SUCCESS", "data": data})
+        if resource == "templates" and identifier == "list-metadata":
+            items = [parent_entity(config, "template", i) for i in range(n)]
+            return self.reply(200, page(config, items, params, "page", "size"))
+        if resource == "templates":
+            template = parent_entity(config, "template", int(identifier[1:]))
+            return self.reply(200, {"status": "SUCCESS", "data": dict(template, yaml=source_yaml("template", identifier))})
+        if resource == "servicesV2" and identifier is None:
+            items = [{"service": parent_entity(config, "service", i)} for i in range(n)]
+            return self.reply(200, page(config, items, params, "page", "size"))
+        if resource == "servicesV2":
+            service = parent_entity(config, "service", int(identifier[1:]))
+            return self.reply(200, {"status": "SUCCESS", "data": {"service": dict(service, yaml=source_yaml("service", identifier))}})
+        if resource == "environmentsV2" and identifier is None:
+            items = [{"environment": parent_entity(config, "environment", i)} for i in range(n)]
+            return self.reply(200, page(config, items, params, "page", "size"))
+        if resource == "environmentsV2":
+            env = parent_entity(config, "environment", int(identifier[1:]))
+            return self.reply(200, {"status": "SUCCESS", "data": {"environment": dict(env, yaml=source_yaml("environment", identifier))}})
+        if resource == "inputSets" and identifier is None:
+            parent_index = int(params["pipelineIdentifier"][0][1:])
+            items = [child_entity(config, "inputset", parent_index, i) for i in range(children)]
+            return self.reply(200, page(config, items, params, "pageIndex", "pageSize"))
+        if resource == "inputSets":
+            index = int(identifier[1:])
+            input_set = child_entity(config, "inputset", index // children, index % children)
+            return self.reply(200, {"status": "SUCCESS", "data": dict(input_set, inputSetYaml=source_yaml("inputSet", identifier))})
+        if resource == "infrastructures" and identifier is None:
+            parent_index = int(params["environmentIdentifier"][0][1:])
+            items = [{"infrastructure": child_entity(config, "infra", parent_index, i)} for i in range(children)]
+            return self.reply(200, page(config, items, params, "page", "size"))
+        if resource == "infrastructures":
+            index = int(identifier[1:])
+            infra = child_entity(config, "infra", index // children, index % children)
+            return self.reply(200, {"status": "SUCCESS", "data": {"infrastructure": dict(infra, yaml=source_yaml("infrastructureDefinition", identifier))}})
+        self.reply(404, {"message": "Not Found"})
+
+    def github(self, method, path, params, body):
+        headers = self.rate_limit_headers
+        match = re.match(r"([^/]+)/([^/]+)(/.*)?$", path)
+        owner, repo, rest = match.group(1), match.group(2), match.group(3) or ""
+        sha = hashlib.sha1(f"{repo}{rest}{time.time()}".encode()).hexdigest()
+        if rest == "" and method == "GET":
+            return self.reply(200, {"name": repo, "owner": {"login": owner}, "default_branch": "main"}, headers)
+        if rest.startswith("/git/ref/heads/"):
+            return self.reply(200, {"object": {"sha": "0" * 40}}, headers)
+        if rest == "/git/refs" and method == "POST":
+            return self.reply(201, {"ref": body["ref"], "object": {"sha": body["sha"]}}, headers)
+        if rest.startswith("/git/refs/heads/") and method == "PATCH":
+            return self.reply(200, {"object": {"sha": body["sha"]}}, headers)
+        if rest.startswith("/git/trees/") and method == "GET":
+            # Only a README on the default branch, every migrated file is new
+            return self.reply(200, {"sha": sha, "tree": [{"path": "README.md", "type": "blob", "sha": "1" * 40}],
+                                    "truncated": False}, headers)
+        if rest == "/git/trees" and method == "POST":
+            self.state.record_files(repo, len(body["tree"]))
+            return self.reply(201, {"sha": sha}, headers)
+        if rest.startswith("/git/commits/") and method == "GET":
+            return self.reply(200, {"sha": rest.rsplit("/", 1)[1], "tree": {"sha": "2" * 40}}, headers)
+        if rest == "/git/commits" and method == "POST":
+            return self.reply(201, {"sha": sha}, headers)
+        if rest.startswith("/contents/") and method == "GET":
+            return self.reply(404, {"message": "Not Found"}, headers)
+        if rest.startswith("/contents/") and method == "PUT":
+            self.state.record_files(repo, 1)
+            return self.reply(201, {"content": {"path": rest[len("/contents/"):], "sha": sha}, "commit": {"sha": sha}},
+                              headers)
+        if rest == "/pulls" and method == "POST":
+            self.state.record_pull_request(repo)
+            return self.reply(201, {"number": 1, "html_url": f"https://github.com/{owner}/{repo}/pull/1"}, headers)
+        if rest.startswith("/tarball/"):
+            return self.reply(200, None, headers, raw=self.tarball(repo))
+        self.reply(404, {"message": "Not Found"}, headers)
+
+    def tarball(self, repo):
+        config = self.state.config
+        repo_index = int(repo[len("repo"):])
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode="w:gz") as tar:
+            for index in range(repo_index, config.entities, config.repos):
+                for kind, prefix in (("pipeline", "p"), ("template", "t"), ("service", "s"), ("environment", "e")):
+                    add_file(tar, f"bench-{repo}-0/{source_path(kind, prefix + str(index))}", source_yaml(kind, prefix + str(index)))
+                for child in range(config.children_per_parent):
+                    child_index = index * config.children_per_parent + child
+                    add_file(tar, f"bench-{repo}-0/{source_path('inputset', 'i' + str(child_index))}", source_yaml("inputSet", "i" + str(child_index)))
+                    add_file(tar, f"bench-{repo}-0/{source_path('infra', 'f' + str(child_index))}", source_yaml("infrastructureDefinition", "f" + str(child_index)))
+        return archive.getvalue()
+
+
+def add_file(tar, name, content):
+    data = content.encode()
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+class FakeHTTPServer(ThreadingHTTPServer):
+    # The default backlog of 5 drops the connections of concurrent clients, which then wait for a SYN retransmit
+    request_queue_size = 1024
+
+
+class FakeServer:
+    """Harness (under /gateway) and GitHub Enterprise (under /api/v3) stand-ins on one local port."""
+
+    def __init__(self, config, port=0):
+        self.state = FakeState(config)
+        handler = type("BoundHandler", (Handler,), {"state": self.state})
+        self.server = FakeHTTPServer(("127.0.0.1", port), handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self):
+        return self.state.stats()
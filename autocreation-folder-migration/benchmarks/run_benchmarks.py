@@ -0,0 +1,219 @@
+"""Offline benchmarks of operation-1 and operation-2 against the local stand-in servers of fake_servers.py.
+
+Every scenario runs in its own process so that its peak RSS is measured alone, eg:
+
+    python benchmarks/run_benchmarks.py --sizes 100,1000 --concurrency 8 --output results.json
+    python benchmarks/run_benchmarks.py --baseline results.json  # fails if throughput or memory regressed
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_servers import ENTITY_TYPES, FakeConfig, FakeServer
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+CHILD_TYPES = {"INPUTSET", "INFRA"}
+# Lines of the tool's error log shown when a scenario didn't do its work
+MAX_ERROR_LINES = 20
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the migration against local fake Harness and GitHub servers")
+    parser.add_argument("--sizes", default="100,1000,10000", help="Comma separated entity counts (default: 100,1000,10000)")
+    parser.add_argument("--operations", default="1,2", help="Comma separated operations to run (default: 1,2)")
+    parser.add_argument("--entity-type", choices=ENTITY_TYPES, default="PIPELINE")
+    parser.add_argument("--engine", choices=["sync", "async"], default="sync")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--commit-mode", choices=["file", "batch"], default="file")
+    parser.add_argument("--fetch-mode", choices=["api", "archive"], default="api")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="Any other Context attribute, eg: --set page_size=50 --set tree_snapshot=true")
+    parser.add_argument("--children-per-parent", type=int, default=1, help="Input sets per pipeline, infras per env")
+    parser.add_argument("--repos", type=int, default=5, help="Repos the entities are spread over")
+    parser.add_argument("--inline-ratio", type=float, default=0.0, help="Share of inline entities")
+    parser.add_argument("--max-page-size", type=int, default=100, help="Largest page the fake Harness returns")
+    parser.add_argument("--harness-latency-ms", type=float, default=5.0)
+    parser.add_argument("--github-latency-ms", type=float, default=5.0)
+    parser.add_argument("--harness-error-rate", type=float, default=0.0, help="Share of Harness calls failing with 503")
+    parser.add_argument("--harness-rate-limit", type=int, default=0, help="Harness calls per second before 429s")
+    parser.add_argument("--github-rate-limit", type=int, default=0, help="GitHub calls per minute before the primary limit")
+    parser.add_argument("--github-secondary-every", type=int, default=0, help="Every Nth GitHub write hits a secondary limit")
+    parser.add_argument("--output", default=None, help="Write the results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="Results of a previous run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed throughput drop and memory growth against the baseline (default: 0.2)")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def parse_value(value):
+    if value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    for kind in (int, float):
+        try:
+            return kind(value)
+        except ValueError:
+            pass
+    return value
+
+
+def get_context_overrides(args):
+    overrides = {"engine": args.engine, "concurrency": args.concurrency, "commit_mode": args.commit_mode,
+                 "fetch_mode": args.fetch_mode}
+    for item in args.set:
+        key, value = item.split("=", 1)
+        overrides[key.strip()] = parse_value(value.strip())
+    return overrides
+
+
+def run_scenario(args, size, operation):
+    config = FakeConfig(entities=size, children_per_parent=args.children_per_parent, repos=args.repos,
+                        inline_ratio=args.inline_ratio, max_page_size=args.max_page_size,
+                        harness_latency_ms=args.harness_latency_ms, github_latency_ms=args.github_latency_ms,
+                        harness_error_rate=args.harness_error_rate, harness_rate_limit=args.harness_rate_limit,
+                        github_rate_limit=args.github_rate_limit, github_secondary_every=args.github_secondary_every)
+    with FakeServer(config) as server, tempfile.TemporaryDirectory() as work_dir:
+        scenario = {"url": server.url, "entity_type": args.entity_type, "operation": operation,
+                    "context": get_context_overrides(args), "result": os.path.join(work_dir, "result.json"),
+                    "errors": os.path.join(work_dir, "errors.log")}
+        # The tool runs in a child process, in a scratch folder for the files it writes (journal, report, clones)
+        process = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", json.dumps(scenario)],
+                                 cwd=work_dir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if process.returncode != 0:
+            raise RuntimeError(f"Scenario {size} entities, operation {operation} failed:\n{process.stderr}")
+        with open(scenario["result"]) as file:
+            result = json.load(file)
+        stats = server.stats()
+        remote = sum(1 for index in range(size) if index >= size * args.inline_ratio)
+        entities = remote * args.children_per_parent if args.entity_type in CHILD_TYPES else remote
+        # Operation-2 updates every listed input set, inline ones included
+        updates = size * args.children_per_parent if args.entity_type == "INPUTSET" else entities
+        problems = check_scenario(operation, entities, updates, stats)
+        if problems:
+            message = f"Scenario {size} entities, operation {operation} didn't complete: " + "; ".join(problems)
+            with open(scenario["errors"]) as file:
+                errors = file.read().splitlines()
+            if errors:
+                message += f"\n{len(errors)} errors logged, the first ones:\n" + "\n".join(errors[:MAX_ERROR_LINES])
+            raise RuntimeError(message)
+    return {
+        "entity_type": args.entity_type,
+        "operation": operation,
+        "size": size,
+        "entities": entities,
+        "seconds": round(result["seconds"], 3),
+        "entities_per_second": round(entities / result["seconds"], 1) if result["seconds"] > 0 else None,
+        "total_requests": stats["total_requests"],
+        "peak_rss_mb": round(result["peak_rss_mb"], 1),
+        "requests": stats["requests"],
+        "injected_faults": stats["injected"],
+    }
+
+
+def check_scenario(operation, entities, updates, stats):
+    """Returns what the run failed to do according to the fake servers, empty if every entity was migrated."""
+    problems = []
+    if operation == "1":
+        if stats["files_written"] != entities:
+            problems.append(f"{stats['files_written']} files written to GitHub, expected {entities}")
+        missing = set(stats["repos_written"]) - set(stats["repos_with_pull_request"])
+        if missing:
+            problems.append(f"no pull request for {', '.join(sorted(missing))}")
+    elif stats["updates"] != updates:
+        problems.append(f"{stats['updates']} git metadata updates, expected {updates}")
+    return problems
+
+
+def run_child(scenario):
+    """Runs one operation of the tool in this process and writes its duration and peak RSS to the result file."""
+    sys.path.insert(0, SRC)
+    from context import Context
+    import log
+    import main
+
+    Context.account_id = "bench"
+    Context.api_key = "bench-api-key"
+    Context.git_token = "bench-git-token"
+    Context.git_provider = "github"
+    Context.git_domain = scenario["url"]
+    Context.harness_url = scenario["url"]
+    for key, value in scenario["context"].items():
+        if not hasattr(Context, key):
+            raise ValueError(f"Unknown Context attribute: {key}")
+        setattr(Context, key, value)
+
+    started = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        log.setup_logging()
+        # Errors also go to a file, which the runner shows if the scenario didn't complete
+        errors = logging.FileHandler(scenario["errors"])
+        errors.setLevel(logging.ERROR)
+        errors.setFormatter(log.EventFormatter(json_format=False))
+        logging.getLogger("gitx").addHandler(errors)
+        if scenario["operation"] == "1":
+            main.handle_operation_1(scenario["entity_type"], "default", "bench")
+        else:
+            main.handle_operation_2(scenario["entity_type"], "default", "bench")
+    seconds = time.perf_counter() - started
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    peak_rss_mb = peak_rss / (1024 * 1024) if sys.platform == "darwin" else peak_rss / 1024
+    with open(scenario["result"], "w") as file:
+        json.dump({"seconds": seconds, "peak_rss_mb": peak_rss_mb}, file)
+
+
+def print_results(results):
+    print(f"{'type':<9} {'op':>2} {'entities':>8} {'seconds':>9} {'entities/s':>10} {'requests':>9} {'peak RSS MB':>11}  faults")
+    for result in results:
+        faults = ", ".join(f"{name}={count}" for name, count in result["injected_faults"].items() if count) or "-"
+        print(f"{result['entity_type']:<9} {result['operation']:>2} {result['entities']:>8} {result['seconds']:>9} "
+              f"{result['entities_per_second']:>10} {result['total_requests']:>9} {result['peak_rss_mb']:>11}  {faults}")
+
+
+def find_regressions(results, baseline, tolerance):
+    regressions = []
+    previous = {(result["entity_type"], result["operation"], result["size"]): result for result in baseline}
+    for result in results:
+        before = previous.get((result["entity_type"], result["operation"], result["size"]))
+        if before is None:
+            continue
+        name = f"{result['entity_type']} operation-{result['operation']} {result['size']} entities"
+        if result["entities_per_second"] < before["entities_per_second"] * (1 - tolerance):
+            regressions.append(f"{name}: {result['entities_per_second']} entities/s, was {before['entities_per_second']}")
+        if result["peak_rss_mb"] > before["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(f"{name}: peak RSS {result['peak_rss_mb']} MB, was {before['peak_rss_mb']}")
+        if result["total_requests"] > before["total_requests"] * (1 + tolerance):
+            regressions.append(f"{name}: {result['total_requests']} requests, was {before['total_requests']}")
+    return regressions
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.child is not None:
+        run_child(json.loads(args.child))
+        sys.exit(0)
+
+    results = []
+    for size in [int(size) for size in args.sizes.split(",")]:
+        for operation in args.operations.split(","):
+            print(f"Running operation-{operation} on {size} {args.entity_type} entities...", flush=True)
+            results.append(run_scenario(args, size, operation.strip()))
+    print_results(results)
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            regressions = find_regressions(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print("Regression: " + regression)
+        if regressions:
+            sys.exit(1)
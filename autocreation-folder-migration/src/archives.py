@@ -0,0 +1,108 @@
+import tarfile
+import tempfile
+import threading
+
+import requests
+
+import github
+import log
+from context import Context
+from git import is_github
+from github_scheduler import get_scheduler
+from utility import get_repo_url, get_yaml_store, is_empty
+
+YAML_EXTENSIONS = (".yaml", ".yml")
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+_archives = {}
+_archive_locks = {}
+_archives_lock = threading.Lock()
+
+logger = log.get_logger("archives")
+
+
+def read_archived_file(git_details):
+    """Returns the content of the entity's file read from its repo archive, or None if it has to come from Harness.
+
+    Only used with Context.fetch_mode "archive". Every repo and branch is downloaded once as a tarball, the entity
+    is looked up by the filePath of its git details. The YAMLs of the archives are kept in the temporary file of the
+    YAML store, only their paths and offsets stay in memory.
+    """
+    if Context.fetch_mode != "archive" or not git_details or is_empty(git_details.get('filePath')):
+        return None
+    repo = git_details.get('repoName')
+    repo_url = git_details.get('repoUrl') or get_repo_url(git_details.get('fileUrl') or "", repo or "")
+    if is_empty(repo) or is_empty(repo_url) or not is_github(repo_url):
+        return None
+    files = get_archive(repo, repo_url, git_details.get('branch'))
+    if files is None:
+        return None
+    file_path = git_details['filePath'].lstrip("/")
+    ref = files.get(file_path)
+    if ref is None:
+        logger.info("File not found in the archive, fetching it from Harness", repo=repo, file_path=file_path)
+        return None
+    return get_yaml_store().read(ref)
+
+
+def get_archive(repo, repo_url, branch):
+    """Returns the path -> YamlRef map of the YAML files of the repo's branch, downloading it on first use."""
+    key = (github.repository_key(repo, repo_url), branch)
+    with _archives_lock:
+        lock = _archive_locks.setdefault(key, threading.Lock())
+    # Workers asking for the same repo wait for the first download instead of starting their own
+    with lock:
+        if key not in _archives:
+            try:
+                _archives[key] = download_archive(repo, repo_url, branch)
+            except Exception:
+                # Cached as well, the entities of the repo are fetched from Harness instead of downloading it again
+                logger.exception("Failed to read the archive", repo=repo, ref=branch)
+                _archives[key] = None
+        return _archives[key]
+
+
+def download_archive(repo, repo_url, branch):
+    repository = github.get_repository(Context.git_token, repo, repo_url)
+    if repository is None:
+        return None
+    ref = branch if not is_empty(branch) else repository.default_branch
+    url = f"{github.get_github_url()}/repos/{repository.owner}/{repository.name}/tarball/{ref}"
+    logger.info("Downloading the archive", repo=repo, ref=ref)
+    response = get_scheduler(Context.git_token).request("GET", url, stream=True)
+    if response.status_code != 200:
+        logger.error("Failed to download the archive", repo=repo, ref=ref, status=response.status_code)
+        logger.payload("Archive download error", response.text, sample=False, repo=repo)
+        return None
+    # The tarball goes to a temporary file as it arrives, so that a large repo is never held in memory
+    with response, tempfile.TemporaryFile(dir=Context.spill_dir or None) as archive:
+        try:
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                archive.write(chunk)
+            size = archive.tell()
+            archive.seek(0)
+            files = read_yaml_files(archive)
+        except (requests.exceptions.RequestException, tarfile.TarError, EOFError, OSError, ValueError) as ex:
+            logger.error("Failed to read the archive", repo=repo, ref=ref, error=str(ex))
+            return None
+    logger.info("Read the archive", repo=repo, ref=ref, yaml_files=len(files), size_bytes=size)
+    return files
+
+
+def read_yaml_files(archive):
+    # GitHub tarballs wrap the tree in a single "<owner>-<repo>-<sha>/" folder
+    files = {}
+    store = get_yaml_store()
+    with tarfile.open(fileobj=archive, mode="r|gz") as tar:
+        for member in tar:
+            if not member.isfile() or not member.name.endswith(YAML_EXTENSIONS):
+                continue
+            path = member.name.split("/", 1)[1] if "/" in member.name else member.name
+            try:
+                content = tar.extractfile(member).read().decode("utf-8")
+            except UnicodeDecodeError:
+                # Left out of the archive, an entity stored in this file is fetched from Harness
+                logger.warning("Skipping a file of the archive that isn't UTF-8", file_path=path)
+                continue
+            files[path] = store.write(content)
+    return files
@@ -0,0 +1,399 @@
+import asyncio
+import json
+import time
+
+import aiohttp
+
+import updates
+from context import Context
+from git import PR_TITLE, get_commit_message, is_github
+import github
+import journal
+import listing_cache
+import log
+import metrics
+from github_scheduler import get_scheduler
+from entities import ENTITY_SPECS
+from harness_client import get_retry_policy, page_count, route
+from updates import Update
+from utility import is_inline, report_fan_out, report_inline
+
+logger = log.get_logger("async_engine")
+
+
+class AsyncResponse:
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class AsyncEngine:
+    """Runs operation 1 and operation 2 as coroutines over a single aiohttp session."""
+
+    def __init__(self, session, api_key, git_token):
+        self.session = session
+        # One bounded queue and committer task per repo, shared by every scope of the run
+        self.fetch_slots = asyncio.Semaphore(Context.queue_depth)
+        self.repo_queues = {}
+        self.committers = []
+        self.github_scheduler = get_scheduler(git_token)
+        self.harness_headers = {
+            "Content-Type": "application/json",
+            "x-api-key": api_key  # API Key for authentication
+        }
+        self.github_headers = {
+            "Authorization": f"token {git_token}",
+            "Accept": "application/vnd.github.v3+json"
+        }
+
+    async def harness(self, request):
+        # Same retry policy and retry budget as the sync client
+        url = Context.harness_url.rstrip("/") + route(request.path)
+        retry_policy = get_retry_policy()
+        endpoint = metrics.harness_endpoint(request.path)
+        attempt = 0
+        while True:
+            retry_policy.record_request()
+            started = time.monotonic()
+            try:
+                async with self.session.request(request.method, url, params=clean_params(request.params), json=request.json,
+                                                headers=self.harness_headers) as response:
+                    body = await response.read()
+                    result = AsyncResponse(response.status, body.decode(response.get_encoding()))
+                    retry_after = response.headers.get("Retry-After")
+                duration = time.monotonic() - started
+                metrics.record(endpoint, result.status_code, duration, json_size(request.json), len(body),
+                               retry=attempt > 0)
+                logger.debug("Harness call", endpoint=endpoint, method=request.method, status=result.status_code,
+                             duration_ms=round(duration * 1000, 1), attempt=attempt)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
+                metrics.record(endpoint, "error", time.monotonic() - started, retry=attempt > 0)
+                delay = retry_policy.retry_delay(request.idempotent, attempt,
+                                                 connect_error=isinstance(ex, aiohttp.ClientConnectorError))
+                if delay is None:
+                    raise
+                logger.warning("Harness call failed, retrying", endpoint=endpoint, method=request.method,
+                               error=repr(ex), attempt=attempt, retry_in_s=round(delay, 1))
+            else:
+                delay = retry_policy.retry_delay(request.idempotent, attempt, result.status_code, retry_after)
+                if delay is None:
+                    return result
+                logger.warning("Harness call returned a retryable status", endpoint=endpoint, method=request.method,
+                               status=result.status_code, attempt=attempt, retry_in_s=round(delay, 1))
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def github(self, method, url, params=None, json=None):
+        # Paced and retried by the same scheduler as the sync GitHub calls
+        scheduler = self.github_scheduler
+        endpoint = metrics.github_endpoint(method, url)
+        for attempt in range(scheduler.max_attempts):
+            await asyncio.sleep(scheduler.reserve(method))
+            started = time.monotonic()
+            try:
+                async with self.session.request(method, url, params=clean_params(params), json=json,
+                                                headers=self.github_headers) as response:
+                    body = await response.read()
+                    result = AsyncResponse(response.status, body.decode(response.get_encoding()))
+                    delay = scheduler.observe(method, response.status, response.headers, result.text, attempt)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                metrics.record(endpoint, "error", time.monotonic() - started, retry=attempt > 0)
+                raise
+            duration = time.monotonic() - started
+            metrics.record(endpoint, result.status_code, duration, json_size(json), len(body), retry=attempt > 0)
+            logger.debug("GitHub call", endpoint=endpoint, method=method, status=result.status_code,
+                         duration_ms=round(duration * 1000, 1), attempt=attempt)
+            if delay is None:
+                return result
+            logger.warning("GitHub rate limit hit, retrying", endpoint=endpoint, method=method,
+                           status=result.status_code, attempt=attempt, retry_in_s=round(delay))
+        return result
+
+    async def list_all(self, request):
+        """Reads the page count from the first page and fetches the remaining pages concurrently.
+
+        Returns (items, error_response) like HarnessClient.list_all, error_response being None if every page was read.
+        """
+        response = await self.harness(request.with_page(0))
+        responses = [response]
+        if response.status_code == 200:
+            total_pages = page_count(response.json()['data'])
+            if total_pages is None:
+                page = 1
+                while response.status_code == 200 and len(response.json()['data']['content']) > 0:
+                    response = await self.harness(request.with_page(page))
+                    responses.append(response)
+                    page += 1
+            else:
+                responses.extend(await asyncio.gather(*[self.harness(request.with_page(page))
+                                                        for page in range(1, total_pages)]))
+        items = []
+        for response in responses:
+            if response.status_code != 200:
+                logger.failed("Failed to list", response, endpoint=metrics.harness_endpoint(request.path),
+                              listed=len(items))
+                return items, response
+            items.extend(response.json()['data']['content'])
+        return items, None
+
+    async def list_scope(self, spec, scope):
+        """Lists the entities of a scope through the listing cache shared with the sync engine."""
+        key = listing_cache.get_key(spec.entity_type, *scope)
+        items = listing_cache.get_listing(key)
+        if items is None:
+            items, error = await self.list_all(spec.list_request(scope, None))
+            if error is None:
+                listing_cache.store_listing(key, items)
+        return items
+
+    async def list_children(self, spec, scope, parent):
+        items, _ = await self.list_all(spec.list_request(scope, parent))
+        return items
+
+    async def list_entities(self, spec, scope):
+        """Yields (parent, entity) pairs, listing the children of every parent concurrently.
+
+        The children of a parent are yielded as soon as its listing returns, so that their details are fetched while
+        the other parents are still being listed.
+        """
+        if spec.parent is None:
+            for element in await self.list_scope(spec, scope):
+                yield None, spec.unwrap(element)
+            return
+        parent_spec = ENTITY_SPECS[spec.parent]
+        parents = [parent_spec.unwrap(element) for element in await self.list_scope(parent_spec, scope)]
+
+        async def list_parent(parent):
+            return parent, await self.list_children(spec, scope, parent)
+
+        child_counts = []
+        for listing in asyncio.as_completed([list_parent(parent) for parent in parents]):
+            parent, elements = await listing
+            child_counts.append(len(elements))
+            for element in elements:
+                yield parent, spec.unwrap(element)
+        report_fan_out(child_counts, parent_spec.entity_type.lower() + "s", spec.entity_type.lower() + "s")
+
+    async def process_entity(self, spec, scope, parent, entity):
+        if journal.is_done(1, spec.target_file_path(scope, parent, entity)):
+            return None
+        try:
+            if Context.fetch_mode == "archive":
+                # Archives are downloaded by the blocking GitHub client, once per repo, off the event loop
+                details = await asyncio.get_running_loop().run_in_executor(None, spec.archived_details, parent, entity)
+                if details is not None:
+                    return spec.build_entity(scope, parent, entity, details)
+            response = await self.harness(spec.details_request(scope, parent, entity))
+            if response.status_code != 200:
+                logger.failed("Failed to fetch entity details", response, entity_type=spec.entity_type,
+                              entity=entity['identifier'])
+                return None
+            return spec.build_entity(scope, parent, entity, response.json())
+        except Exception:
+            logger.exception("Failed to process entity", entity_type=spec.entity_type, entity=entity['identifier'])
+        return None
+
+    async def send_steps(self, steps):
+        """Async github.send_steps, the GitHub calls of steps are sent through self.github."""
+        response = None
+        try:
+            while True:
+                method, url, kwargs = steps.send(response)
+                response = await self.github(method, url, **kwargs)
+        except StopIteration as stop:
+            return stop.value
+
+    async def migrate_repo(self, repo, repo_url, branch, queue):
+        # Contents API commits on one branch have to be sequential, different repos progress independently.
+        # The queue holds (entity_type, entity_data) pairs and is always drained until its None sentinel, even if
+        # the repo can't be migrated, so that producers blocked on it are released.
+        repository = None
+        forked = False
+        try:
+            repository = await self.send_steps(github.repository_steps(repo, repo_url))
+            if repository is not None:
+                forked = journal.repo_state(repo, repo_url, branch) is not None
+                if not forked and await self.send_steps(github.branch_steps(repository, branch)):
+                    journal.record_repo(repo, repo_url, branch, journal.FORKED)
+                    forked = True
+        except Exception:
+            logger.exception("Failed to fork the repo", repo=repo)
+        if repository is not None and not forked:
+            # Nothing can be committed without the branch, its files are dropped and it gets no pull request
+            logger.error("Skipping the repo, its branch couldn't be created", repo=repo, branch=branch)
+            repository = None
+        batch = []
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            if repository is None:
+                continue
+            try:
+                if Context.commit_mode == "batch":
+                    batch.append(item)
+                    if len(batch) >= Context.commit_batch_size:
+                        await self.commit_batch(repository, branch, batch)
+                        batch = []
+                else:
+                    entity_type, entity_data = item
+                    steps = github.commit_file_steps(repository, branch, entity_data.target_file_path,
+                                                     get_commit_message(), entity_data.yaml)
+                    if await self.send_steps(steps) is not None:
+                        journal.record_migration(entity_type, entity_data, journal.COMMITTED)
+            except Exception:
+                logger.exception("Failed to commit", repo=repo)
+        if repository is None:
+            return
+        try:
+            if len(batch) > 0:
+                await self.commit_batch(repository, branch, batch)
+            if journal.repo_state(repo, repo_url, branch) != journal.PR_RAISED:
+                if await self.send_steps(github.pull_request_steps(repository, branch, PR_TITLE, PR_TITLE)):
+                    journal.record_repo(repo, repo_url, branch, journal.PR_RAISED)
+        except Exception:
+            logger.exception("Failed to raise the pull request", repo=repo)
+
+    async def commit_batch(self, repository, branch, batch):
+        files = [(entity_data.target_file_path, entity_data.yaml) for entity_type, entity_data in batch]
+        steps = github.commit_files_steps(repository, branch, files, get_commit_message())
+        if await self.send_steps(steps) is not None:
+            for entity_type, entity_data in batch:
+                journal.record_migration(entity_type, entity_data, journal.COMMITTED)
+
+    def add_committer(self, repo, repo_url, branch):
+        queue = self.repo_queues[(repo, repo_url)] = asyncio.Queue(maxsize=Context.queue_depth)
+        self.committers.append(asyncio.create_task(self.migrate_repo(repo, repo_url, branch, queue)))
+        return queue
+
+    async def stream_entities(self, spec, scope, branch):
+        """Streams entities from the detail fetches to one committer per repo through bounded queues.
+
+        A fetch slot is held until its entity is queued, so at most Context.queue_depth entities are being fetched
+        or waiting for a full queue, and every repo queue holds at most Context.queue_depth more.
+        """
+        async def fetch(parent, entity):
+            async with self.fetch_slots:
+                entity_data = await self.process_entity(spec, scope, parent, entity)
+                if entity_data is None or not is_github(entity_data.repo_url):
+                    return
+                journal.record_migration(spec.entity_type, entity_data, journal.FETCHED)
+                queue = self.repo_queues.get((entity_data.repo, entity_data.repo_url))
+                if queue is None:
+                    queue = self.add_committer(entity_data.repo, entity_data.repo_url, branch)
+                await queue.put((spec.entity_type, entity_data))
+
+        fetches = []
+        inline = 0
+        async for parent, entity in self.list_entities(spec, scope):
+            if is_inline(entity):
+                inline += 1
+                continue
+            fetches.append(asyncio.create_task(fetch(parent, entity)))
+        report_inline(inline, spec.entity_type.lower() + "s")
+        await asyncio.gather(*fetches)
+
+    async def close_repos(self, branch):
+        # Lets every committer flush its last batch and raise its pull request. Repos forked by a resumed run that got
+        # nothing new to commit still get a committer, to raise the pull request the interrupted run didn't.
+        for repo, repo_url, _ in journal.journaled_repos():
+            if (repo, repo_url) not in self.repo_queues:
+                self.add_committer(repo, repo_url, branch)
+        for queue in self.repo_queues.values():
+            await queue.put(None)
+        await asyncio.gather(*self.committers)
+
+    async def operation_1(self, spec, scope, branch):
+        await self.stream_entities(spec, scope, branch)
+        await self.close_repos(branch)
+
+    async def update_entity(self, spec, scope, parent, entity):
+        if spec.skip_inline_update and entity['storeType'] == 'INLINE':
+            return
+        update = Update(spec.entity_type, scope[1], scope[2], entity['identifier'],
+                        spec.target_file_path(scope, parent, entity), spec.update_request(scope, parent, entity))
+        if not updates.start_update(update):
+            return
+        started = time.monotonic()
+        try:
+            response = await self.harness(update.request)
+            updates.finish_update(update, started, response.status_code, response.text)
+        except Exception as ex:
+            updates.finish_update(update, started, error=str(ex))
+
+    async def operation_2(self, spec, scope):
+        tasks = [asyncio.create_task(self.update_entity(spec, scope, parent, entity))
+                 async for parent, entity in self.list_entities(spec, scope)]
+        await asyncio.gather(*tasks)
+
+    async def crawl(self, operation, work, branch):
+        """Runs the operation for every (entity_type, org_id, project_id) of work, Context.scope_concurrency at a time."""
+        scope_slots = asyncio.Semaphore(Context.scope_concurrency)
+
+        async def migrate_scope(entity_type, org_id, project_id):
+            async with scope_slots:
+                logger.info("Processing scope", entity_type=entity_type, org=org_id, project=project_id)
+                scope = (Context.account_id, org_id, project_id)
+                try:
+                    if operation == 1:
+                        await self.stream_entities(ENTITY_SPECS[entity_type], scope, branch)
+                    else:
+                        await self.operation_2(ENTITY_SPECS[entity_type], scope)
+                except Exception:
+                    logger.exception("Scope failed", entity_type=entity_type, org=org_id, project=project_id)
+
+        await asyncio.gather(*[migrate_scope(*item) for item in work])
+        if operation == 1:
+            await self.close_repos(branch)
+
+
+def json_size(payload):
+    return 0 if payload is None else len(json.dumps(payload))
+
+
+def clean_params(params):
+    # aiohttp rejects None values in query params, requests silently drops them
+    if params is None:
+        return None
+    return {key: str(value) for key, value in params.items() if value is not None}
+
+
+def create_session():
+    connector = aiohttp.TCPConnector(limit=Context.async_connection_limit,
+                                     limit_per_host=Context.async_connections_per_host)
+    timeout = aiohttp.ClientTimeout(total=None, connect=Context.connect_timeout, sock_read=Context.read_timeout)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+async def run(operation, entity_type, org_id, project_id, branch=None):
+    spec = ENTITY_SPECS.get(entity_type)
+    if spec is None:
+        logger.error("Invalid entity type as input", entity_type=entity_type)
+        return
+    scope = (Context.account_id, org_id, project_id)
+    async with create_session() as session:
+        engine = AsyncEngine(session, Context.api_key, Context.git_token)
+        if operation == 1:
+            await engine.operation_1(spec, scope, branch)
+        else:
+            await engine.operation_2(spec, scope)
+
+
+async def run_crawl(operation, work, branch):
+    async with create_session() as session:
+        await AsyncEngine(session, Context.api_key, Context.git_token).crawl(operation, work, branch)
+
+
+def handle_operation_1(entity_type, org_id, project_id, branch):
+    asyncio.run(run(1, entity_type, org_id, project_id, branch))
+
+
+def handle_operation_2(entity_type, org_id, project_id):
+    asyncio.run(run(2, entity_type, org_id, project_id))
+
+
+def handle_crawl(operation, work, branch):
+    asyncio.run(run_crawl(operation, work, branch))
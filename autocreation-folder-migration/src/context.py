@@ -7,6 +7,55 @@ class Context:
     git_provider = ""
     api_key = ""
     git_domain = ""
+    harness_url = "https://app.harness.io"
+    pool_size = 20
+    page_size = 100
+    queue_depth = 100
+    journal_path = "gitx-journal.db"
+    listing_cache_dir = ""
+    listing_cache_ttl = 3600
+    report_path = "operation-2-report.json"
+    plan_dir = "gitx-plan"
+    shard_index = 0
+    shard_count = 1
+    metrics_path = "gitx-metrics.json"
+    metrics_prometheus_path = ""
+    metrics_interval = 0
+    log_level = "INFO"
+    log_format = "text"
+    log_file = ""
+    log_sample_rate = 0.01
+    resume = False
+    commit_batch_size = 500
+    commit_max_bytes = 0
+    pr_max_files = 0
+    pr_max_bytes = 0
+    spill_yaml = False
+    spill_dir = ""
+    tree_snapshot = False
+    connect_timeout = 10
+    read_timeout = 60
+    concurrency = 1
+    scope_concurrency = 4
+    repo_concurrency = 4
+    engine = "sync"
+    commit_mode = "file"
+    fetch_mode = "api"
+    git_backend = "rest"
+    clone_dir = "gitx-clones"
+    git_username = "x-access-token"
+    git_author_name = "Harness GitX Migration"
+    git_author_email = "gitx-migration@harness.io"
+    harness_max_attempts = 5
+    harness_retry_base_delay = 0.5
+    harness_retry_max_delay = 30.0
+    harness_retry_budget_ratio = 0.2
+    harness_retry_budget_min = 100
+    harness_retry_budget_cap = 1000
+    github_max_attempts = 8
+    github_write_interval = 0.0
+    async_connection_limit = 200
+    async_connections_per_host = 100
 
     @staticmethod
     def init():
@@ -18,3 +67,49 @@ class Context:
             Context.git_provider = data['git-provider']
             Context.api_key = data['harness-api-key']
             Context.git_domain = data['git-domain']
+            Context.harness_url = data.get('harness-url', Context.harness_url)
+            Context.pool_size = int(data.get('pool-size', Context.pool_size))
+            Context.page_size = int(data.get('page-size', Context.page_size))
+            Context.queue_depth = int(data.get('queue-depth', Context.queue_depth))
+            Context.journal_path = data.get('journal-path', Context.journal_path)
+            Context.listing_cache_dir = data.get('listing-cache-dir', Context.listing_cache_dir)
+            Context.listing_cache_ttl = float(data.get('listing-cache-ttl', Context.listing_cache_ttl))
+            Context.report_path = data.get('report-path', Context.report_path)
+            Context.plan_dir = data.get('plan-dir', Context.plan_dir)
+            Context.metrics_path = data.get('metrics-path', Context.metrics_path)
+            Context.metrics_prometheus_path = data.get('metrics-prometheus-path', Context.metrics_prometheus_path)
+            Context.metrics_interval = float(data.get('metrics-interval', Context.metrics_interval))
+            Context.log_level = data.get('log-level', Context.log_level)
+            Context.log_format = data.get('log-format', Context.log_format)
+            Context.log_file = data.get('log-file', Context.log_file)
+            Context.log_sample_rate = float(data.get('log-sample-rate', Context.log_sample_rate))
+            Context.commit_batch_size = int(data.get('commit-batch-size', Context.commit_batch_size))
+            Context.commit_max_bytes = int(data.get('commit-max-bytes', Context.commit_max_bytes))
+            Context.pr_max_files = int(data.get('pr-max-files', Context.pr_max_files))
+            Context.pr_max_bytes = int(data.get('pr-max-bytes', Context.pr_max_bytes))
+            Context.spill_yaml = bool(data.get('spill-yaml', Context.spill_yaml))
+            Context.spill_dir = data.get('spill-dir', Context.spill_dir)
+            Context.tree_snapshot = bool(data.get('tree-snapshot', Context.tree_snapshot))
+            Context.connect_timeout = float(data.get('connect-timeout', Context.connect_timeout))
+            Context.read_timeout = float(data.get('read-timeout', Context.read_timeout))
+            Context.concurrency = int(data.get('concurrency', Context.concurrency))
+            Context.scope_concurrency = int(data.get('scope-concurrency', Context.scope_concurrency))
+            Context.repo_concurrency = int(data.get('repo-concurrency', Context.repo_concurrency))
+            Context.engine = data.get('engine', Context.engine)
+            Context.commit_mode = data.get('commit-mode', Context.commit_mode)
+            Context.fetch_mode = data.get('fetch-mode', Context.fetch_mode)
+            Context.git_backend = data.get('git-backend', Context.git_backend)
+            Context.clone_dir = data.get('clone-dir', Context.clone_dir)
+            Context.git_username = data.get('git-username', Context.git_username)
+            Context.git_author_name = data.get('git-author-name', Context.git_author_name)
+            Context.git_author_email = data.get('git-author-email', Context.git_author_email)
+            Context.harness_max_attempts = int(data.get('harness-max-attempts', Context.harness_max_attempts))
+            Context.harness_retry_base_delay = float(data.get('harness-retry-base-delay', Context.harness_retry_base_delay))
+            Context.harness_retry_max_delay = float(data.get('harness-retry-max-delay', Context.harness_retry_max_delay))
+            Context.harness_retry_budget_ratio = float(data.get('harness-retry-budget-ratio', Context.harness_retry_budget_ratio))
+            Context.harness_retry_budget_min = int(data.get('harness-retry-budget-min', Context.harness_retry_budget_min))
+            Context.harness_retry_budget_cap = int(data.get('harness-retry-budget-cap', Context.harness_retry_budget_cap))
+            Context.github_max_attempts = int(data.get('github-max-attempts', Context.github_max_attempts))
+            Context.github_write_interval = float(data.get('github-write-interval', Context.github_write_interval))
+            Context.async_connection_limit = int(data.get('async-connection-limit', Context.async_connection_limit))
+            Context.async_connections_per_host = int(data.get('async-connections-per-host', Context.async_connections_per_host))
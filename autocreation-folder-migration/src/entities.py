@@ -0,0 +1,94 @@
+import environments
+import infras
+import inputsets
+import pipelines
+import services
+import templates
+
+
+class EntitySpec:
+    """How one entity type is listed, fetched, built and updated, for the async engine and the plan commands.
+
+    Every callable receives the scope as an (account_id, org_id, project_id) tuple and the unwrapped parent
+    entity (the pipeline of an input set, the environment of an infra), which is None for top level entities.
+    """
+
+    def __init__(self, entity_type, list_request, unwrap, details_request, build_entity, update_request,
+                 target_file_path, archived_details, parent=None, skip_inline_update=True):
+        self.entity_type = entity_type
+        self.list_request = list_request
+        self.unwrap = unwrap
+        self.details_request = details_request
+        self.build_entity = build_entity
+        self.update_request = update_request
+        self.target_file_path = target_file_path
+        self.archived_details = archived_details
+        self.parent = parent
+        self.skip_inline_update = skip_inline_update
+
+
+ENTITY_SPECS = {
+    "PIPELINE": EntitySpec(
+        entity_type="PIPELINE",
+        list_request=lambda scope, parent: pipelines.list_pipelines_request(*scope),
+        unwrap=lambda element: element,
+        details_request=lambda scope, parent, pipeline: pipelines.pipeline_details_request(*scope, pipeline['identifier']),
+        build_entity=lambda scope, parent, pipeline, details: pipelines.build_pipeline_entity(*scope, pipeline, details),
+        update_request=lambda scope, parent, pipeline: pipelines.update_pipeline_git_metadata_request(*scope, pipeline['identifier']),
+        target_file_path=lambda scope, parent, pipeline: pipelines.get_target_file_path(*scope[1:], pipeline['identifier']),
+        archived_details=lambda parent, pipeline: pipelines.read_pipeline_details(pipeline)
+    ),
+    "INPUTSET": EntitySpec(
+        entity_type="INPUTSET",
+        list_request=lambda scope, pipeline: inputsets.list_input_sets_request(*scope, pipeline['identifier']),
+        unwrap=lambda element: element,
+        details_request=lambda scope, pipeline, input_set: inputsets.input_set_details_request(*scope, pipeline['identifier'], input_set['identifier']),
+        build_entity=lambda scope, pipeline, input_set, details: inputsets.build_input_set_entity(*scope, pipeline, details),
+        update_request=lambda scope, pipeline, input_set: inputsets.update_input_set_git_metadata_request(*scope, pipeline['identifier'], input_set['identifier']),
+        target_file_path=lambda scope, pipeline, input_set: inputsets.get_target_file_path(*scope[1:], pipeline['identifier'], input_set['identifier']),
+        archived_details=lambda parent, input_set: inputsets.read_input_set_details(input_set),
+        parent="PIPELINE",
+        skip_inline_update=False
+    ),
+    "TEMPLATE": EntitySpec(
+        entity_type="TEMPLATE",
+        list_request=lambda scope, parent: templates.list_templates_request(*scope),
+        unwrap=lambda element: element,
+        details_request=lambda scope, parent, template: templates.template_details_request(*scope, template['identifier'], template['versionLabel']),
+        build_entity=lambda scope, parent, template, details: templates.build_template_entity(*scope, template, details),
+        update_request=lambda scope, parent, template: templates.update_template_git_metadata_request(*scope, template['identifier'], template['versionLabel']),
+        target_file_path=lambda scope, parent, template: templates.get_target_file_path(*scope[1:], template['identifier'], template['versionLabel']),
+        archived_details=lambda parent, template: templates.read_template_details(template)
+    ),
+    "SERVICE": EntitySpec(
+        entity_type="SERVICE",
+        list_request=lambda scope, parent: services.list_services_request(*scope),
+        unwrap=lambda element: element['service'],
+        details_request=lambda scope, parent, service: services.service_details_request(*scope, service['identifier']),
+        build_entity=lambda scope, parent, service, details: services.build_service_entity(*scope, service, details),
+        update_request=lambda scope, parent, service: services.update_service_git_metadata_request(*scope, service['identifier']),
+        target_file_path=lambda scope, parent, service: services.get_target_file_path(*scope[1:], service['identifier']),
+        archived_details=lambda parent, service: services.read_service_details(service)
+    ),
+    "ENV": EntitySpec(
+        entity_type="ENV",
+        list_request=lambda scope, parent: environments.list_environments_request(*scope),
+        unwrap=lambda element: element['environment'],
+        details_request=lambda scope, parent, env: environments.environment_details_request(*scope, env['identifier']),
+        build_entity=lambda scope, parent, env, details: environments.build_environment_entity(*scope, env, details),
+        update_request=lambda scope, parent, env: environments.update_environment_git_metadata_request(*scope, env['identifier'], env['type']),
+        target_file_path=lambda scope, parent, env: environments.get_target_file_path(*scope[1:], env['identifier'], env['type']),
+        archived_details=lambda parent, env: environments.read_environment_details(env)
+    ),
+    "INFRA": EntitySpec(
+        entity_type="INFRA",
+        list_request=lambda scope, env: infras.list_infras_request(*scope, env['identifier']),
+        unwrap=lambda element: element['infrastructure'],
+        details_request=lambda scope, env, infra: infras.infrastructure_details_request(*scope, env['identifier'], infra['identifier']),
+        build_entity=lambda scope, env, infra, details: infras.build_infra_entity(*scope, env, details),
+        update_request=lambda scope, env, infra: infras.update_infra_git_metadata_request(*scope, env['identifier'], env['type'], infra['identifier']),
+        target_file_path=lambda scope, env, infra: infras.get_target_file_path(*scope[1:], infra['identifier'], env['identifier'], env['type']),
+        archived_details=lambda parent, infra: infras.read_infra_details(infra),
+        parent="ENV"
+    )
+}
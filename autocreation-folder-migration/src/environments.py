@@ -1,110 +1,135 @@
-import requests
-from utility import EntityDetails, get_repo_url, is_empty
+import time
 
+import requests
+import log
+from context import Context
+from harness_client import HarnessRequest, get_client
+from utility import EntityDetails, get_repo_url, is_empty, imap_concurrently, skip_inline
+from archives import read_archived_file
+from journal import is_done
+from listing_cache import list_cached
+from updates import Update, run_updates
 
-def get_environments(api_key, account_id, org_id, project_id):
-    page = 0
-    headers = {
-        "Content-Type": "application/json",
-        "x-api-key": api_key  # API Key for authentication
-    }
-    envs = []
+logger = log.get_logger("environments")
 
-    while True:
-        url = f"https://app.harness.io/gateway/ng/api/environmentsV2?accountIdentifier={account_id}&orgIdentifier={org_id}&projectIdentifier={project_id}&page={page}"
-        response = requests.get(url, headers=headers)
 
-        if response.status_code == 200:
-            content = response.json()['data']['content']
-            if len(content) == 0:
-                return envs
-            envs.extend(response.json()['data']['content'])
-            page += 1
-        else:
-            return {"error": f"Failed to fetch environments: {response.status_code}", "details": response.text}
+def get_environments(api_key, account_id, org_id, project_id):
+    request = list_environments_request(account_id, org_id, project_id)
+    envs, error = list_cached(api_key, "ENV", account_id, org_id, project_id, request)
+    if error is not None:
+        logger.error("Failed to list environments", org=org_id, project=project_id, status=error.status_code,
+                     listed=len(envs))
+        logger.payload("Environment listing error", error.text, sample=False, status=error.status_code)
+    logger.info("Listed environments", org=org_id, project=project_id, count=len(envs))
+    logger.payload("Environment listing", envs, org=org_id, project=project_id)
+    return envs
 
 
 def fetch_environment_details(api_key, account_id, org_id, project_id, env_id):
-    url = f"https://app.harness.io/ng/api/environmentsV2/{env_id}"
-
-    params = {
-        "accountIdentifier": account_id,
-        "orgIdentifier": org_id,
-        "projectIdentifier": project_id
-    }
-
-    headers = {
-        "Content-Type": "application/json",
-        "x-api-key": api_key  # API Key for authentication
-    }
-
+    started = time.monotonic()
     try:
-        response = requests.get(url, headers=headers, params=params)
+        response = get_client(api_key).send(environment_details_request(account_id, org_id, project_id, env_id))
         response.raise_for_status()  # Raise an error for HTTP errors (4xx and 5xx)
+        logger.debug("Fetched environment details", entity=env_id, endpoint="environments.details",
+                     status=response.status_code, duration_ms=round((time.monotonic() - started) * 1000, 1))
         return response.json()
 
     except requests.exceptions.RequestException as e:
-        print(f"Error fetching environment details: {e}")
+        logger.error("Failed to fetch environment details", entity=env_id, endpoint="environments.details",
+                     error=str(e), duration_ms=round((time.monotonic() - started) * 1000, 1))
         return None
 
 
-def update_environment_git_metadata(api_key, account_id, org_id, project_id, env_id, env_type):
-    url = f"https://app.harness.io/gateway/ng/api/environmentsV2/{env_id}/update-git-metadata"
+def update_env_file_path(api_key, account_id, org_id, project_id):
+    env_list = get_environments(api_key, account_id, org_id, project_id)
+    updates = []
+    for element in env_list:
+        env = element['environment']
+        if env['storeType'] != 'INLINE':
+            updates.append(Update("ENV", org_id, project_id, env['identifier'],
+                                  get_target_file_path(org_id, project_id, env['identifier'], env['type']),
+                                  update_environment_git_metadata_request(account_id, org_id, project_id, env['identifier'], env['type'])))
+    run_updates(api_key, updates)
 
-    params = {
-        "accountIdentifier": account_id,
-        "orgIdentifier": org_id,
-        "projectIdentifier": project_id,
-        "filePath": get_target_file_path(org_id, project_id, env_id, env_type)
-    }
 
-    headers = {
-        "Content-Type": "application/json",
-        "x-api-key": api_key  # API Key for authentication
-    }
+def stream_environments(api_key, account_id, org_id, project_id):
+    env_list = get_environments(api_key, account_id, org_id, project_id)
+    entity_data_list = imap_concurrently(
+        lambda element: process_environment(api_key, account_id, org_id, project_id, element['environment']),
+        skip_inline(env_list, "environments", lambda element: element['environment']), Context.concurrency,
+        Context.queue_depth)
+    return (entity_data for entity_data in entity_data_list if entity_data is not None)
 
-    print(f"Updating env filepath : {params} for env id : {env_id}")
 
+def process_environment(api_key, account_id, org_id, project_id, env):
+    if is_done(1, get_target_file_path(org_id, project_id, env["identifier"], env['type'])):
+        return None
     try:
-        response = requests.put(url, headers=headers, params=params)
-        response.raise_for_status()  # Raise an error for HTTP errors (4xx and 5xx)
-        return response.json()
+        env_details = read_environment_details(env) or \
+            fetch_environment_details(api_key, account_id, org_id, project_id, env["identifier"])
+        if env_details is None:
+            return None
+        logger.payload("Environment details", env_details, entity=env["identifier"])
+        return build_environment_entity(account_id, org_id, project_id, env, env_details)
+    except Exception:
+        logger.exception("Failed to process environment", entity=env["identifier"])
+    return None
+
+
+def read_environment_details(env):
+    """Environment details with the YAML read from the repo archive, None if it has to be fetched from Harness."""
+    yaml = read_archived_file(env.get('entityGitDetails'))
+    if yaml is None:
+        return None
+    return {"data": {"environment": {"storeType": env['storeType'], "yaml": yaml,
+                                     "entityGitDetails": env['entityGitDetails']}}}
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error updating Git metadata: {e}")
+
+def build_environment_entity(account_id, org_id, project_id, env, env_details):
+    data = env_details['data']['environment']
+    if data['storeType'] == 'INLINE':
+        return None
+    entity_data = EntityDetails(account_id, org_id, project_id, env['identifier'], data['yaml'],
+                                data['entityGitDetails']['repoName'], get_repo_url(data['entityGitDetails']['fileUrl'], data['entityGitDetails']['repoName']))
+    entity_data.sub_type = env['type']
+    entity_data.target_file_path = get_target_file_path_from_entity(entity_data)
+    entity_data.source_file_path = data['entityGitDetails']['filePath']
+    entity_data.source_branch = data['entityGitDetails'].get('branch') or ""
+    if entity_data.target_file_path == entity_data.source_file_path:
+        logger.info("Ignoring the environment as it is already under the conventional file path",
+                    entity=env['identifier'], file_path=entity_data.target_file_path)
         return None
+    return entity_data
 
 
-def update_env_file_path(api_key, account_id, org_id, project_id):
-    env_list = get_environments(api_key, account_id, org_id, project_id)
-    for element in env_list:
-        env = element['environment']
-        if env['storeType'] != 'INLINE':
-            update_environment_git_metadata(api_key, account_id, org_id, project_id, env['identifier'], env['type'])
+def list_environments_request(account_id, org_id, project_id):
+    params = {
+        "accountIdentifier": account_id,
+        "orgIdentifier": org_id,
+        "projectIdentifier": project_id,
+        "page": 0,
+        "size": Context.page_size
+    }
+    return HarnessRequest("GET", "/ng/api/environmentsV2", params=params, page_param="page")
 
 
-def process_environments(api_key, account_id, org_id, project_id):
-    env_list = get_environments(api_key, account_id, org_id, project_id)
-    entity_data_list = []
-    for element in env_list:
-        env = element['environment']
-        try:
-            env_details = fetch_environment_details(api_key, account_id, org_id, project_id, env["identifier"])
-            print(env_details)
-            data = env_details['data']['environment']
-            if data['storeType'] != 'INLINE':
-                entity_data = EntityDetails(account_id, org_id, project_id, env['identifier'], data['yaml'],
-                                            data['entityGitDetails']['repoName'], get_repo_url(data['entityGitDetails']['fileUrl'], data['entityGitDetails']['repoName']))
-                entity_data.sub_type = env['type']
-                entity_data.target_file_path = get_target_file_path_from_entity(entity_data)
-                if entity_data.target_file_path == data['entityGitDetails']['filePath']:
-                    print("ignoring the env as its already under conventional filepath\nMetadata:" + str(
-                        env) + "\nDetails:" + str(data))
-                    continue
-                entity_data_list.append(entity_data)
-        except Exception as ex:
-            print(ex)
-    return entity_data_list
+def environment_details_request(account_id, org_id, project_id, env_id):
+    params = {
+        "accountIdentifier": account_id,
+        "orgIdentifier": org_id,
+        "projectIdentifier": project_id
+    }
+    return HarnessRequest("GET", f"/ng/api/environmentsV2/{env_id}", params=params)
+
+
+def update_environment_git_metadata_request(account_id, org_id, project_id, env_id, env_type):
+    params = {
+        "accountIdentifier": account_id,
+        "orgIdentifier": org_id,
+        "projectIdentifier": project_id,
+        "filePath": get_target_file_path(org_id, project_id, env_id, env_type)
+    }
+    return HarnessRequest("PUT", f"/ng/api/environmentsV2/{env_id}/update-git-metadata", params=params)
 
 
 def get_target_file_path_from_entity(entity_data):
@@ -1,20 +1,60 @@
+import re
+
 import github
+import local_git
+import log
+from context import Context
+
+PR_TITLE = "Harness auto-creation folder setup"
+# Subtree of .harness/ a shard of a repo is grouped by: a project, an org or the account level
+SHARD_PREFIX = re.compile(r"\.harness/(?:orgs/([^/]+)/(?:projects/([^/]+)/)?)?")
+
+logger = log.get_logger("git")
 
 
 def fork_branch(token, branch, repo, repo_url):
+    if is_local():
+        return local_git.create_branch(token, repo, branch, repo_url)
     if is_github(repo_url):
-        github.create_branch_from_default(token, repo, branch, repo_url)
+        return github.create_branch_from_default(token, repo, branch, repo_url)
 
 
 def commit_file(token, repo, branch, repo_url, file_path, file_content):
+    if is_local():
+        return local_git.write_files(token, repo, branch, repo_url, [(file_path, file_content)])
+    if is_github(repo_url):
+        return github.commit_file_to_github(token, repo, branch, file_path, get_commit_message(), file_content, repo_url)
+
+
+def commit_files(token, repo, branch, repo_url, files):
+    if is_local():
+        return local_git.write_files(token, repo, branch, repo_url, files)
     if is_github(repo_url):
-        github.commit_file_to_github(token, repo, branch, file_path, get_commit_message(), file_content, repo_url)
+        return github.commit_files_to_github(token, repo, branch, files, get_commit_message(), repo_url)
 
 
-def create_pull_request(token, repo, branch, repo_url):
-    PR_TITLE = "Harness auto-creation folder setup"
+def push_branch(token, repo, branch, repo_url):
+    """Returns True once the remote has the branch's files, False if there was nothing to push, None on failure.
+
+    The local backend only wrote the files to its clone, they reach the remote in a single push. The REST backends
+    committed them on the remote already.
+    """
+    if is_local():
+        return local_git.push_branch(token, repo, branch, repo_url, get_commit_message())
+    return True
+
+
+def create_pull_request(token, repo, branch, repo_url, title=PR_TITLE, body=PR_TITLE):
+    if is_local():
+        if not is_github(repo_url):
+            logger.info("Open a pull request from the pushed branch", branch=branch, repo_url=repo_url)
+            return {"branch": branch}
     if is_github(repo_url):
-        github.create_pull_request(token, repo, branch, PR_TITLE, PR_TITLE, repo_url)
+        return github.create_pull_request(token, repo, branch, title, body, repo_url)
+
+
+def is_local():
+    return Context.git_backend == "local"
 
 
 def is_github(repo_url):
@@ -25,3 +65,41 @@ def is_github(repo_url):
 
 def get_commit_message():
     return "Harness Commit"
+
+
+def is_sharded():
+    return Context.pr_max_files > 0 or Context.pr_max_bytes > 0
+
+
+def get_shard_prefix(file_path):
+    match = SHARD_PREFIX.match(file_path)
+    return match.group(0) if match else ""
+
+
+def get_shard_label(prefix):
+    # .harness/orgs/<org>/projects/<project>/ is labelled <org>-<project>, .harness/ at account level "account".
+    # Harness identifiers have no "-", which keeps the label and the part number separable in the branch name
+    match = SHARD_PREFIX.match(prefix)
+    scope_ids = [scope_id for scope_id in match.groups() if scope_id] if match else []
+    return "-".join(scope_ids) or "account"
+
+
+def get_shard_path(label):
+    if label == "account":
+        return ".harness/"
+    scope_ids = label.split("-")
+    if len(scope_ids) == 1:
+        return f".harness/orgs/{scope_ids[0]}/"
+    return f".harness/orgs/{scope_ids[0]}/projects/{scope_ids[1]}/"
+
+
+def get_shard_branch(branch, label, part):
+    return f"{branch}-{label}-{part}"
+
+
+def parse_shard_branch(branch, shard_branch):
+    """Returns the (label, part) of a shard branch of the run, None for the run's own branch."""
+    if not shard_branch.startswith(branch + "-"):
+        return None
+    label, part = shard_branch[len(branch) + 1:].rsplit("-", 1)
+    return label, int(part)
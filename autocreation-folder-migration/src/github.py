@@ -1,82 +1,209 @@
+import hashlib
+import threading
+from functools import lru_cache
 from urllib.parse import urlparse
 
-import requests
 import base64
+import log
 from context import Context
+from github_scheduler import get_scheduler
 
 
-def create_branch_from_default(github_token, repo, new_branch, repo_url):
-    owner = extract_owner_from_url(repo_url)
-    # API URL to fetch repo details (including default branch)
-    repo_url = f"{get_github_url()}/repos/{owner}/{repo}"
-
-    # Headers for authentication
-    headers = {
-        "Authorization": f"token {github_token}",
-        "Accept": "application/vnd.github.v3+json"
-    }
+class Repository:
+    """Metadata of a GitHub repository, resolved once per run and shared by fork, commit and PR."""
+
+    def __init__(self, owner, name, default_branch, head_sha):
+        self.owner = owner
+        self.name = name
+        self.default_branch = default_branch
+        self.head_sha = head_sha  # Head of the default branch when the repository was first resolved
+        self.branch_heads = {}  # Branch name -> head commit SHA for branches written during this run
+        self.commit_trees = {}  # Commit SHA -> tree SHA for commits created or read during this run
+        self.tree_indexes = {}  # Branch name -> {path: blob SHA} of its .harness folder, see get_tree_index
+
+
+HARNESS_FOLDER = ".harness"
+
+logger = log.get_logger("github")
+
+
+_repositories = {}
+_repositories_lock = threading.Lock()
 
-    # Step 1: Get the default branch of the repository
-    response = requests.get(repo_url, headers=headers)
 
+def get_repository(github_token, repo, repo_url):
+    """Returns the cached Repository for (domain, owner, repo), fetching it from GitHub on first use."""
+    return send_steps(github_token, repository_steps(repo, repo_url))
+
+
+def get_tree_index(github_token, repository, branch):
+    return send_steps(github_token, tree_index_steps(repository, branch))
+
+
+def send_steps(github_token, steps):
+    """Runs the GitHub calls of steps through the blocking scheduler and returns the result of steps.
+
+    The *_steps generators hold everything but the sending of the calls, so that the sync and async engines make the
+    same calls and share their state: they yield (method, url, kwargs) for every call and are sent its response.
+    """
+    scheduler = get_scheduler(github_token)
+    response = None
+    try:
+        while True:
+            method, url, kwargs = steps.send(response)
+            response = scheduler.request(method, url, **kwargs)
+    except StopIteration as stop:
+        return stop.value
+
+
+def repository_steps(repo, repo_url):
+    key = repository_key(repo, repo_url)
+    repository = cached_repository(key)
+    if repository is not None:
+        return repository
+    owner = key[1]
+
+    # Get the default branch of the repository
+    response = yield "GET", f"{get_github_url()}/repos/{owner}/{repo}", {}
+    if response.status_code != 200:
+        logger.failed("Failed to fetch the repository", response, repo=repo)
+        return None
+    default_branch = response.json()["default_branch"]
+
+    # Get the latest commit SHA of the default branch
+    response = yield "GET", f"{get_github_url()}/repos/{owner}/{repo}/git/ref/heads/{default_branch}", {}
     if response.status_code != 200:
-        return f"Error fetching repository details: {response.status_code}, {response.text}"
+        logger.failed("Failed to fetch the default branch", response, repo=repo, branch=default_branch)
+        return None
+    head_sha = response.json()["object"]["sha"]
+
+    return register_repository(key, Repository(owner, repo, default_branch, head_sha))
 
-    repo_data = response.json()
-    default_branch = repo_data["default_branch"]  # Get the default branch name
 
-    # Step 2: Get the latest commit SHA of the default branch
-    base_branch_url = f"{get_github_url()}/repos/{owner}/{repo}/git/ref/heads/{default_branch}"
-    response = requests.get(base_branch_url, headers=headers)
+def tree_index_steps(repository, branch):
+    """Returns the path -> blob SHA index of the branch's .harness folder, read once per repository and branch.
 
+    Returns None if the tree couldn't be read completely, callers then look the files up one by one.
+    """
+    if branch in repository.tree_indexes:
+        return repository.tree_indexes[branch]
+    trees_url = f"{get_github_url()}/repos/{repository.owner}/{repository.name}/git/trees"
+
+    # Only the .harness folder is read recursively, the rest of the repository can be arbitrarily large
+    index = None
+    response = yield "GET", f"{trees_url}/{branch}", {}
+    if response.status_code == 200:
+        folder_sha = find_tree_entry(response.json(), HARNESS_FOLDER)
+        if folder_sha is None:
+            index = {}
+        else:
+            response = yield "GET", f"{trees_url}/{folder_sha}", {"params": {"recursive": 1}}
+            if response.status_code == 200:
+                index = build_tree_index(HARNESS_FOLDER, response.json())
     if response.status_code != 200:
-        return f"Error fetching base branch: {response.status_code}, {response.text}"
+        logger.failed("Failed to read the tree", response, repo=repository.name, branch=branch)
+    repository.tree_indexes[branch] = index
+    return index
+
+
+def find_tree_entry(tree, path):
+    for entry in tree["tree"]:
+        if entry["path"] == path and entry["type"] == "tree":
+            return entry["sha"]
+    return None
+
+
+def build_tree_index(prefix, tree):
+    if tree.get("truncated"):
+        return None
+    return {prefix + "/" + entry["path"]: entry["sha"] for entry in tree["tree"] if entry["type"] == "blob"}
+
+
+def git_blob_sha(file_content):
+    """SHA of the git blob holding file_content, the same as `git hash-object` and the SHAs in GitHub trees."""
+    data = file_content.encode()
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def repository_key(repo, repo_url):
+    return get_github_url(), extract_owner_from_url(repo_url), repo
+
+
+def cached_repository(key):
+    with _repositories_lock:
+        return _repositories.get(key)
+
+
+def register_repository(key, repository):
+    # Keeps the first registered entry if two workers resolved the same repository at once
+    with _repositories_lock:
+        return _repositories.setdefault(key, repository)
 
-    latest_sha = response.json()["object"]["sha"]
 
-    # Step 3: Create the new branch
-    new_branch_url = f"{get_github_url()}/repos/{owner}/{repo}/git/refs"
+def create_branch_from_default(github_token, repo, new_branch, repo_url):
+    # Step 1: Get the default branch of the repository and its latest commit SHA
+    repository = get_repository(github_token, repo, repo_url)
+    if repository is None:
+        logger.error("Failed to resolve the repository", repo=repo)
+        return False
+
+    # Step 2: Create the new branch
+    return send_steps(github_token, branch_steps(repository, new_branch))
+
+
+def branch_steps(repository, new_branch):
+    new_branch_url = f"{get_github_url()}/repos/{repository.owner}/{repository.name}/git/refs"
     payload = {
         "ref": f"refs/heads/{new_branch}",
-        "sha": latest_sha
+        "sha": repository.head_sha
     }
 
-    response = requests.post(new_branch_url, json=payload, headers=headers)
+    response = yield "POST", new_branch_url, {"json": payload}
 
     if response.status_code == 201:
-        print(f"Branch '{new_branch}' created successfully from '{default_branch}' in {repo}!")
-    else:
-        print(f"Error creating branch: {response.status_code}, {response.text}")
+        repository.branch_heads[new_branch] = repository.head_sha
+        logger.info("✅ Branch created", repo=repository.name, branch=new_branch, base=repository.default_branch)
+        return True
+    logger.failed("Failed to create the branch", response, repo=repository.name, branch=new_branch)
+    return False
 
 
 def commit_file_to_github(github_token, repo, branch, file_path, commit_message, file_content, repo_url):
-    owner = extract_owner_from_url(repo_url)
     """
     Commits a file to a specific branch in a GitHub repository using the GitHub API.
 
     Args:
         github_token (str): GitHub personal access token
-        owner (str): Repository owner (username or organization)
         repo (str): Repository name
         branch (str): Target branch for the commit
         file_path (str): Path to the file in the repository
         commit_message (str): Commit message
         file_content (str): Content of the file as a string
+        repo_url (str): Repository URL, used to find the owner
 
     Returns:
-        dict: API response JSON or error message
+        dict: API response JSON, or None if the commit failed
     """
+    repository = get_repository(github_token, repo, repo_url)
+    if repository is None:
+        return None
+    return send_steps(github_token, commit_file_steps(repository, branch, file_path, commit_message, file_content))
 
-    # GitHub API URL for file operations
-    base_url = f"{get_github_url()}/repos/{owner}/{repo}/contents/{file_path}"
-
-    # Headers for authentication
-    headers = {"Authorization": f"token {github_token}"}
-
-    # Get the file SHA (needed if updating an existing file)
-    response = requests.get(base_url, headers=headers, params={"ref": branch})
 
-    file_sha = response.json().get("sha") if response.status_code == 200 else None
+def commit_file_steps(repository, branch, file_path, commit_message, file_content):
+    # GitHub API URL for file operations
+    base_url = f"{get_github_url()}/repos/{repository.owner}/{repository.name}/contents/{file_path}"
+
+    # Get the file SHA (needed if updating an existing file), from the branch's tree snapshot if there is one
+    index = (yield from tree_index_steps(repository, branch)) if Context.tree_snapshot else None
+    if index is not None:
+        file_sha = index.get(file_path)
+        if file_sha == git_blob_sha(file_content):
+            logger.info("✅ File already up to date", repo=repository.name, branch=branch, file_path=file_path)
+            return {"content": {"path": file_path, "sha": file_sha}}
+    else:
+        response = yield "GET", base_url, {"params": {"ref": branch}}
+        file_sha = response.json().get("sha") if response.status_code == 200 else None
 
     # Convert file content to Base64 (GitHub API requires this format)
     encoded_content = base64.b64encode(file_content.encode()).decode()
@@ -91,76 +218,148 @@ def commit_file_to_github(github_token, repo, branch, file_path, commit_message,
         data["sha"] = file_sha  # Required for updating existing files
 
     # Send PUT request to create or update the file
-    response = requests.put(base_url, headers=headers, json=data)
+    response = yield "PUT", base_url, {"json": data}
 
     if response.status_code in [200, 201]:
-        print({"status": "success", "message": f"✅ File '{file_path}' committed to '{branch}'"})
-    else:
-        print({"status": "error", "details": response.json()})
+        repository.branch_heads[branch] = response.json()["commit"]["sha"]
+        if index is not None:
+            index[file_path] = response.json()["content"]["sha"]
+        logger.info("✅ File committed", repo=repository.name, branch=branch, file_path=file_path,
+                    status=response.status_code)
+        return response.json()
+    logger.failed("Failed to commit the file", response, repo=repository.name, branch=branch, file_path=file_path)
+    return None
+
+
+def commit_files_to_github(github_token, repo, branch, files, commit_message, repo_url):
+    """
+    Commits several files to a branch as a single commit using the Git Data API.
+
+    Args:
+        github_token (str): GitHub personal access token
+        repo (str): Repository name
+        branch (str): Target branch for the commit
+        files (list): (file_path, file_content) tuples to write
+        commit_message (str): Commit message
+        repo_url (str): Repository URL, used to find the owner
+
+    Returns:
+        str: SHA of the new commit (of the branch head if every file was already up to date), or None if any step failed
+    """
+    repository = get_repository(github_token, repo, repo_url)
+    if repository is None:
+        return None
+    return send_steps(github_token, commit_files_steps(repository, branch, files, commit_message))
+
+
+def commit_files_steps(repository, branch, files, commit_message):
+    repo = repository.name
+    git_url = f"{get_github_url()}/repos/{repository.owner}/{repo}/git"
+
+    # Leave out the files whose content is already on the branch
+    index = (yield from tree_index_steps(repository, branch)) if Context.tree_snapshot else None
+    if index is not None:
+        files = [(file_path, file_content) for file_path, file_content in files
+                 if index.get(file_path) != git_blob_sha(file_content)]
+        if len(files) == 0:
+            logger.info("✅ All files already up to date", repo=repo, branch=branch)
+            return repository.branch_heads.get(branch, repository.head_sha)
+
+    # Step 1: Get the current head commit of the branch and its tree, unless this run already knows them
+    head_sha = repository.branch_heads.get(branch)
+    if head_sha is None:
+        response = yield "GET", f"{git_url}/ref/heads/{branch}", {}
+        if response.status_code != 200:
+            logger.failed("Failed to fetch the branch", response, repo=repo, branch=branch)
+            return None
+        head_sha = response.json()["object"]["sha"]
+
+    base_tree_sha = repository.commit_trees.get(head_sha)
+    if base_tree_sha is None:
+        response = yield "GET", f"{git_url}/commits/{head_sha}", {}
+        if response.status_code != 200:
+            logger.failed("Failed to fetch the head commit", response, repo=repo, branch=branch)
+            return None
+        base_tree_sha = response.json()["tree"]["sha"]
+        repository.commit_trees[head_sha] = base_tree_sha
+
+    # Step 2: Create one tree holding every file on top of the current tree, GitHub creates the blobs from the inline content
+    tree = [{"path": file_path, "mode": "100644", "type": "blob", "content": file_content} for file_path, file_content in files]
+    response = yield "POST", f"{git_url}/trees", {"json": {"base_tree": base_tree_sha, "tree": tree}}
+    if response.status_code != 201:
+        logger.failed("Failed to create the tree", response, repo=repo, branch=branch)
+        return None
+    tree_sha = response.json()["sha"]
+
+    # Step 3: Create the commit
+    response = yield "POST", f"{git_url}/commits", {
+        "json": {"message": commit_message, "tree": tree_sha, "parents": [head_sha]}}
+    if response.status_code != 201:
+        logger.failed("Failed to create the commit", response, repo=repo, branch=branch)
+        return None
+    commit_sha = response.json()["sha"]
+
+    # Step 4: Move the branch to the new commit
+    response = yield "PATCH", f"{git_url}/refs/heads/{branch}", {"json": {"sha": commit_sha}}
+    if response.status_code == 200:
+        repository.branch_heads[branch] = commit_sha
+        repository.commit_trees[commit_sha] = tree_sha
+        if index is not None:
+            index.update((file_path, git_blob_sha(file_content)) for file_path, file_content in files)
+        logger.info("✅ Files committed", repo=repo, branch=branch, files=len(files), commit=commit_sha)
+        return commit_sha
+    logger.failed("Failed to move the branch", response, repo=repo, branch=branch)
+    return None
 
 
 def create_pull_request(github_token, repo, feature_branch, pr_title, pr_body, repo_url):
-    owner = extract_owner_from_url(repo_url)
     """
     Creates a pull request on GitHub using the GitHub API.
 
     Args:
         github_token (str): GitHub personal access token
-        owner (str): Repository owner (username or organization)
         repo (str): Repository name
-        base_branch (str): Base branch for the PR (e.g., 'main')
-        head_branch (str): Head branch for the PR (e.g., 'feature-branch')
+        feature_branch (str): Head branch for the PR (e.g., 'feature-branch'), the base is the default branch
         pr_title (str): Title for the pull request
         pr_body (str): Body description for the pull request
+        repo_url (str): Repository URL, used to find the owner
 
     Returns:
-        dict: API response JSON or error message
+        dict: API response JSON, or None if the pull request couldn't be created
     """
 
-    repo_url = f"{get_github_url()}/repos/{owner}/{repo}"
-
-    # Headers for authentication
-    headers = {
-        "Authorization": f"token {github_token}",
-        "Accept": "application/vnd.github.v3+json"
-    }
-
     # Get the repository details to fetch the default branch
-    response = requests.get(repo_url, headers=headers)
-    if response.status_code != 200:
-        return {
-            "status": "error",
-            "details": response.json()
-        }
+    repository = get_repository(github_token, repo, repo_url)
+    if repository is None:
+        logger.error("Failed to resolve the repository", repo=repo)
+        return None
+    return send_steps(github_token, pull_request_steps(repository, feature_branch, pr_title, pr_body))
 
-    default_branch = response.json().get('default_branch')
 
+def pull_request_steps(repository, feature_branch, pr_title, pr_body):
     # GitHub API URL for creating a pull request
-    url = f"{get_github_url()}/repos/{owner}/{repo}/pulls"
-
-    # Headers for authentication
-    headers = {
-        "Authorization": f"token {github_token}",
-        "Accept": "application/vnd.github.v3+json"
-    }
+    url = f"{get_github_url()}/repos/{repository.owner}/{repository.name}/pulls"
 
     # Data to send in the request
     data = {
         "title": pr_title,
         "head": feature_branch,  # The feature or compare branch
-        "base": default_branch,  # The base branch (usually 'main' or 'master')
+        "base": repository.default_branch,  # The base branch (usually 'main' or 'master')
         "body": pr_body  # Optional: Add description for PR
     }
 
     # Send the POST request to create a PR
-    response = requests.post(url, headers=headers, json=data)
+    response = yield "POST", url, {"json": data}
 
     if response.status_code == 201:
-        print(f"✅ Pull Request created successfully!\nURL: {response.json()['html_url']}")
-    else:
-        print({"status": "error", "details": response.json()})
+        logger.info("✅ Pull request created", repo=repository.name, branch=feature_branch,
+                    url=response.json()['html_url'])
+        return response.json()
+    logger.failed("Failed to create the pull request", response, repo=repository.name, branch=feature_branch)
+    return None
 
 
+@lru_cache(maxsize=None)
 def extract_owner_from_url(repo_url):
     parsed_url = urlparse(repo_url)
 
@@ -0,0 +1,166 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import log
+import metrics
+from context import Context
+
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+MAX_WRITE_INTERVAL = 60.0
+SECONDARY_LIMIT_WAIT = 60.0
+MAX_SECONDARY_LIMIT_WAIT = 300.0
+
+logger = log.get_logger("github")
+
+
+class GitHubScheduler:
+    """Paces every GitHub call against the token's rate limit.
+
+    It reads X-RateLimit-* from every response and spreads the remaining budget over the time left until reset
+    once the budget runs low. It honours Retry-After and retries throttled calls instead of dropping them. Writes
+    are spaced by an interval that doubles on every secondary rate limit and decays again while writes succeed.
+    """
+
+    def __init__(self, github_token, pool_size, max_attempts, write_interval):
+        self.max_attempts = max_attempts
+        self.min_write_interval = write_interval
+        self.write_interval = write_interval
+        self.limit = None
+        self.remaining = None
+        self.reset_at = None  # Epoch seconds
+        self.blocked_until = 0.0  # Monotonic seconds
+        self.next_request_at = 0.0
+        self.next_write_at = 0.0
+        self.throttled = 0
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"token {github_token}",
+            "Accept": "application/vnd.github.v3+json"
+        })
+
+    def request(self, method, url, params=None, json=None, stream=False):
+        """Sends the call, waiting out and retrying rate limits. With stream the body of a 200 is left unread."""
+        response = None
+        endpoint = metrics.github_endpoint(method, url)
+        for attempt in range(self.max_attempts):
+            time.sleep(self.reserve(method))
+            started = time.monotonic()
+            try:
+                response = self.session.request(method, url, params=params, json=json, stream=stream,
+                                                timeout=(Context.connect_timeout, Context.read_timeout))
+            except requests.exceptions.RequestException:
+                metrics.record(endpoint, "error", time.monotonic() - started, retry=attempt > 0)
+                raise
+            duration = time.monotonic() - started
+            streamed = stream and response.status_code == 200
+            received = int(response.headers.get("Content-Length") or 0) if streamed else len(response.content)
+            metrics.record(endpoint, response.status_code, duration,
+                           len(response.request.body or b""), received, retry=attempt > 0)
+            logger.debug("GitHub call", endpoint=endpoint, method=method, status=response.status_code,
+                         duration_ms=round(duration * 1000, 1), attempt=attempt)
+            delay = self.observe(method, response.status_code, response.headers, "" if streamed else response.text,
+                                 attempt)
+            if delay is None:
+                return response
+            logger.warning("GitHub rate limit hit, retrying", endpoint=endpoint, method=method,
+                           status=response.status_code, attempt=attempt, retry_in_s=round(delay))
+        return response
+
+    def reserve(self, method):
+        """Returns how long the caller has to wait before sending, and books the slot."""
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.blocked_until, self.next_request_at)
+            if method in WRITE_METHODS:
+                start = max(start, self.next_write_at)
+                self.next_write_at = start + self.write_interval
+            self.next_request_at = start + self.pace_interval()
+            return start - now
+
+    def observe(self, method, status_code, headers, text, attempt):
+        """Records the rate limit headers of a response, returns the retry delay if it was throttled."""
+        with self.lock:
+            if headers.get("X-RateLimit-Remaining") is not None:
+                self.remaining = int(headers.get("X-RateLimit-Remaining"))
+            if headers.get("X-RateLimit-Limit") is not None:
+                self.limit = int(headers.get("X-RateLimit-Limit"))
+            if headers.get("X-RateLimit-Reset") is not None:
+                self.reset_at = int(headers.get("X-RateLimit-Reset"))
+
+            if not is_throttled(status_code, headers, text):
+                if method in WRITE_METHODS:
+                    self.write_interval = max(self.min_write_interval, self.write_interval * 0.9)
+                return None
+
+            self.throttled += 1
+            if attempt + 1 >= self.max_attempts:
+                return None
+            delay = parse_retry_after(headers.get("Retry-After"))
+            if delay is None and self.remaining == 0 and self.reset_at is not None:
+                delay = max(1.0, self.reset_at - time.time() + 1)
+            elif delay is None:
+                # Secondary rate limit without Retry-After: GitHub asks for at least a minute, then exponential up to
+                # a few minutes, jittered so that the workers blocked together don't retry together
+                delay = random.uniform(SECONDARY_LIMIT_WAIT,
+                                       min(MAX_SECONDARY_LIMIT_WAIT, SECONDARY_LIMIT_WAIT * (2 ** attempt)))
+                self.write_interval = min(MAX_WRITE_INTERVAL, max(1.0, self.write_interval * 2))
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+            return delay
+
+    def pace_interval(self):
+        # Run at full speed while the budget is healthy, spread the rest evenly over the window once it runs low
+        if self.remaining is None or self.limit is None or self.reset_at is None:
+            return 0.0
+        if self.remaining > self.limit * 0.1:
+            return 0.0
+        window = self.reset_at - time.time()
+        if window <= 0:
+            return 0.0
+        return window / max(self.remaining, 1)
+
+
+def parse_retry_after(retry_after):
+    """Seconds to wait from a Retry-After header in seconds or as an HTTP-date, None if it is missing or invalid."""
+    if retry_after is None:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_throttled(status_code, headers, text):
+    if status_code == 429:
+        return True
+    if status_code != 403:
+        return False
+    return headers.get("Retry-After") is not None or headers.get("X-RateLimit-Remaining") == "0" \
+        or "rate limit" in text.lower()
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(github_token):
+    """Returns the scheduler for the given token, creating it on first use."""
+    with _schedulers_lock:
+        scheduler = _schedulers.get(github_token)
+        if scheduler is None:
+            scheduler = GitHubScheduler(github_token, max(Context.pool_size, Context.concurrency),
+                                        Context.github_max_attempts, Context.github_write_interval)
+            _schedulers[github_token] = scheduler
+        return scheduler
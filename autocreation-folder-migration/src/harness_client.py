@@ -0,0 +1,233 @@
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import log
+import metrics
+from context import Context
+from utility import map_concurrently
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+logger = log.get_logger("harness")
+
+
+class HarnessRequest:
+    """A single Harness API call, shared by the sync client and the async engine.
+
+    POST calls are treated as not idempotent unless marked otherwise, read-only POST listings pass idempotent=True.
+    """
+
+    def __init__(self, method, path, params=None, json=None, page_param=None, idempotent=None):
+        self.method = method
+        self.path = path
+        self.params = params or {}
+        self.json = json
+        self.page_param = page_param
+        self.idempotent = method in IDEMPOTENT_METHODS if idempotent is None else idempotent
+
+    def with_page(self, page):
+        params = dict(self.params)
+        params[self.page_param] = page
+        return HarnessRequest(self.method, self.path, params, self.json, self.page_param, self.idempotent)
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, bounded per call and by a retry budget shared by the whole run.
+
+    Every request adds `budget_ratio` retry tokens to the budget (up to `budget_cap`), every retry spends one. A
+    gateway outage therefore can't multiply the load on Harness, while isolated blips are always retried.
+    """
+
+    def __init__(self, max_attempts, base_delay, max_delay, budget_ratio, budget_min, budget_cap):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget_ratio = budget_ratio
+        self.budget_cap = budget_cap
+        self.tokens = float(budget_min)
+        self.lock = threading.Lock()
+
+    def record_request(self):
+        with self.lock:
+            self.tokens = min(self.budget_cap, self.tokens + self.budget_ratio)
+
+    def retry_delay(self, idempotent, attempt, status_code=None, retry_after=None, connect_error=False):
+        """Returns the seconds to wait before retrying, or None if the call must not be retried."""
+        if attempt + 1 >= self.max_attempts:
+            return None
+        if status_code is not None:
+            if status_code not in RETRYABLE_STATUS_CODES:
+                return None
+            # A 429 was rejected before being processed, anything else may have been applied already
+            if not idempotent and status_code != 429:
+                return None
+        elif not idempotent and not connect_error:
+            return None
+        with self.lock:
+            if self.tokens < 1:
+                return None
+            self.tokens -= 1
+        if retry_after is not None:
+            try:
+                return min(self.max_delay, float(retry_after))
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+class HarnessClient:
+    """Keep-alive client for the Harness API, shared by every entity module."""
+
+    def __init__(self, api_key, base_url, pool_size, connect_timeout, read_timeout, retry_policy):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.retry_policy = retry_policy
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            "Accept-Encoding": "gzip, deflate",
+            "x-api-key": api_key  # API Key for authentication
+        })
+
+    def url(self, path):
+        return self.base_url + route(path)
+
+    def request(self, method, path, params=None, json=None, idempotent=None):
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        endpoint = metrics.harness_endpoint(path)
+        attempt = 0
+        while True:
+            self.retry_policy.record_request()
+            started = time.monotonic()
+            try:
+                response = self.session.request(method, self.url(path), params=params, json=json, timeout=self.timeout)
+            except requests.exceptions.RequestException as ex:
+                metrics.record(endpoint, "error", time.monotonic() - started, retry=attempt > 0)
+                delay = self.retry_policy.retry_delay(idempotent, attempt,
+                                                      connect_error=isinstance(ex, requests.exceptions.ConnectionError))
+                if delay is None:
+                    raise
+                logger.warning("Harness call failed, retrying", endpoint=endpoint, method=method, error=repr(ex),
+                               attempt=attempt, retry_in_s=round(delay, 1))
+            else:
+                duration = time.monotonic() - started
+                metrics.record(endpoint, response.status_code, duration, body_size(response.request.body),
+                               len(response.content), retry=attempt > 0)
+                logger.debug("Harness call", endpoint=endpoint, method=method, status=response.status_code,
+                             duration_ms=round(duration * 1000, 1), attempt=attempt)
+                delay = self.retry_policy.retry_delay(idempotent, attempt, response.status_code,
+                                                      response.headers.get("Retry-After"))
+                if delay is None:
+                    return response
+                logger.warning("Harness call returned a retryable status", endpoint=endpoint, method=method,
+                               status=response.status_code, attempt=attempt, retry_in_s=round(delay, 1))
+            time.sleep(delay)
+            attempt += 1
+
+    def send(self, request):
+        return self.request(request.method, request.path, params=request.params, json=request.json,
+                            idempotent=request.idempotent)
+
+    def list_all(self, request):
+        """Fetches every page of a listing, the first page gives the page count and the rest are fetched in parallel.
+
+        Returns the items fetched and the failing response, which is None when every page was fetched.
+        """
+        response = self.send(request.with_page(0))
+        if response.status_code != 200:
+            return [], response
+        data = response.json()['data']
+        items = list(data['content'])
+        total_pages = page_count(data)
+        if total_pages is None:
+            # No paging metadata, fall back to reading pages until an empty one
+            page = 1
+            while len(data['content']) > 0:
+                response = self.send(request.with_page(page))
+                if response.status_code != 200:
+                    return items, response
+                data = response.json()['data']
+                items.extend(data['content'])
+                page += 1
+            return items, None
+        responses = map_concurrently(lambda page: self.send(request.with_page(page)), range(1, total_pages),
+                                     Context.concurrency)
+        for response in responses:
+            if response.status_code != 200:
+                return items, response
+            items.extend(response.json()['data']['content'])
+        return items, None
+
+    def get(self, path, params=None):
+        return self.request("GET", path, params=params)
+
+    def post(self, path, params=None, json=None):
+        return self.request("POST", path, params=params, json=json)
+
+    def put(self, path, params=None, json=None):
+        return self.request("PUT", path, params=params, json=json)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+_retry_policy = None
+
+
+def get_client(api_key):
+    """Returns the client for the given API key, creating it on first use."""
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is None:
+            # Every scope in flight runs its own detail workers
+            pool_size = max(Context.pool_size, Context.concurrency * Context.scope_concurrency)
+            client = HarnessClient(api_key, Context.harness_url, pool_size,
+                                   Context.connect_timeout, Context.read_timeout, _get_retry_policy())
+            _clients[api_key] = client
+        return client
+
+
+def get_retry_policy():
+    with _clients_lock:
+        return _get_retry_policy()
+
+
+def _get_retry_policy():
+    global _retry_policy
+    if _retry_policy is None:
+        _retry_policy = RetryPolicy(Context.harness_max_attempts, Context.harness_retry_base_delay,
+                                    Context.harness_retry_max_delay, Context.harness_retry_budget_ratio,
+                                    Context.harness_retry_budget_min, Context.harness_retry_budget_cap)
+    return _retry_policy
+
+
+def body_size(body):
+    if body is None:
+        return 0
+    return len(body.encode() if isinstance(body, str) else body)
+
+
+def page_count(data):
+    """Number of pages of a Harness page response, or None if it carries no paging metadata."""
+    if data.get('totalPages') is not None:
+        return data['totalPages']
+    if data.get('totalItems') is not None and data.get('pageSize'):
+        return -(-data['totalItems'] // data['pageSize'])
+    return None
+
+
+def route(path):
+    # Modules mix "/gateway/ng/..." and bare "/ng/..." or "/pipeline/..." paths, send them all through the gateway
+    if not path.startswith("/"):
+        path = "/" + path
+    if path.startswith("/gateway/"):
+        return path
+    return "/gateway" + path
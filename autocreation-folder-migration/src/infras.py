@@ -1,40 +1,28 @@
-import requests
-from utility import EntityDetails, get_repo_url, is_empty
+import time
+
+import log
+from context import Context
+from harness_client import HarnessRequest, get_client
+from utility import EntityDetails, fan_out, get_repo_url, is_empty, imap_concurrently, skip_inline
+from archives import read_archived_file
+from journal import is_done
+from updates import Update, run_updates
 from environments import get_environments
 
+logger = log.get_logger("infras")
 
-def get_infras(api_key, account_id, org_id, project_id, environment_id):
-    # Construct the API URL with additional scope parameters
-    url = f"https://app.harness.io/gateway/ng/api/infrastructures"
-    page = 0
-    params = {
-        'accountIdentifier': account_id,
-        "orgIdentifier": org_id,
-        "projectIdentifier": project_id,
-        'environmentIdentifier': environment_id,
-        'page': page
-    }
-    headers = {
-        "Content-Type": "application/json",
-        "x-api-key": api_key  # API Key for authentication
-    }
 
-    infras = []
-    while True:
-        # Send GET request to Harness API with scope parameters
-        response = requests.get(url, headers=headers, params=params)
-
-        # Check if the request was successful
-        if response.status_code == 200:
-            # Parse JSON response
-            content = response.json()['data']['content']
-            if len(content) == 0:
-                return infras
-            infras.extend(content)
-            params['page'] += 1
-        else:
-            # Return error message if the request fails
-            return f"Failed to retrieve data: {response.status_code} - {response.text}"
+def get_infras(api_key, account_id, org_id, project_id, environment_id):
+    request = list_infras_request(account_id, org_id, project_id, environment_id)
+    # Send GET requests to Harness API with scope parameters
+    infras, error = get_client(api_key).list_all(request)
+    if error is not None:
+        # Keep the infras fetched so far, callers iterate the result
+        logger.error("Failed to list infrastructures", environment=environment_id, status=error.status_code,
+                     listed=len(infras))
+        logger.payload("Infrastructure listing error", error.text, sample=False, environment=environment_id)
+    logger.payload("Infrastructure listing", infras, environment=environment_id)
+    return infras
 
 
 def get_infrastructure_details(api_key, account_id, org_id, project_id, environment_id, infrastructure_id):
@@ -43,106 +31,128 @@ def get_infrastructure_details(api_key, account_id, org_id, project_id, environm
 
     :param api_key: The Harness API key (Bearer Token)
     :param infrastructure_id: The ID of the infrastructure to fetch details for
-    :return: The infrastructure details, or an error message if the request fails.
+    :return: The infrastructure details, or None if the request fails.
     """
-    # Harness API endpoint for fetching specific infrastructure details
-    url = f"https://app.harness.io/ng/api/infrastructures/{infrastructure_id}"
-
-    params = {
-        'accountIdentifier': account_id,
-        "orgIdentifier": org_id,
-        "projectIdentifier": project_id,
-        'environmentIdentifier': environment_id
-    }
-
-    # Set up headers with the Authorization key
-    headers = {
-        "Content-Type": "application/json",
-        "x-api-key": api_key  # API Key for authentication
-    }
-
     # Send GET request to Harness API
-    response = requests.get(url, headers=headers, params=params)
+    request = infrastructure_details_request(account_id, org_id, project_id, environment_id, infrastructure_id)
+    started = time.monotonic()
+    response = get_client(api_key).send(request)
+    duration_ms = round((time.monotonic() - started) * 1000, 1)
 
     # Check if the request was successful
     if response.status_code == 200:
         # Parse JSON response and return the details
+        logger.debug("Fetched infrastructure details", entity=infrastructure_id, environment=environment_id,
+                     endpoint="infras.details", status=response.status_code, duration_ms=duration_ms)
         return response.json()
     else:
-        # Return error message if the request fails
-        return f"Failed to retrieve data: {response.status_code} - {response.text}"
+        logger.error("Failed to fetch infrastructure details", entity=infrastructure_id, environment=environment_id,
+                     endpoint="infras.details", status=response.status_code, duration_ms=duration_ms)
+        logger.payload("Infrastructure details error", response.text, sample=False, entity=infrastructure_id)
+        return None
 
 
-def update_infra_git_metadata(api_key, account_id, org_id, project_id, env_id, env_type, infra_id):
-    url = f"https://app.harness.io/ng/api/infrastructures/{infra_id}/update-git-metadata"
+def update_infra_file_path(api_key, account_id, org_id, project_id):
+    updates = []
+    for env, infra in list_environment_infras(api_key, account_id, org_id, project_id):
+        if infra['storeType'] != 'INLINE':
+            updates.append(Update("INFRA", org_id, project_id, infra['identifier'],
+                                  get_target_file_path(org_id, project_id, infra['identifier'], env['identifier'], env['type']),
+                                  update_infra_git_metadata_request(account_id, org_id, project_id, env['identifier'], env['type'], infra['identifier'])))
+    run_updates(api_key, updates)
 
-    params = {
-        "accountIdentifier": account_id,
-        "orgIdentifier": org_id,
-        "projectIdentifier": project_id,
-        "environmentIdentifier": env_id,
-        "filePath": get_target_file_path(org_id, project_id, infra_id, env_id, env_type)
-    }
 
-    headers = {
-        "Content-Type": "application/json",
-        "x-api-key": api_key  # API Key for authentication
-    }
+def stream_infras(api_key, account_id, org_id, project_id):
+    entity_data_list = imap_concurrently(
+        lambda pair: process_infra(api_key, account_id, org_id, project_id, pair[0], pair[1]),
+        skip_inline(list_environment_infras(api_key, account_id, org_id, project_id), "infrastructures",
+                    lambda pair: pair[1]), Context.concurrency, Context.queue_depth)
+    return (entity_data for entity_data in entity_data_list if entity_data is not None)
+
 
-    print(f"Updating infra filepath : {params} for infra id : {infra_id}")
+def list_environment_infras(api_key, account_id, org_id, project_id):
+    """Yields (environment, infrastructure) pairs, the infras of several environments are listed concurrently."""
+    env_list = [element['environment'] for element in get_environments(api_key, account_id, org_id, project_id)]
+    pairs = fan_out(lambda env: get_infras(api_key, account_id, org_id, project_id, env['identifier']),
+                    env_list, Context.concurrency, Context.queue_depth, "environments", "infrastructures")
+    return ((env, element['infrastructure']) for env, element in pairs)
 
+
+def process_infra(api_key, account_id, org_id, project_id, env, element):
+    if is_done(1, get_target_file_path(org_id, project_id, element['identifier'], env['identifier'], env['type'])):
+        return None
     try:
-        response = requests.put(url, headers=headers, params=params)
-        response.raise_for_status()  # Raise an error for HTTP errors (4xx and 5xx)
-        return response.json()
+        infra_details = read_infra_details(element) or \
+            get_infrastructure_details(api_key, account_id, org_id, project_id, env['identifier'], element['identifier'])
+        if infra_details is None:
+            return None
+        logger.payload("Infrastructure details", infra_details, entity=element['identifier'])
+        return build_infra_entity(account_id, org_id, project_id, env, infra_details)
+    except Exception:
+        logger.exception("Failed to process infrastructure", entity=element['identifier'], environment=env['identifier'])
+    return None
+
+
+def read_infra_details(infra):
+    """Infrastructure details with the YAML read from the repo archive, None if it has to be fetched from Harness."""
+    yaml = read_archived_file(infra.get('entityGitDetails'))
+    if yaml is None:
+        return None
+    return {"data": {"infrastructure": {"identifier": infra['identifier'], "storeType": infra['storeType'],
+                                        "yaml": yaml, "entityGitDetails": infra['entityGitDetails']}}}
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error updating Git metadata: {e}")
+
+def build_infra_entity(account_id, org_id, project_id, env, infra_details):
+    data = infra_details['data']['infrastructure']
+    if data['storeType'] == 'INLINE':
+        return None
+    entity_data = EntityDetails(account_id, org_id, project_id, data['identifier'], data['yaml'],
+                                data['entityGitDetails']['repoName'],
+                                get_repo_url(data['entityGitDetails']['fileUrl'],
+                                             data['entityGitDetails']['repoName']))
+    entity_data.sub_type = env['type']
+    entity_data.parent_id = env['identifier']
+    entity_data.target_file_path = get_target_file_path_from_entity(entity_data)
+    entity_data.source_file_path = data['entityGitDetails']['filePath']
+    entity_data.source_branch = data['entityGitDetails'].get('branch') or ""
+    if entity_data.target_file_path == entity_data.source_file_path:
+        logger.info("Ignoring the infrastructure as it is already under the conventional file path",
+                    entity=data['identifier'], environment=env['identifier'], file_path=entity_data.target_file_path)
         return None
+    return entity_data
 
 
-def update_infra_file_path(api_key, account_id, org_id, project_id):
-    env_list = get_environments(api_key, account_id, org_id, project_id)
-    for element in env_list:
-        env = element['environment']
-        infra_list = get_infras(api_key, account_id, org_id, project_id, env['identifier'])
-        for element in infra_list:
-            infra = element['infrastructure']
-            if infra['storeType'] != 'INLINE':
-                update_infra_git_metadata(api_key, account_id, org_id, project_id, env['identifier'], env['type'], infra['identifier'])
-
-
-def process_infras(api_key, account_id, org_id, project_id):
-    env_list = get_environments(api_key, account_id, org_id, project_id)
-    entity_data_list = []
-    for element in env_list:
-        env = element['environment']
-        infra_list = get_infras(api_key, account_id, org_id, project_id, env['identifier'])
-        if len(infra_list) == 0:
-            continue
-        for infra in infra_list:
-            element = infra['infrastructure']
-            try:
-                infra_details = get_infrastructure_details(api_key, account_id, org_id, project_id, env['identifier'], element['identifier'])
-                data = infra_details['data']['infrastructure']
-                print(infra_details)
-                print(data)
-                if data['storeType'] != 'INLINE':
-                    entity_data = EntityDetails(account_id, org_id, project_id, data['identifier'], data['yaml'],
-                                            data['entityGitDetails']['repoName'],
-                                            get_repo_url(data['entityGitDetails']['fileUrl'],
-                                                         data['entityGitDetails']['repoName']))
-                    entity_data.sub_type = env['type']
-                    entity_data.parent_id = env['identifier']
-                    entity_data.target_file_path = get_target_file_path_from_entity(entity_data)
-                    if entity_data.target_file_path == data['entityGitDetails']['filePath']:
-                        print("ignoring the env as its already under conventional filepath\nMetadata:" + str(
-                            env) + "\nDetails:" + str(data))
-                        continue
-                    entity_data_list.append(entity_data)
-            except Exception as ex:
-                print(ex)
-    return entity_data_list
+def list_infras_request(account_id, org_id, project_id, environment_id):
+    params = {
+        'accountIdentifier': account_id,
+        "orgIdentifier": org_id,
+        "projectIdentifier": project_id,
+        'environmentIdentifier': environment_id,
+        'page': 0,
+        'size': Context.page_size
+    }
+    return HarnessRequest("GET", "/ng/api/infrastructures", params=params, page_param="page")
+
+
+def infrastructure_details_request(account_id, org_id, project_id, environment_id, infrastructure_id):
+    params = {
+        'accountIdentifier': account_id,
+        "orgIdentifier": org_id,
+        "projectIdentifier": project_id,
+        'environmentIdentifier': environment_id
+    }
+    return HarnessRequest("GET", f"/ng/api/infrastructures/{infrastructure_id}", params=params)
+
+
+def update_infra_git_metadata_request(account_id, org_id, project_id, env_id, env_type, infra_id):
+    params = {
+        "accountIdentifier": account_id,
+        "orgIdentifier": org_id,
+        "projectIdentifier": project_id,
+        "environmentIdentifier": env_id,
+        "filePath": get_target_file_path(org_id, project_id, infra_id, env_id, env_type)
+    }
+    return HarnessRequest("PUT", f"/ng/api/infrastructures/{infra_id}/update-git-metadata", params=params)
 
 
 def get_target_file_path_from_entity(entity_data):
@@ -157,4 +167,4 @@ def get_target_file_path(org_id, project_id, identifier, env_id, env_type):
         return target_file_path + ending_path
     if is_empty(project_id):
         return target_file_path + "orgs/" + org_id + "/" + ending_path
-    return ".harness/orgs/" + org_id + "/projects/" + project_id + "/" + ending_path
\ No newline at end of file
+    return ".harness/orgs/" + org_id + "/projects/" + project_id + "/" + ending_path
@@ -1,77 +1,136 @@
-import requests
-from utility import EntityDetails, get_repo_url
+import time
+
+import log
+from context import Context
+from harness_client import HarnessRequest, get_client
+from utility import EntityDetails, fan_out, get_repo_url, imap_concurrently, skip_inline
+from archives import read_archived_file
+from journal import is_done
+from updates import Update, run_updates
 from pipelines import fetch_pipelines
 
+logger = log.get_logger("inputsets")
+
 
 def get_input_sets(api_key, account_id, org_id, project_id, pipeline_id):
-    # Harness API endpoint for fetching input sets for a pipeline
-    url = f"https://app.harness.io/gateway/pipeline/api/inputSets"
+    request = list_input_sets_request(account_id, org_id, project_id, pipeline_id)
+    # Send GET requests to Harness API
+    input_set_list, error = get_client(api_key).list_all(request)
+    if error is not None:
+        logger.error("Failed to list input sets", pipeline=pipeline_id, status=error.status_code,
+                     listed=len(input_set_list))
+        logger.payload("Input set listing error", error.text, sample=False, pipeline=pipeline_id)
+    logger.payload("Input set listing", input_set_list, pipeline=pipeline_id)
+    return input_set_list
 
-    # Set up headers with the Authorization key
-    headers = {
-        "Content-Type": "application/json",
-        "x-api-key": api_key  # API Key for authentication
-    }
 
-    # Query parameters
+def get_input_set_details(api_key, account_id, org_id, project_id, pipeline_id,  input_set_id):
+    # Send GET request to Harness API
+    started = time.monotonic()
+    response = get_client(api_key).send(input_set_details_request(account_id, org_id, project_id, pipeline_id, input_set_id))
+    duration_ms = round((time.monotonic() - started) * 1000, 1)
+
+    # Check if the request was successful
+    if response.status_code == 200:
+        # Parse and return the input set details if successful
+        logger.debug("Fetched input set details", entity=input_set_id, pipeline=pipeline_id,
+                     endpoint="inputsets.details", status=response.status_code, duration_ms=duration_ms)
+        return response.json()
+    else:
+        logger.error("Failed to fetch input set details", entity=input_set_id, pipeline=pipeline_id,
+                     endpoint="inputsets.details", status=response.status_code, duration_ms=duration_ms)
+        logger.payload("Input set details error", response.text, sample=False, entity=input_set_id)
+        return None
+
+
+def update_input_set_file_path(api_key, account_id, org_id, project_id):
+    updates = []
+    for pipeline, input_set in list_pipeline_input_sets(api_key, account_id, org_id, project_id):
+        updates.append(Update("INPUTSET", org_id, project_id, input_set['identifier'],
+                              get_target_file_path(org_id, project_id, pipeline['identifier'], input_set['identifier']),
+                              update_input_set_git_metadata_request(account_id, org_id, project_id, pipeline['identifier'], input_set['identifier'])))
+    run_updates(api_key, updates)
+
+
+def stream_input_sets(api_key, account_id, org_id, project_id):
+    entity_data_list = imap_concurrently(
+        lambda pair: process_input_set(api_key, account_id, org_id, project_id, pair[0], pair[1]),
+        skip_inline(list_pipeline_input_sets(api_key, account_id, org_id, project_id), "input sets",
+                    lambda pair: pair[1]), Context.concurrency, Context.queue_depth)
+    return (entity_data for entity_data in entity_data_list if entity_data is not None)
+
+
+def list_pipeline_input_sets(api_key, account_id, org_id, project_id):
+    """Yields (pipeline, input set) pairs, the input sets of several pipelines are listed concurrently."""
+    pipeline_list = fetch_pipelines(api_key, account_id, org_id, project_id)
+    return fan_out(lambda pipeline: get_input_sets(api_key, account_id, org_id, project_id, pipeline['identifier']),
+                   pipeline_list, Context.concurrency, Context.queue_depth, "pipelines", "input sets")
+
+
+def process_input_set(api_key, account_id, org_id, project_id, pipeline, element):
+    if is_done(1, get_target_file_path(org_id, project_id, pipeline['identifier'], element['identifier'])):
+        return None
+    try:
+        input_set_details = read_input_set_details(element) or \
+            get_input_set_details(api_key, account_id, org_id, project_id, pipeline['identifier'], element['identifier'])
+        if input_set_details is None:
+            return None
+        return build_input_set_entity(account_id, org_id, project_id, pipeline, input_set_details)
+    except Exception:
+        logger.exception("Failed to process input set", entity=element['identifier'], pipeline=pipeline['identifier'])
+    return None
+
+
+def read_input_set_details(input_set):
+    """Input set details with the YAML read from the repo archive, None if it has to be fetched from Harness."""
+    yaml = read_archived_file(input_set.get('gitDetails'))
+    if yaml is None:
+        return None
+    return {"data": {"identifier": input_set['identifier'], "storeType": input_set.get('storeType', 'REMOTE'),
+                     "inputSetYaml": yaml, "gitDetails": input_set['gitDetails']}}
+
+
+def build_input_set_entity(account_id, org_id, project_id, pipeline, input_set_details):
+    data = input_set_details['data']
+    if data['storeType'] == 'INLINE':
+        return None
+    entity_data = EntityDetails(account_id, org_id, project_id, data['identifier'],
+                                data['inputSetYaml'], data['gitDetails']['repoName'],
+                                get_repo_url(data['gitDetails']['fileUrl'], data['gitDetails']['repoName']))
+    entity_data.parent_id = pipeline['identifier']
+    entity_data.target_file_path = get_target_file_path_from_entity(entity_data)
+    entity_data.source_file_path = data['gitDetails']['filePath']
+    entity_data.source_branch = data['gitDetails'].get('branch') or ""
+    if entity_data.target_file_path == entity_data.source_file_path:
+        logger.info("Ignoring the input set as it is already under the conventional file path",
+                    entity=data['identifier'], pipeline=pipeline['identifier'], file_path=entity_data.target_file_path)
+        return None
+    return entity_data
+
+
+def list_input_sets_request(account_id, org_id, project_id, pipeline_id):
     params = {
         'accountIdentifier': account_id,
         'orgIdentifier': org_id,
         'projectIdentifier': project_id,
         'pipelineIdentifier': pipeline_id,
-        'pageIndex': 0
+        'pageIndex': 0,
+        'pageSize': Context.page_size
     }
-
-    input_set_list = []
-    while True:
-        # Send GET request to Harness API
-        response = requests.get(url, headers=headers, params=params)
-        # Check if the request was successful
-        if response.status_code == 200:
-            content = response.json()['data']['content']
-            if len(content) == 0:
-                return input_set_list
-            input_set_list.extend(content)
-            params['pageIndex'] += 1
-        else:
-            # Return error message if the request fails
-            print(f"Failed to retrieve input sets: {response.status_code} - {response.text}")
-            return []
+    return HarnessRequest("GET", "/pipeline/api/inputSets", params=params, page_param="pageIndex")
 
 
-def get_input_set_details(api_key, account_id, org_id, project_id, pipeline_id,  input_set_id):
-    # Harness API endpoint for fetching a specific input set by ID
-    url = f"https://app.harness.io/pipeline/api/inputSets/{input_set_id}"
-
-    # Set up headers with the Authorization key
-    headers = {
-        "Content-Type": "application/json",
-        "x-api-key": api_key  # API Key for authentication
-    }
-
-    # Query parameters
+def input_set_details_request(account_id, org_id, project_id, pipeline_id, input_set_id):
     params = {
         'accountIdentifier': account_id,
         'orgIdentifier': org_id,
         'projectIdentifier': project_id,
         'pipelineIdentifier': pipeline_id
     }
+    return HarnessRequest("GET", f"/pipeline/api/inputSets/{input_set_id}", params=params)
 
-    # Send GET request to Harness API
-    response = requests.get(url, headers=headers, params=params)
 
-    # Check if the request was successful
-    if response.status_code == 200:
-        # Parse and return the input set details if successful
-        return response.json()
-    else:
-        # Return error message if the request fails
-        return f"Failed to retrieve input set details: {response.status_code} - {response.text}"
-
-
-def update_input_set_git_metadata(api_key, account_id, org_id, project_id, pipeline_id, input_set_id):
-    # URL to update Git metadata for the pipeline
-    url = f"https://app.harness.io/gateway/pipeline/api/inputSets/{input_set_id}/update-git-metadata"
+def update_input_set_git_metadata_request(account_id, org_id, project_id, pipeline_id, input_set_id):
     params = {
         "accountIdentifier": account_id,
         "orgIdentifier": org_id,
@@ -79,55 +138,7 @@ def update_input_set_git_metadata(api_key, account_id, org_id, project_id, pipel
         "pipelineIdentifier": pipeline_id,
         "filePath": get_target_file_path(org_id, project_id, pipeline_id, input_set_id)
     }
-    # Headers for authentication
-    headers = {
-        "Content-Type": "application/json",
-        "x-api-key": api_key  # API Key for authentication
-    }
-
-    print(f"Updating input-set filepath : {params} for input-set id : {input_set_id}")
-
-    # Make the PUT request to update the Git metadata
-    response = requests.put(url, headers=headers, params=params)
-    if response.status_code == 200:
-        print({"status": "success", "message": f"✅ Git metadata for inputset {input_set_id} updated successfully!"})
-    else:
-        print({"status": "error", "message": "Failed to update Git metadata", "details": response.json()})
-
-
-def update_input_set_file_path(api_key, account_id, org_id, project_id):
-    pipeline_list = fetch_pipelines(api_key, account_id, org_id, project_id)
-    for pipeline in pipeline_list:
-        input_set_list = get_input_sets(api_key, account_id, org_id, project_id, pipeline['identifier'])
-        for input_set in input_set_list:
-            try:
-                update_input_set_git_metadata(api_key, account_id, org_id, project_id, pipeline['identifier'], input_set['identifier'])
-            except Exception as ex:
-                print(ex)
-
-
-def process_input_sets(api_key, account_id, org_id, project_id):
-    pipeline_list = fetch_pipelines(api_key, account_id, org_id, project_id)
-    entity_data_list = []
-    for pipeline in pipeline_list:
-        input_set_list = get_input_sets(api_key, account_id, org_id, project_id, pipeline['identifier'])
-        for element in input_set_list:
-            try:
-                input_set_details = get_input_set_details(api_key, account_id, org_id, project_id, pipeline['identifier'], element['identifier'])
-                data = input_set_details['data']
-                if data['storeType'] != 'INLINE':
-                    entity_data = EntityDetails(account_id, org_id, project_id, data['identifier'],
-                                                data['inputSetYaml'], data['gitDetails']['repoName'],
-                                                get_repo_url(data['gitDetails']['fileUrl'], data['gitDetails']['repoName']))
-                    entity_data.parent_id = pipeline['identifier']
-                    entity_data.target_file_path = get_target_file_path_from_entity(entity_data)
-                    if entity_data.target_file_path == data['gitDetails']['filePath']:
-                        print("ignoring the pipeline as its already under conventional filepath:\nMetadata:" + str(pipeline) + "\nDetails:" + str(data))
-                        continue
-                    entity_data_list.append(entity_data)
-            except Exception as ex:
-                print(ex)
-    return entity_data_list
+    return HarnessRequest("PUT", f"/pipeline/api/inputSets/{input_set_id}/update-git-metadata", params=params)
 
 
 def get_target_file_path_from_entity(entity_data):
@@ -0,0 +1,126 @@
+import sqlite3
+import threading
+
+import log
+
+# Entity states, per operation
+FETCHED = "fetched"
+COMMITTED = "committed"
+UPDATED = "updated"
+# Branch states of operation-1, per repo
+FORKED = "forked"
+PR_RAISED = "pr_raised"
+
+_journal = None
+
+logger = log.get_logger("journal")
+
+
+class Journal:
+    """SQLite journal of the work done by a run, so that a --resume run can skip it.
+
+    Entities are keyed by their target file path, which is unique across the account and can be computed from the
+    listing alone, so resumed runs skip completed entities before fetching their details.
+    """
+
+    def __init__(self, path, resume):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS runs (name TEXT PRIMARY KEY, value TEXT)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS entities (operation INTEGER, file_path TEXT, "
+                                    "entity_type TEXT, org_id TEXT, project_id TEXT, state TEXT, "
+                                    "PRIMARY KEY (operation, file_path))")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS branches (repo TEXT, repo_url TEXT, branch TEXT, "
+                                    "state TEXT, PRIMARY KEY (repo, repo_url, branch))")
+            if not resume:
+                for table in ("runs", "entities", "branches"):
+                    self.connection.execute(f"DELETE FROM {table}")
+
+    def execute(self, sql, parameters=()):
+        with self.lock, self.connection:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def get_branch(self, new_branch):
+        self.execute("INSERT OR IGNORE INTO runs (name, value) VALUES ('branch', ?)", (new_branch,))
+        return self.execute("SELECT value FROM runs WHERE name = 'branch'")[0][0]
+
+    def entity_state(self, operation, file_path):
+        rows = self.execute("SELECT state FROM entities WHERE operation = ? AND file_path = ?", (operation, file_path))
+        return rows[0][0] if rows else None
+
+    def record_entity(self, operation, entity_type, org_id, project_id, file_path, state):
+        self.execute("INSERT OR REPLACE INTO entities (operation, file_path, entity_type, org_id, project_id, state) "
+                     "VALUES (?, ?, ?, ?, ?, ?)", (operation, file_path, entity_type, org_id, project_id, state))
+
+    def repo_state(self, repo, repo_url, branch):
+        rows = self.execute("SELECT state FROM branches WHERE repo = ? AND repo_url = ? AND branch = ?",
+                            (repo, repo_url, branch))
+        return rows[0][0] if rows else None
+
+    def record_repo(self, repo, repo_url, branch, state):
+        self.execute("INSERT OR REPLACE INTO branches (repo, repo_url, branch, state) VALUES (?, ?, ?, ?)",
+                     (repo, repo_url, branch, state))
+
+    def repos(self):
+        return [tuple(row) for row in self.execute("SELECT repo, repo_url, branch FROM branches ORDER BY rowid")]
+
+
+def open_journal(path, resume):
+    global _journal
+    _journal = Journal(path, resume)
+    return _journal
+
+
+# The functions below do nothing when no journal was opened, e.g. when the modules are used as a library
+
+
+def get_branch(new_branch):
+    """Returns the branch of the run being resumed, or records new_branch as the branch of this run."""
+    if _journal is None:
+        return new_branch
+    return _journal.get_branch(new_branch)
+
+
+def is_done(operation, file_path):
+    if _journal is None:
+        return False
+    state = _journal.entity_state(operation, file_path)
+    if state in (COMMITTED, UPDATED):
+        logger.info("Skipping, already done by the resumed run", operation=operation, file_path=file_path)
+        return True
+    return False
+
+
+def record_entity(operation, entity_type, org_id, project_id, file_path, state):
+    if _journal is not None:
+        _journal.record_entity(operation, entity_type, org_id, project_id, file_path, state)
+
+
+def record_migration(entity_type, entity_data, state):
+    """Records the operation-1 state of an EntityDetails."""
+    record_entity(1, entity_type, entity_data.org_identifier, entity_data.project_identifier,
+                  entity_data.target_file_path, state)
+
+
+def repo_state(repo, repo_url, branch):
+    if _journal is None:
+        return None
+    return _journal.repo_state(repo, repo_url, branch)
+
+
+def record_repo(repo, repo_url, branch, state):
+    if _journal is not None:
+        _journal.record_repo(repo, repo_url, branch, state)
+
+
+def journaled_repos():
+    """(repo, repo_url, branch) of every branch forked by this run or the run being resumed.
+
+    A repo has one branch per shard when pull requests are split, see Context.pr_max_files.
+    """
+    if _journal is None:
+        return []
+    return _journal.repos()
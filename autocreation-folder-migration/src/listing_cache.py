@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import log
+from context import Context
+from harness_client import get_client
+
+_listings = {}
+_listing_locks = {}
+_listings_lock = threading.Lock()
+
+logger = log.get_logger("listing_cache")
+
+
+def list_cached(api_key, kind, account_id, org_id, project_id, request):
+    """client.list_all for the listing of an entity kind in a scope, done once per run and shared by every caller.
+
+    Pipelines are listed for pipelines and input sets, environments for environments and infras: the second entity
+    type of a scope reuses the listing of the first. With Context.listing_cache_dir set, complete listings are also
+    kept on disk for Context.listing_cache_ttl seconds, so operation-2 can reuse the listings of operation-1.
+    """
+    key = get_key(kind, account_id, org_id, project_id)
+    with _listings_lock:
+        lock = _listing_locks.setdefault(key, threading.Lock())
+    # Callers listing the same scope at once wait for the first listing instead of repeating it
+    with lock:
+        items = get_listing(key)
+        if items is not None:
+            return items, None
+        items, error = get_client(api_key).list_all(request)
+        if error is None:
+            store_listing(key, items)
+        return items, error
+
+
+def get_key(kind, account_id, org_id, project_id):
+    return Context.harness_url, account_id, org_id, project_id, kind
+
+
+def get_listing(key):
+    """Returns the cached items of the listing, None if it isn't cached or its disk entry has expired."""
+    with _listings_lock:
+        items = _listings.get(key)
+    if items is not None or not Context.listing_cache_dir:
+        return items
+    try:
+        with open(get_listing_path(key)) as file:
+            entry = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if time.time() - entry["created"] > Context.listing_cache_ttl:
+        return None
+    logger.info("Reusing a listing cached on disk", kind=key[4], org=key[2], project=key[3], count=len(entry["items"]))
+    with _listings_lock:
+        return _listings.setdefault(key, entry["items"])
+
+
+def store_listing(key, items):
+    """Caches a complete listing, failed listings are never cached."""
+    with _listings_lock:
+        _listings[key] = items
+    if not Context.listing_cache_dir:
+        return
+    os.makedirs(Context.listing_cache_dir, exist_ok=True)
+    path = get_listing_path(key)
+    # Written aside and renamed so that a concurrent or interrupted run never reads a partial entry
+    with open(path + ".tmp", "w") as file:
+        json.dump({"key": list(key), "created": time.time(), "items": items}, file)
+    os.replace(path + ".tmp", path)
+
+
+def get_listing_path(key):
+    return os.path.join(Context.listing_cache_dir, hashlib.sha1(json.dumps(key).encode()).hexdigest() + ".json")
@@ -0,0 +1,133 @@
+import base64
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+
+import log
+import metrics
+from context import Context
+
+HARNESS_FOLDER = ".harness"
+# Commands that talk to the remote, recorded in the metrics like the REST calls
+REMOTE_COMMANDS = {"clone", "fetch", "push"}
+
+_clones = {}
+_clones_lock = threading.Lock()
+
+logger = log.get_logger("local_git")
+
+
+class Clone:
+    """Shallow, sparse local clone of a repo in which the migration branch is built and then pushed once."""
+
+    def __init__(self, path, repo_url, token):
+        self.path = path
+        self.repo_url = repo_url
+        self.token = token
+
+    def git(self, *args):
+        """Runs git in the clone, prints its error and returns None if it fails, its stdout otherwise."""
+        return run_git(list(args), self.path, self.repo_url, self.token)
+
+
+def create_branch(token, repo, branch, repo_url):
+    """Clones the default branch of the repo and checks out the migration branch, replacing any previous clone.
+
+    Every branch of a repo gets its own clone, so that the shards of a repo are built and pushed independently.
+    """
+    with _clones_lock:
+        _clones.pop((repo_url, branch), None)
+    return get_clone(token, repo, branch, repo_url, fresh=not Context.resume) is not None
+
+
+def get_clone(token, repo, branch, repo_url, fresh=False):
+    with _clones_lock:
+        clone = _clones.get((repo_url, branch))
+    if clone is not None:
+        return clone
+    path = get_clone_path(repo_url, branch)
+    clone = Clone(path, repo_url, token)
+    if fresh or not os.path.isdir(os.path.join(path, ".git")):
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Only the tip of the default branch and the .harness folder are fetched and checked out
+        logger.info("Cloning the repo", repo=repo, path=path)
+        if run_git(["clone", "--depth", "1", "--filter=blob:none", "--sparse", get_fetch_url(repo_url), path],
+                   None, repo_url, token) is None:
+            return None
+        if clone.git("sparse-checkout", "set", HARNESS_FOLDER) is None or \
+                clone.git("checkout", "-B", branch) is None:
+            return None
+    else:
+        # Resumed run: the files written by the interrupted run are still staged in the clone
+        logger.info("Reusing the clone of the resumed run", repo=repo, path=path)
+    with _clones_lock:
+        return _clones.setdefault((repo_url, branch), clone)
+
+
+def write_files(token, repo, branch, repo_url, files):
+    """Writes (file_path, content) pairs into the working tree and stages them, returns the staged paths."""
+    clone = get_clone(token, repo, branch, repo_url)
+    if clone is None:
+        return None
+    for file_path, file_content in files:
+        target = os.path.join(clone.path, file_path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "w", newline="") as file:
+            file.write(file_content)
+    paths = [file_path for file_path, _ in files]
+    if clone.git("add", "--sparse", "--", *paths) is None:
+        return None
+    return paths
+
+
+def push_branch(token, repo, branch, repo_url, commit_message):
+    """Commits everything staged in one commit and pushes the branch, returns False if there was nothing to push."""
+    clone = get_clone(token, repo, branch, repo_url)
+    if clone is None:
+        return None
+    if run_git(["diff", "--cached", "--quiet"], clone.path, repo_url, token, quiet=True) is not None:
+        logger.info("No changes to push", repo=repo, branch=branch)
+        return False
+    if clone.git("-c", f"user.name={Context.git_author_name}", "-c", f"user.email={Context.git_author_email}",
+                 "commit", "--quiet", "-m", commit_message) is None:
+        return None
+    if clone.git("push", "--quiet", get_fetch_url(repo_url), f"HEAD:refs/heads/{branch}") is None:
+        return None
+    logger.info("✅ Branch pushed", repo=repo, branch=branch)
+    return True
+
+
+def run_git(args, cwd, repo_url, token, quiet=False):
+    command = ["git"]
+    if token and repo_url.startswith(("https://", "http://")):
+        # Passed per command so that the token is never written to the clone's config
+        credentials = base64.b64encode(f"{Context.git_username}:{token}".encode()).decode()
+        command += ["-c", f"http.extraHeader=Authorization: Basic {credentials}"]
+    started = time.monotonic()
+    result = subprocess.run(command + args, cwd=cwd, capture_output=True, text=True)
+    duration = time.monotonic() - started
+    if args[0] in REMOTE_COMMANDS:
+        metrics.record("git." + args[0], "ok" if result.returncode == 0 else "error", duration)
+    logger.debug("git command", command=args[0], repo_url=repo_url, exit_code=result.returncode,
+                 duration_ms=round(duration * 1000, 1))
+    if result.returncode != 0:
+        if not quiet:
+            logger.error("git command failed", command=args[0], repo_url=repo_url, exit_code=result.returncode,
+                         stderr=result.stderr.strip())
+        return None
+    return result.stdout
+
+
+def get_fetch_url(repo_url):
+    # Local bare repos are cloned through file:// so that --depth and --filter apply to them too
+    if os.path.isdir(repo_url):
+        return "file://" + os.path.abspath(repo_url)
+    return repo_url
+
+
+def get_clone_path(repo_url, branch):
+    return os.path.join(Context.clone_dir, re.sub(r"[^\w.-]+", "_", repo_url.split("://")[-1].strip("/")), branch)
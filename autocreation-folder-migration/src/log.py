@@ -0,0 +1,87 @@
+import json
+import logging
+import random
+import sys
+
+from context import Context
+
+# Fields logged with every payload event are cut to this many characters
+MAX_PAYLOAD_LENGTH = 2000
+RESERVED_ARGUMENTS = ("exc_info", "stack_info", "stacklevel", "extra")
+
+
+class EventLogger(logging.LoggerAdapter):
+    """Logger whose keyword arguments become the fields of a one-line event.
+
+        log.info("Pipeline committed", entity=pipeline_id, repo=repo, duration_ms=12.5)
+    """
+
+    def process(self, msg, kwargs):
+        fields = {key: kwargs.pop(key) for key in list(kwargs) if key not in RESERVED_ARGUMENTS}
+        kwargs["extra"] = {"fields": fields}
+        return msg, kwargs
+
+    def payload(self, msg, payload, sample=True, **fields):
+        """Debug event carrying a request or response body.
+
+        Bodies are only serialised at DEBUG level and, when sample is set, for Context.log_sample_rate of the calls.
+        """
+        if not self.isEnabledFor(logging.DEBUG):
+            return
+        if sample and random.random() >= Context.log_sample_rate:
+            return
+        text = payload if isinstance(payload, str) else json.dumps(payload, default=str)
+        if len(text) > MAX_PAYLOAD_LENGTH:
+            text = text[:MAX_PAYLOAD_LENGTH] + f"... ({len(text)} characters)"
+        self.debug(msg, payload=text, **fields)
+
+    def failed(self, msg, response, **fields):
+        """Error event for a call that failed with response, whose body is only logged at DEBUG level."""
+        self.error(msg, status=response.status_code, **fields)
+        self.payload(msg, response.text, sample=False, status=response.status_code, **fields)
+
+
+class EventFormatter(logging.Formatter):
+    """Formats events on one line, as `time level logger message key=value ...` or as a JSON object."""
+
+    def __init__(self, json_format):
+        super().__init__(datefmt="%Y-%m-%dT%H:%M:%S")
+        self.json_format = json_format
+
+    def format(self, record):
+        fields = getattr(record, "fields", {})
+        if self.json_format:
+            event = {"time": self.formatTime(record, self.datefmt), "level": record.levelname, "logger": record.name,
+                     "message": record.getMessage()}
+            event.update(fields)
+            if record.exc_info:
+                event["exception"] = self.formatException(record.exc_info)
+            return json.dumps(event, default=str, ensure_ascii=False)
+        line = f"{self.formatTime(record, self.datefmt)} {record.levelname:<7} {record.name}: {record.getMessage()}"
+        if fields:
+            line += " " + " ".join(f"{key}={format_value(value)}" for key, value in fields.items())
+        if record.exc_info:
+            line += " exception=" + json.dumps(self.formatException(record.exc_info))
+        return line
+
+
+def format_value(value):
+    text = str(value)
+    if text == "" or any(character.isspace() or character in '"=' for character in text):
+        return json.dumps(text, ensure_ascii=False)
+    return text
+
+
+def get_logger(name):
+    return EventLogger(logging.getLogger("gitx." + name), {})
+
+
+def setup_logging(level=None, log_format=None, log_file=None):
+    """Sends the gitx events to stdout, or to log_file, at the configured level and format."""
+    handler = logging.FileHandler(log_file or Context.log_file) if (log_file or Context.log_file) \
+        else logging.StreamHandler(sys.stdout)
+    handler.setFormatter(EventFormatter((log_format or Context.log_format) == "json"))
+    logger = logging.getLogger("gitx")
+    logger.handlers = [handler]
+    logger.setLevel((level or Context.log_level).upper())
+    logger.propagate = False
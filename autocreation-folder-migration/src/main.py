@@ -1,46 +1,253 @@
-from pipelines import process_pipelines, update_pipeline_file_path
-from inputsets import process_input_sets, update_input_set_file_path
-from templates import process_templates, update_template_file_path
-from services import process_services, update_service_file_path
-from environments import process_environments, update_env_file_path
-from infras import process_infras, update_infra_file_path
+from pipelines import stream_pipelines, update_pipeline_file_path
+from inputsets import stream_input_sets, update_input_set_file_path
+from templates import stream_templates, update_template_file_path
+from services import stream_services, update_service_file_path
+from environments import stream_environments, update_env_file_path
+from infras import stream_infras, update_infra_file_path
+import argparse
+import atexit
+import threading
 import time
-from git import fork_branch, commit_file, create_pull_request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from git import PR_TITLE, fork_branch, commit_file, commit_files, create_pull_request, push_branch, is_local, \
+    get_shard_branch, get_shard_label, get_shard_path, get_shard_prefix, is_sharded, parse_shard_branch
 from context import Context
+from scopes import ENTITY_TYPES, is_supported, list_scopes
+from utility import map_concurrently
+import async_engine
+import journal
+import log
+import metrics
+import plan
+import updates
 
 
 ORG_ID = "default"
 PROJECT_ID = "test_mohit_11_march"
 
+logger = log.get_logger("main")
+
+
+class RepoChain:
+    """Work queued for one branch of a repo: the fork, the commits and finally the pull request, run in order.
+
+    A repo has a single chain on the run's branch, or one per shard when pull requests are limited in size.
+    """
+
+    def __init__(self, shard_details, forked):
+        self.repo, self.repo_url, self.branch = shard_details
+        self.work = deque()
+        self.running = False
+        self.forked = forked
+        self.failed = False
+        # (entity_type, org_id, project_id, file_path) staged in the local clone, committed once the branch is pushed
+        self.staged = []
+
+
+class Shard:
+    """Files of a repo under one path prefix that are committed to the same branch and pull request."""
+
+    def __init__(self, label, part):
+        self.label = label
+        self.part = part
+        self.files = 0
+        self.bytes = 0
+
+    def is_full(self, size):
+        if self.files == 0:
+            # A file larger than Context.pr_max_bytes still gets a shard of its own
+            return False
+        return (Context.pr_max_files > 0 and self.files >= Context.pr_max_files) or \
+            (Context.pr_max_bytes > 0 and self.bytes + size > Context.pr_max_bytes)
+
+
+class Migration:
+    """Branch and repos of one operation-1 run, shared by every scope migrated in it.
+
+    Every branch progresses on its own: its work runs in order, one task at a time, while up to
+    Context.repo_concurrency branches are worked on in parallel. A slow repo only delays itself, a branch that can't
+    be created is skipped without affecting the others. When resuming, the branch and the shards forked by the
+    interrupted run come from the journal.
+    """
+
+    def __init__(self, branch):
+        self.branch = journal.get_branch(branch)
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.chains = {shard_details: RepoChain(shard_details, forked=True)
+                       for shard_details in journal.journaled_repos()}
+        self.shards = {}
+        # A resumed run puts its files in new parts, the shards of the interrupted run only get their pull request
+        self.resumed_parts = {}
+        for repo, repo_url, shard_branch in self.chains:
+            shard = parse_shard_branch(self.branch, shard_branch)
+            if shard is not None:
+                label, part = shard
+                self.resumed_parts[(repo_url, label)] = max(part, self.resumed_parts.get((repo_url, label), 0))
+        self.outstanding = 0
+        # Tasks queued across branches, so that the fetch stream stays at most Context.queue_depth commits ahead
+        self.pending = threading.Semaphore(Context.queue_depth)
+        self.executor = ThreadPoolExecutor(max_workers=Context.repo_concurrency)
+
+    def get_shard(self, entity_data, size):
+        """Returns the (repo, repo_url, branch) the entity is committed to.
+
+        Without pull request limits that is the run's branch. With them the files of a repo are grouped by their
+        .harness/orgs/<org>/projects/<project>/ subtree, and every group is split into parts of at most
+        Context.pr_max_files files and Context.pr_max_bytes bytes, each forked and reviewed on its own branch.
+        """
+        if not is_sharded():
+            return entity_data.repo, entity_data.repo_url, self.branch
+        prefix = get_shard_prefix(entity_data.target_file_path)
+        with self.lock:
+            shard = self.shards.get((entity_data.repo_url, prefix))
+            if shard is None or shard.is_full(size):
+                label = get_shard_label(prefix)
+                part = shard.part if shard is not None else self.resumed_parts.get((entity_data.repo_url, label), 0)
+                shard = self.shards[(entity_data.repo_url, prefix)] = Shard(label, part + 1)
+            shard.files += 1
+            shard.bytes += size
+        return entity_data.repo, entity_data.repo_url, get_shard_branch(self.branch, shard.label, shard.part)
+
+    def submit(self, shard_details, task):
+        """Queues task(chain) after the work already queued for the branch, blocks while too many tasks are queued."""
+        self.pending.acquire()
+        with self.lock:
+            chain = self.chains.get(shard_details)
+            if chain is None:
+                chain = self.chains[shard_details] = RepoChain(shard_details, forked=False)
+            chain.work.append(task)
+            self.outstanding += 1
+            if chain.running:
+                return
+            chain.running = True
+        self.executor.submit(self.run_next, chain)
+
+    def run_next(self, chain):
+        # Runs one task of the branch and requeues the branch behind the others, so that busy branches take turns
+        with self.lock:
+            task = chain.work.popleft()
+        try:
+            if not chain.failed:
+                task(chain)
+        except Exception:
+            logger.exception("Repo task failed", repo=chain.repo, branch=chain.branch)
+        self.pending.release()
+        with self.lock:
+            self.outstanding -= 1
+            if self.outstanding == 0:
+                self.idle.notify_all()
+            if len(chain.work) == 0:
+                chain.running = False
+                return
+        self.executor.submit(self.run_next, chain)
+
+    def commit(self, entity_type, shard_details, entities):
+        self.submit(shard_details, lambda chain: self.commit_entities(chain, entity_type, entities))
+
+    def commit_entities(self, chain, entity_type, entities):
+        if not self.fork_once(chain):
+            return
+        if Context.commit_mode == "batch":
+            files = [(entity_data.target_file_path, entity_data.yaml) for entity_data in entities]
+            committed = commit_files(Context.git_token, chain.repo, chain.branch, chain.repo_url, files) is not None
+        else:
+            entity_data = entities[0]
+            committed = commit_file(Context.git_token, chain.repo, chain.branch, chain.repo_url,
+                                    entity_data.target_file_path, entity_data.yaml) is not None
+        if not committed:
+            return
+        for entity_data in entities:
+            if is_local():
+                chain.staged.append((entity_type, entity_data.org_identifier, entity_data.project_identifier,
+                                     entity_data.target_file_path))
+            else:
+                journal.record_migration(entity_type, entity_data, journal.COMMITTED)
+
+    def fork_once(self, chain):
+        if not chain.forked:
+            if not fork_branch(Context.git_token, chain.branch, chain.repo, chain.repo_url):
+                # Nothing can be committed without the branch, its remaining work is dropped
+                logger.error("Skipping the branch, it couldn't be created", repo=chain.repo, branch=chain.branch)
+                chain.failed = True
+                return False
+            journal.record_repo(chain.repo, chain.repo_url, chain.branch, journal.FORKED)
+            chain.forked = True
+        return True
+
+    def finish(self):
+        """Queues the pull request of every branch after its commits and waits until every branch is done."""
+        with self.lock:
+            shard_details_list = list(self.chains)
+        for shard_details in shard_details_list:
+            self.submit(shard_details, self.raise_pr)
+        with self.idle:
+            self.idle.wait_for(lambda: self.outstanding == 0)
+        self.executor.shutdown()
+        failed = [chain.branch for chain in self.chains.values() if chain.failed]
+        logger.info("Repos migrated", repos=len({(repo, repo_url) for repo, repo_url, _ in self.chains}),
+                    branches=len(self.chains) - len(failed), failed_branches=len(failed))
+
+    def raise_pr(self, chain):
+        if not chain.forked or journal.repo_state(chain.repo, chain.repo_url, chain.branch) == journal.PR_RAISED:
+            return
+        title = body = PR_TITLE
+        shard = parse_shard_branch(self.branch, chain.branch)
+        if shard is not None:
+            label, part = shard
+            title = f"{PR_TITLE} ({label}, part {part})"
+            body = f"{PR_TITLE}\n\nPart {part} of the files under `{get_shard_path(label)}`."
+        if not push_branch(Context.git_token, chain.repo, chain.branch, chain.repo_url):
+            return
+        # Only pushed files count as committed, a resumed run writes the others again, even into a new clone
+        for entity_type, org_id, project_id, file_path in chain.staged:
+            journal.record_entity(1, entity_type, org_id, project_id, file_path, journal.COMMITTED)
+        chain.staged = []
+        if create_pull_request(Context.git_token, chain.repo, chain.branch, chain.repo_url, title, body) is not None:
+            journal.record_repo(chain.repo, chain.repo_url, chain.branch, journal.PR_RAISED)
+
 
 def handle_operation_1(entity_type, org_id, project_id):
+    if Context.engine == "async":
+        async_engine.handle_operation_1(entity_type, org_id, project_id, journal.get_branch(get_branch_name()))
+        return
+    entity_data_stream = stream_entities(entity_type, org_id, project_id)
+    if entity_data_stream is None:
+        logger.error("Invalid entity type as input", entity_type=entity_type)
+        return
+    migration = Migration(get_branch_name())
+    commit_entities(entity_type, entity_data_stream, migration)
+    migration.finish()
+
+
+def stream_entities(entity_type, org_id, project_id):
+    # Entities are committed as soon as their details arrive, the fetch workers stay at most
+    # Context.queue_depth entities ahead of the commits
     if entity_type == "PIPELINE":
-        entity_data_list = process_pipelines(Context.api_key, Context.account_id, org_id, project_id)
+        entity_data_stream = stream_pipelines(Context.api_key, Context.account_id, org_id, project_id)
     elif entity_type == "INPUTSET":
-        entity_data_list = process_input_sets(Context.api_key, Context.account_id, org_id, project_id)
+        entity_data_stream = stream_input_sets(Context.api_key, Context.account_id, org_id, project_id)
     elif entity_type == "TEMPLATE":
-        entity_data_list = process_templates(Context.api_key, Context.account_id, org_id, project_id)
+        entity_data_stream = stream_templates(Context.api_key, Context.account_id, org_id, project_id)
     elif entity_type == "SERVICE":
-        entity_data_list = process_services(Context.api_key, Context.account_id, org_id, project_id)
+        entity_data_stream = stream_services(Context.api_key, Context.account_id, org_id, project_id)
     elif entity_type == "ENV":
-        entity_data_list = process_environments(Context.api_key, Context.account_id, org_id, project_id)
+        entity_data_stream = stream_environments(Context.api_key, Context.account_id, org_id, project_id)
     elif entity_type == "INFRA":
-        entity_data_list = process_infras(Context.api_key, Context.account_id, org_id, project_id)
+        entity_data_stream = stream_infras(Context.api_key, Context.account_id, org_id, project_id)
     else:
-        print("Invalid entity type as input: " + entity_type)
-        return
-    print(entity_data_list)
-    branch = get_branch_name()
-    fork_branches(entity_data_list, branch)
-    for entity_data in entity_data_list:
-        commit_file(Context.git_token, entity_data.repo, branch, entity_data.repo_url, entity_data.target_file_path, entity_data.yaml)
-    raise_pr(entity_data_list, branch)
+        return None
+    return entity_data_stream
 
 
 def handle_operation_2(entity_type, org_id, project_id):
+    if Context.engine == "async":
+        async_engine.handle_operation_2(entity_type, org_id, project_id)
+        return
     if entity_type == "PIPELINE":
         update_pipeline_file_path(Context.api_key, Context.account_id, org_id, project_id)
-    if entity_type == "INPUTSET":
+    elif entity_type == "INPUTSET":
         update_input_set_file_path(Context.api_key, Context.account_id, org_id, project_id)
     elif entity_type == "TEMPLATE":
         update_template_file_path(Context.api_key, Context.account_id, org_id, project_id)
@@ -51,48 +258,281 @@ def handle_operation_2(entity_type, org_id, project_id):
     elif entity_type == "INFRA":
         update_infra_file_path(Context.api_key, Context.account_id, org_id, project_id)
     else:
-        print("Invalid entity type as input: " + entity_type)
+        logger.error("Invalid entity type as input", entity_type=entity_type)
 
 
-def raise_pr(entity_data_list, branch):
-    repo_details_list = get_repo_details(entity_data_list)
-    for repo_details in repo_details_list:
-        create_pull_request(Context.git_token, repo_details[0], branch, repo_details[1])
+def handle_plan(entity_type, org_id, project_id):
+    """Fetches the entities like operation-1 but writes their plan instead of committing them."""
+    entity_data_stream = stream_entities(entity_type, org_id, project_id)
+    if entity_data_stream is None:
+        logger.error("Invalid entity type as input", entity_type=entity_type)
+        return None
+    return plan.write_plan(entity_type, org_id, project_id, entity_data_stream)
 
 
-def fork_branches(entity_data_list, branch):
-    repo_details_list = get_repo_details(entity_data_list)
-    for repo_details in repo_details_list:
-        fork_branch(Context.git_token, branch, repo_details[0], repo_details[1])
+def apply_plans(operation_type):
+    """Runs the operation on the plans of Context.plan_dir, without listing anything in Harness.
 
+    Operation-1 fetches the planned entities and commits them, operation-2 points Harness to their target paths.
+    """
+    plans = plan.load_plans()
+    if operation_type == "1":
+        migration = Migration(get_branch_name())
+        for header, entries in plans:
+            commit_entities(header["kind"], plan.stream_plan(entries), migration)
+        migration.finish()
+    else:
+        updates.run_updates(Context.api_key, [update for _, entries in plans for update in plan.plan_updates(entries)])
+
+
+def commit_entities(entity_type, entity_data_stream, migration):
+    """Hands the entities to the workers of their branch as they arrive, the branch is forked by the first one.
 
-def get_repo_details(entity_data_list):
-    repo_details_list = set()
-    for entity_data in entity_data_list:
-        repo_details_list.add((entity_data.repo, entity_data.repo_url))
-    return repo_details_list
+    In batch mode files are buffered per branch and committed every Context.commit_batch_size files, or before the
+    commit would exceed Context.commit_max_bytes.
+    """
+    files_by_shard = {}
+    for entity_data in entity_data_stream:
+        journal.record_migration(entity_type, entity_data, journal.FETCHED)
+        size = entity_data.yaml_size
+        shard_details = migration.get_shard(entity_data, size)
+        entities, batch_size = files_by_shard.get(shard_details, ([], 0))
+        if Context.commit_mode == "batch" and len(entities) > 0 and 0 < Context.commit_max_bytes < batch_size + size:
+            migration.commit(entity_type, shard_details, entities)
+            entities, batch_size = [], 0
+        entities.append(entity_data)
+        files_by_shard[shard_details] = (entities, batch_size + size)
+        if Context.commit_mode == "batch" and len(entities) < Context.commit_batch_size:
+            continue
+        files_by_shard[shard_details] = ([], 0)
+        migration.commit(entity_type, shard_details, entities)
+    for shard_details, (entities, _) in files_by_shard.items():
+        if len(entities) > 0:
+            migration.commit(entity_type, shard_details, entities)
+
+
+def crawl(operation_type, entity_types):
+    """Runs the operation for the entity types at the account, every org and every project in one process.
+
+    Up to Context.scope_concurrency scopes are processed at once. In operation-1 every repo gets one branch and one
+    pull request for the whole account, or one per shard with Context.pr_max_files or Context.pr_max_bytes.
+    """
+    scopes = list_scopes(Context.api_key, Context.account_id)
+    work = [(entity_type, org_id, project_id) for org_id, project_id in scopes for entity_type in entity_types
+            if is_supported(entity_type, org_id, project_id)]
+    logger.info("Crawling the account", scopes=len(scopes), work_items=len(work))
+    if operation_type == "plan":
+        plan.log_totals(map_concurrently(lambda item: handle_plan(*item), work, Context.scope_concurrency))
+        return
+    if Context.engine == "async":
+        async_engine.handle_crawl(int(operation_type), work, journal.get_branch(get_branch_name()))
+        return
+    migration = Migration(get_branch_name())
+
+    def migrate_scope(item):
+        entity_type, org_id, project_id = item
+        logger.info("Processing scope", entity_type=entity_type, org=org_id, project=project_id)
+        try:
+            if operation_type == "1":
+                commit_entities(entity_type, stream_entities(entity_type, org_id, project_id), migration)
+            else:
+                handle_operation_2(entity_type, org_id, project_id)
+        except Exception:
+            logger.exception("Scope failed", entity_type=entity_type, org=org_id, project=project_id)
+
+    map_concurrently(migrate_scope, work, Context.scope_concurrency)
+    if operation_type == "1":
+        migration.finish()
 
 
 def get_branch_name():
     return "HARNESS_GITX_" + str(int(time.time() * 1000))
 
 
-# Press the green button in the gutter to run the script.
-if __name__ == '__main__':
-    Context.init()
+def parse_args():
+    parser = argparse.ArgumentParser(description="Migrate Harness GitX entities to the autocreation folder structure")
+    parser.add_argument("command", nargs="?", choices=["plan", "apply-op1", "apply-op2"], default=None,
+                        help="plan: write the migration plan of the scope (or of the account with --crawl) to "
+                             "--plan-dir; apply-op1/apply-op2: run operation 1/2 on those plans without listing")
+    parser.add_argument("--plan-dir", default=None, metavar="DIR",
+                        help="Folder the plans are written to and applied from (default: gitx-plan)")
+    parser.add_argument("--shard", default=None, metavar="K/N",
+                        help="Only apply the repos of shard K of N (0 <= K < N), to spread a plan over N machines")
+    parser.add_argument("--concurrency", type=int, default=None,
+                        help="Number of entity details fetched from Harness in parallel (default: 1)")
+    parser.add_argument("--commit-mode", choices=["file", "batch"], default=None,
+                        help="Commit every file separately (file) or all files of a repo in one commit (batch)")
+    parser.add_argument("--fetch-mode", choices=["api", "archive"], default=None,
+                        help="Read entity YAMLs through the Harness API (api) or from one tarball per repo (archive)")
+    parser.add_argument("--git-backend", choices=["rest", "local"], default=None,
+                        help="Write files through the GitHub REST API (rest) or in a local clone pushed once (local)")
+    parser.add_argument("--commit-max-bytes", type=int, default=None, metavar="BYTES",
+                        help="In batch mode, start a new commit before one would exceed BYTES of YAML")
+    parser.add_argument("--pr-max-files", type=int, default=None, metavar="FILES",
+                        help="Split the files of a repo into pull requests of at most FILES files, one shard branch per "
+                             "org or project folder and part (default: one pull request per repo)")
+    parser.add_argument("--pr-max-bytes", type=int, default=None, metavar="BYTES",
+                        help="Split the files of a repo into pull requests of at most BYTES of YAML, like --pr-max-files")
+    parser.add_argument("--spill-yaml", action="store_true",
+                        help="Keep fetched YAMLs in a temporary file until they are committed instead of in memory")
+    parser.add_argument("--tree-snapshot", action="store_true",
+                        help="Read each repo's .harness tree once and only write new or changed files")
+    parser.add_argument("--engine", choices=["sync", "async"], default=None,
+                        help="Execution engine: threaded requests (sync) or asyncio/aiohttp coroutines (async)")
+    parser.add_argument("--crawl", action="store_true",
+                        help="Discover every org and project of the account and process all of them in one run")
+    parser.add_argument("--entity-types", default=None,
+                        help="Comma separated entity types to crawl (default: " + ",".join(ENTITY_TYPES) + ")")
+    parser.add_argument("--operation", choices=["1", "2"], default=None,
+                        help="Operation to run when crawling, asked interactively if not given")
+    parser.add_argument("--repo-concurrency", type=int, default=None,
+                        help="Number of repos whose branch, commits and pull request progress in parallel (default: 4)")
+    parser.add_argument("--scope-concurrency", type=int, default=None,
+                        help="Number of scopes processed in parallel when crawling (default: 4)")
+    parser.add_argument("--listing-cache", default=None, metavar="DIR",
+                        help="Keep complete Harness listings in DIR and reuse them for listing-cache-ttl seconds")
+    parser.add_argument("--metrics", default=None, metavar="PATH",
+                        help="JSON file the per-endpoint request metrics are written to at exit")
+    parser.add_argument("--metrics-prometheus", default=None, metavar="PATH",
+                        help="Also write the metrics in Prometheus text format, eg: for the node exporter textfile collector")
+    parser.add_argument("--metrics-interval", type=float, default=None, metavar="SECONDS",
+                        help="Also write the metrics every SECONDS while the run is in progress")
+    parser.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"], type=str.upper, default=None,
+                        help="Least severe events written to the log (default: INFO, DEBUG adds sampled payloads)")
+    parser.add_argument("--log-format", choices=["text", "json"], default=None,
+                        help="One key=value line (text) or one JSON object (json) per event")
+    parser.add_argument("--log-sample-rate", type=float, default=None, metavar="RATE",
+                        help="Share of request and response bodies written at DEBUG level (default: 0.01)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted run from its journal, skipping the work it completed")
+    parser.add_argument("--report", default=None,
+                        help="File the per-entity results of operation-2 are written to, CSV if it ends with .csv")
+    return parser.parse_args()
+
+
+def apply_args(args):
+    if args.concurrency is not None:
+        Context.concurrency = max(1, args.concurrency)
+    if args.commit_mode is not None:
+        Context.commit_mode = args.commit_mode
+    if args.fetch_mode is not None:
+        Context.fetch_mode = args.fetch_mode
+    if args.git_backend is not None:
+        Context.git_backend = args.git_backend
+    if args.commit_max_bytes is not None:
+        Context.commit_max_bytes = args.commit_max_bytes
+    if args.pr_max_files is not None:
+        Context.pr_max_files = args.pr_max_files
+    if args.pr_max_bytes is not None:
+        Context.pr_max_bytes = args.pr_max_bytes
+    if args.spill_yaml:
+        Context.spill_yaml = True
+    if args.tree_snapshot:
+        Context.tree_snapshot = True
+    if args.engine is not None:
+        Context.engine = args.engine
+    if args.repo_concurrency is not None:
+        Context.repo_concurrency = max(1, args.repo_concurrency)
+    if args.scope_concurrency is not None:
+        Context.scope_concurrency = max(1, args.scope_concurrency)
+    if args.listing_cache is not None:
+        Context.listing_cache_dir = args.listing_cache
+    if args.metrics is not None:
+        Context.metrics_path = args.metrics
+    if args.metrics_prometheus is not None:
+        Context.metrics_prometheus_path = args.metrics_prometheus
+    if args.metrics_interval is not None:
+        Context.metrics_interval = args.metrics_interval
+    if args.log_level is not None:
+        Context.log_level = args.log_level
+    if args.log_format is not None:
+        Context.log_format = args.log_format
+    if args.log_sample_rate is not None:
+        Context.log_sample_rate = args.log_sample_rate
+    Context.resume = args.resume
+    if args.report is not None:
+        Context.report_path = args.report
+    if args.plan_dir is not None:
+        Context.plan_dir = args.plan_dir
+    if args.shard is not None:
+        Context.shard_index, Context.shard_count = parse_shard(args.shard)
+    log.setup_logging()
+    if Context.git_backend == "local" and Context.engine == "async":
+        logger.warning("The local git backend runs on the sync engine, ignoring engine 'async'")
+        Context.engine = "sync"
+    if (is_sharded() or Context.commit_max_bytes > 0) and Context.engine == "async":
+        logger.warning("Commit and pull request size limits apply on the sync engine, ignoring engine 'async'")
+        Context.engine = "sync"
+    if args.command is not None and Context.engine == "async":
+        logger.warning("Plans are made and applied on the sync engine, ignoring engine 'async'")
+        Context.engine = "sync"
+
+
+def parse_shard(shard):
+    index, _, count = shard.partition("/")
+    if not (index.isdigit() and count.isdigit() and int(index) < int(count)):
+        raise SystemExit(f"Invalid shard '{shard}', expected K/N with 0 <= K < N, eg: 0/4")
+    return int(index), int(count)
+
+
+def get_entity_types(args):
+    if args.entity_types is None:
+        return ENTITY_TYPES
+    entity_types = []
+    for entity_type in args.entity_types.split(","):
+        entity_type = entity_type.strip().upper()
+        if entity_type in ENTITY_TYPES:
+            entity_types.append(entity_type)
+        else:
+            logger.error("Invalid entity type as input", entity_type=entity_type)
+    return entity_types
+
+
+def ask_scope():
     print("Please enter the entity scope:")
     org_id = input("Input org id (leave empty for ACCOUNT level operation): ")
     project_id = input("Input project id (leave empty for ACCOUNT/ORG level operation): ")
     entity_type = input("Please enter the entity-type to process (PIPELINE/INPUTSET/TEMPLATE/SERVICE/ENV/INFRA): ")
-    operation_type = input("Choose operation: \n1: Create new files and raise PR \n2: Update all file paths\n")
-    if operation_type == "1":
-        handle_operation_1(entity_type, org_id, project_id)
+    return entity_type, org_id, project_id
+
+
+# Press the green button in the gutter to run the script.
+if __name__ == '__main__':
+    args = parse_args()
+    Context.init()
+    apply_args(args)
+    if args.command != "plan":
+        # Planning doesn't change anything, it must not replace the journal of the run it prepares
+        journal.open_journal(Context.journal_path, Context.resume)
+    atexit.register(metrics.export)
+    if Context.metrics_interval > 0:
+        metrics.start_periodic_export(Context.metrics_interval)
+    if args.command in ("apply-op1", "apply-op2"):
+        apply_plans(args.command[-1])
+        if args.command == "apply-op2":
+            updates.write_report(Context.report_path)
+    elif args.command == "plan" and not args.crawl:
+        handle_plan(*ask_scope())
+    elif args.crawl:
+        operation_type = "plan" if args.command == "plan" else args.operation
+        if operation_type is None:
+            operation_type = input("Choose operation: \n1: Create new files and raise PR \n2: Update all file paths\n")
+        crawl(operation_type, get_entity_types(args))
+        if operation_type not in ("1", "plan"):
+            updates.write_report(Context.report_path)
     else:
-        handle_operation_2(entity_type, org_id, project_id)
+        entity_type, org_id, project_id = ask_scope()
+        operation_type = input("Choose operation: \n1: Create new files and raise PR \n2: Update all file paths\n")
+        if operation_type == "1":
+            handle_operation_1(entity_type, org_id, project_id)
+        else:
+            handle_operation_2(entity_type, org_id, project_id)
+            updates.write_report(Context.report_path)
 
 
 def exec_with_inputs():
     Context.init()
+    log.setup_logging()
     operation_type = "1"
     entity_type = "INFRA"
     if operation_type == "1":
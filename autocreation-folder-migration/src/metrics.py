@@ -0,0 +1,177 @@
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import log
+from context import Context
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+HARNESS_RESOURCES = {
+    "pipelines": "pipelines",
+    "inputSets": "inputsets",
+    "templates": "templates",
+    "servicesV2": "services",
+    "environmentsV2": "environments",
+    "infrastructures": "infras",
+    "organizations": "organizations",
+    "projects": "projects"
+}
+
+logger = log.get_logger("metrics")
+
+
+class EndpointMetrics:
+    """Calls made to one logical endpoint: status codes, retries, bytes and a latency histogram."""
+
+    def __init__(self):
+        self.count = 0
+        self.statuses = {}
+        self.retries = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)  # Calls per bucket, not cumulative
+
+    def add(self, status, seconds, bytes_sent, bytes_received, retry):
+        self.count += 1
+        self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+        if retry:
+            self.retries += 1
+        self.bytes_sent += bytes_sent
+        self.bytes_received += bytes_received
+        self.latency_sum += seconds
+        self.latency_max = max(self.latency_max, seconds)
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[index] += 1
+                break
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "statuses": dict(self.statuses),
+            "retries": self.retries,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "latency_sum_seconds": round(self.latency_sum, 6),
+            "latency_max_seconds": round(self.latency_max, 6),
+            "latency_avg_seconds": round(self.latency_sum / self.count, 6) if self.count else 0.0,
+            "latency_buckets": {str(bound): count for bound, count in zip(LATENCY_BUCKETS, self.buckets)}
+        }
+
+
+_endpoints = {}
+_lock = threading.Lock()
+_started = time.time()
+
+
+def record(endpoint, status, seconds, bytes_sent=0, bytes_received=0, retry=False):
+    """Records one outbound call. status is the HTTP status code, or "error" if no response was received."""
+    with _lock:
+        metrics = _endpoints.get(endpoint)
+        if metrics is None:
+            metrics = _endpoints[endpoint] = EndpointMetrics()
+        metrics.add(status, seconds, bytes_sent, bytes_received, retry)
+
+
+def snapshot():
+    with _lock:
+        return {endpoint: metrics.to_dict() for endpoint, metrics in sorted(_endpoints.items())}
+
+
+def harness_endpoint(path):
+    """Logical name of a Harness call, eg: pipelines.details, templates.update_git_metadata."""
+    parts = path.strip("/").split("/")
+    if "api" not in parts or parts.index("api") + 1 >= len(parts):
+        return "harness." + parts[-1]
+    rest = parts[parts.index("api") + 1:]
+    resource = HARNESS_RESOURCES.get(rest[0], rest[0])
+    if "git-metadata" in rest or "update-git-metadata" in rest:
+        return resource + ".update_git_metadata"
+    if len(rest) == 1 or rest[1] in ("list", "list-metadata"):
+        return resource + ".list"
+    return resource + ".details"
+
+
+def github_endpoint(method, url):
+    """Logical name of a GitHub call, eg: github.contents.put, github.git.trees.post."""
+    parts = urlparse(url).path.split("/repos/", 1)[-1].strip("/").split("/")[2:]
+    if len(parts) == 0:
+        name = "repos"
+    elif parts[0] == "git" and len(parts) > 1:
+        name = "git." + parts[1]
+    else:
+        name = parts[0]
+    return f"github.{name}.{method.lower()}"
+
+
+def export():
+    """Writes the metrics to Context.metrics_path as JSON and, if set, to Context.metrics_prometheus_path."""
+    endpoints = snapshot()
+    if Context.metrics_path:
+        write_file(Context.metrics_path, json.dumps({
+            "started": _started,
+            "exported": time.time(),
+            "latency_buckets_seconds": list(LATENCY_BUCKETS),
+            "endpoints": endpoints
+        }, indent=2))
+    if Context.metrics_prometheus_path:
+        write_file(Context.metrics_prometheus_path, to_prometheus(endpoints))
+
+
+def to_prometheus(endpoints):
+    """Prometheus text exposition format, for the node exporter's textfile collector."""
+    lines = []
+
+    def metric(name, kind, description):
+        lines.append(f"# HELP gitx_{name} {description}")
+        lines.append(f"# TYPE gitx_{name} {kind}")
+
+    metric("requests_total", "counter", "Outbound calls by logical endpoint and status code.")
+    for endpoint, metrics in endpoints.items():
+        for status, count in sorted(metrics["statuses"].items()):
+            lines.append(f'gitx_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+    metric("retries_total", "counter", "Outbound calls that were retries of a failed call.")
+    for endpoint, metrics in endpoints.items():
+        lines.append(f'gitx_retries_total{{endpoint="{endpoint}"}} {metrics["retries"]}')
+    metric("bytes_sent_total", "counter", "Request body bytes sent.")
+    for endpoint, metrics in endpoints.items():
+        lines.append(f'gitx_bytes_sent_total{{endpoint="{endpoint}"}} {metrics["bytes_sent"]}')
+    metric("bytes_received_total", "counter", "Response body bytes received.")
+    for endpoint, metrics in endpoints.items():
+        lines.append(f'gitx_bytes_received_total{{endpoint="{endpoint}"}} {metrics["bytes_received"]}')
+    metric("request_duration_seconds", "histogram", "Latency of outbound calls.")
+    for endpoint, metrics in endpoints.items():
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, metrics["latency_buckets"].values()):
+            cumulative += count
+            lines.append(f'gitx_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+        lines.append(f'gitx_request_duration_seconds_bucket{{endpoint="{endpoint}",le="+Inf"}} {metrics["count"]}')
+        lines.append(f'gitx_request_duration_seconds_sum{{endpoint="{endpoint}"}} {metrics["latency_sum_seconds"]}')
+        lines.append(f'gitx_request_duration_seconds_count{{endpoint="{endpoint}"}} {metrics["count"]}')
+    return "\n".join(lines) + "\n"
+
+
+def write_file(path, content):
+    # Written aside and renamed, so that collectors never read a half written file
+    with open(path + ".tmp", "w") as file:
+        file.write(content)
+    os.replace(path + ".tmp", path)
+
+
+def start_periodic_export(interval):
+    """Exports the metrics every `interval` seconds until the process exits."""
+    def flush():
+        while True:
+            time.sleep(interval)
+            try:
+                export()
+            except OSError as ex:
+                logger.error("Failed to export metrics", error=str(ex))
+
+    threading.Thread(target=flush, daemon=True).start()
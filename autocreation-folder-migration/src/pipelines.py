@@ -1,120 +1,139 @@
-import requests
-from utility import EntityDetails
+import time
+
+import log
+from context import Context
+from harness_client import HarnessRequest, get_client
+from utility import EntityDetails, imap_concurrently, skip_inline
+from archives import read_archived_file
+from journal import is_done
+from listing_cache import list_cached
+from updates import Update, run_updates
+
+logger = log.get_logger("pipelines")
 
 
 def fetch_pipelines(api_key, account_identifier, org_identifier, project_identifier):
     """Fetches a list of pipelines from Harness for a given account, org, and project."""
 
-    page = 0
-    is_last_page = False
-    # Headers with authentication
-    headers = {
-        "Content-Type": "application/json",
-        "x-api-key": api_key  # API Key for authentication
-    }
-
-    pipelines = []
-
-    while not is_last_page:
-        url = (
-            f"https://app.harness.io/gateway/pipeline/api/pipelines/list?&"
-            f"accountIdentifier={account_identifier}&orgIdentifier={org_identifier}&projectIdentifier={project_identifier}&page={page}"
-        )
-
-        response = requests.post(url, headers=headers)
-        # Check response status
-        if response.status_code == 200:
-            data = response.json()
-            print(response.json())
-            content = data.get("data", {}).get("content", [])
-            if len(content) == 0:
-                is_last_page = True
-            pipelines.extend(content)
-            page += 1
-        else:
-            print(f"Error: {response.status_code}, {response.text}")
-            return []
-    print(pipelines)
+    request = list_pipelines_request(account_identifier, org_identifier, project_identifier)
+    pipelines, error = list_cached(api_key, "PIPELINE", account_identifier, org_identifier, project_identifier, request)
+    if error is not None:
+        # Keep the pages fetched so far, the remaining ones failed even after retries
+        logger.error("Failed to list pipelines", org=org_identifier, project=project_identifier,
+                     status=error.status_code, listed=len(pipelines))
+        logger.payload("Pipeline listing error", error.text, sample=False, status=error.status_code)
+    logger.info("Listed pipelines", org=org_identifier, project=project_identifier, count=len(pipelines))
+    logger.payload("Pipeline listing", pipelines, org=org_identifier, project=project_identifier)
     return pipelines
 
 
 def fetch_pipeline_details(api_key, account_id, org_id, project_id, pipeline_id):
     """Fetches details of a specific pipeline from Harness."""
 
-    # API URL to fetch pipeline details
-    url = (
-        f"https://app.harness.io/gateway/pipeline/api/pipelines/{pipeline_id}?"
-        f"accountIdentifier={account_id}&orgIdentifier={org_id}&projectIdentifier={project_id}"
-    )
-
-    # Headers with authentication
-    headers = {
-        "Content-Type": "application/json",
-        "x-api-key": api_key  # API Key for authentication
-    }
-
     # Send GET request to Harness API
-    response = requests.get(url, headers=headers)
+    started = time.monotonic()
+    response = get_client(api_key).send(pipeline_details_request(account_id, org_id, project_id, pipeline_id))
+    duration_ms = round((time.monotonic() - started) * 1000, 1)
 
     # Check response status
     if response.status_code == 200:
+        logger.debug("Fetched pipeline details", entity=pipeline_id, endpoint="pipelines.details",
+                     status=response.status_code, duration_ms=duration_ms)
         return response.json()  # Return pipeline details
     else:
-        print(f"Error: {response.status_code}, {response.text}")
+        logger.error("Failed to fetch pipeline details", entity=pipeline_id, endpoint="pipelines.details",
+                     status=response.status_code, duration_ms=duration_ms)
+        logger.payload("Pipeline details error", response.text, sample=False, entity=pipeline_id)
+        return None
+
+
+def update_pipeline_file_path(api_key, account_id, org_id, project_id):
+    pipeline_list = fetch_pipelines(api_key, account_id, org_id, project_id)
+    updates = []
+    for pipeline in pipeline_list:
+        if pipeline['storeType'] != 'INLINE':
+            updates.append(Update("PIPELINE", org_id, project_id, pipeline['identifier'],
+                                  get_target_file_path(org_id, project_id, pipeline['identifier']),
+                                  update_pipeline_git_metadata_request(account_id, org_id, project_id, pipeline['identifier'])))
+    run_updates(api_key, updates)
+
+
+def stream_pipelines(api_key, account_id, org_id, project_id):
+    """Yields the pipelines to migrate while the remaining details are still being fetched."""
+    pipeline_list = fetch_pipelines(api_key, account_id, org_id, project_id)
+    entity_data_list = imap_concurrently(
+        lambda pipeline: process_pipeline(api_key, account_id, org_id, project_id, pipeline),
+        skip_inline(pipeline_list, "pipelines"), Context.concurrency, Context.queue_depth)
+    return (entity_data for entity_data in entity_data_list if entity_data is not None)
+
+
+def process_pipeline(api_key, account_id, org_id, project_id, pipeline):
+    if is_done(1, get_target_file_path(org_id, project_id, pipeline["identifier"])):
+        return None
+    try:
+        pipeline_details = read_pipeline_details(pipeline) or \
+            fetch_pipeline_details(api_key, account_id, org_id, project_id, pipeline["identifier"])
+        if pipeline_details is None:
+            return None
+        return build_pipeline_entity(account_id, org_id, project_id, pipeline, pipeline_details)
+    except Exception:
+        logger.exception("Failed to process pipeline", entity=pipeline["identifier"])
+    return None
+
+
+def read_pipeline_details(pipeline):
+    """Pipeline details with the YAML read from the repo archive, None if it has to be fetched from Harness."""
+    yaml = read_archived_file(pipeline.get('gitDetails'))
+    if yaml is None:
+        return None
+    return {"data": {"storeType": pipeline['storeType'], "yamlPipeline": yaml, "gitDetails": pipeline['gitDetails']}}
+
+
+def build_pipeline_entity(account_id, org_id, project_id, pipeline, pipeline_details):
+    data = pipeline_details['data']
+    if data['storeType'] == 'INLINE':
         return None
+    entity_data = EntityDetails(account_id, org_id, project_id, pipeline['identifier'],
+                                data['yamlPipeline'], data['gitDetails']['repoName'],
+                                data['gitDetails']['repoUrl'])
+    entity_data.target_file_path = get_target_file_path_from_entity(entity_data)
+    entity_data.source_file_path = data['gitDetails']['filePath']
+    entity_data.source_branch = data['gitDetails'].get('branch') or ""
+    if entity_data.target_file_path == entity_data.source_file_path:
+        logger.info("Ignoring the pipeline as it is already under the conventional file path",
+                    entity=pipeline['identifier'], file_path=entity_data.target_file_path)
+        return None
+    return entity_data
 
 
-def update_pipeline_git_metadata(api_key, account_id, org_id, project_id, pipeline_id):
-    # URL to update Git metadata for the pipeline
-    url = f"https://app.harness.io/gateway/pipeline/api/pipelines/{pipeline_id}/update-git-metadata"
+def list_pipelines_request(account_id, org_id, project_id):
     params = {
         "accountIdentifier": account_id,
         "orgIdentifier": org_id,
         "projectIdentifier": project_id,
-        "filePath": get_target_file_path(org_id, project_id, pipeline_id)
-    }
-    # Headers for authentication
-    headers = {
-        "Content-Type": "application/json",
-        "x-api-key": api_key  # API Key for authentication
+        "page": 0,
+        "size": Context.page_size
     }
-
-    print(f"Updating pipeline filepath : {params} for pipeline id : {pipeline_id}")
-
-    # Make the PUT request to update the Git metadata
-    response = requests.put(url, headers=headers, params=params)
-    if response.status_code == 200:
-        print({"status": "success", "message": f"✅ Git metadata for pipeline {pipeline_id} updated successfully!"})
-    else:
-        print({"status": "error", "message": "Failed to update Git metadata", "details": response.json()})
+    return HarnessRequest("POST", "/pipeline/api/pipelines/list", params=params, page_param="page", idempotent=True)
 
 
-def update_pipeline_file_path(api_key, account_id, org_id, project_id):
-    pipeline_list = fetch_pipelines(api_key, account_id, org_id, project_id)
-    for pipeline in pipeline_list:
-        if pipeline['storeType'] != 'INLINE':
-            update_pipeline_git_metadata(api_key, account_id, org_id, project_id, pipeline['identifier'])
+def pipeline_details_request(account_id, org_id, project_id, pipeline_id):
+    params = {
+        "accountIdentifier": account_id,
+        "orgIdentifier": org_id,
+        "projectIdentifier": project_id
+    }
+    return HarnessRequest("GET", f"/pipeline/api/pipelines/{pipeline_id}", params=params)
 
 
-def process_pipelines(api_key, account_id, org_id, project_id):
-    pipeline_list = fetch_pipelines(api_key, account_id, org_id, project_id)
-    entity_data_list = []
-    for pipeline in pipeline_list:
-        try:
-            pipeline_details = fetch_pipeline_details(api_key, account_id, org_id, project_id, pipeline["identifier"])
-            data = pipeline_details['data']
-            if data['storeType'] != 'INLINE':
-                entity_data = EntityDetails(account_id, org_id, project_id, pipeline['identifier'],
-                                            data['yamlPipeline'], data['gitDetails']['repoName'],
-                                            data['gitDetails']['repoUrl'])
-                entity_data.target_file_path = get_target_file_path_from_entity(entity_data)
-                if entity_data.target_file_path == data['gitDetails']['filePath']:
-                    print("ignoring the pipeline as its already under conventional filepath:\nMetadata:" + str(pipeline) + "\nDetails:" + str(data))
-                    continue
-                entity_data_list.append(entity_data)
-        except Exception as ex:
-            print(ex)
-    return entity_data_list
+def update_pipeline_git_metadata_request(account_id, org_id, project_id, pipeline_id):
+    params = {
+        "accountIdentifier": account_id,
+        "orgIdentifier": org_id,
+        "projectIdentifier": project_id,
+        "filePath": get_target_file_path(org_id, project_id, pipeline_id)
+    }
+    return HarnessRequest("PUT", f"/pipeline/api/pipelines/{pipeline_id}/update-git-metadata", params=params)
 
 
 def get_target_file_path_from_entity(entity_data):
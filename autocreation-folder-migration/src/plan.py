@@ -0,0 +1,218 @@
+import json
+import math
+import os
+import zlib
+from collections import Counter
+
+import journal
+import log
+from context import Context
+from entities import ENTITY_SPECS
+from git import get_shard_prefix, is_sharded
+from github import git_blob_sha
+from harness_client import get_client
+from updates import Update
+from utility import imap_concurrently, is_empty
+
+PLAN_VERSION = 1
+PLAN_EXTENSION = ".jsonl"
+
+logger = log.get_logger("plan")
+
+
+def get_plan_path(entity_type, org_id, project_id):
+    # One file per entity type and scope, eg: PIPELINE.default.my_project.jsonl, or TEMPLATE.jsonl at account level
+    name = ".".join([entity_type] + [scope_id for scope_id in (org_id, project_id) if not is_empty(scope_id)])
+    return os.path.join(Context.plan_dir, name + PLAN_EXTENSION)
+
+
+def to_entry(entity_type, entity_data):
+    return {
+        "kind": entity_type,
+        "org_id": entity_data.org_identifier,
+        "project_id": entity_data.project_identifier,
+        "identifier": entity_data.identifier,
+        "parent_id": entity_data.parent_id,
+        "version": entity_data.version,
+        "sub_type": entity_data.sub_type,
+        "source_path": entity_data.source_file_path,
+        "source_branch": entity_data.source_branch,
+        "target_path": entity_data.target_file_path,
+        "repo": entity_data.repo,
+        "repo_url": entity_data.repo_url,
+        "content_sha": git_blob_sha(entity_data.yaml)
+    }
+
+
+def write_plan(entity_type, org_id, project_id, entity_data_stream):
+    """Writes the plan of an entity type in a scope: a header line, then one line per entity to migrate.
+
+    Entries are sorted by target path and hold no timestamps, so that plans of the same account can be diffed.
+    Returns the header.
+    """
+    entries = sorted((to_entry(entity_type, entity_data) for entity_data in entity_data_stream),
+                     key=lambda entry: entry["target_path"])
+    header = {
+        "plan_version": PLAN_VERSION,
+        "kind": entity_type,
+        "account_id": Context.account_id,
+        "org_id": org_id,
+        "project_id": project_id,
+        "entities": len(entries),
+        "repos": len({entry["repo_url"] for entry in entries}),
+        "estimate": estimate_calls(entries)
+    }
+    path = get_plan_path(entity_type, org_id, project_id)
+    os.makedirs(Context.plan_dir, exist_ok=True)
+    with open(path + ".tmp", "w") as file:
+        for line in [header] + entries:
+            file.write(json.dumps(line, sort_keys=True, separators=(",", ":")) + "\n")
+    os.replace(path + ".tmp", path)
+    logger.info("Plan written", path=path, entities=header["entities"], repos=header["repos"], **header["estimate"])
+    return header
+
+
+def estimate_calls(entries):
+    """Calls apply-op1 and apply-op2 will make for the entries with the current settings, none of them a listing.
+
+    Counted per repo of the plan, repos shared by several plans are created and get their pull request only once.
+    Shards are counted from Context.pr_max_files only, the plan doesn't hold the size of the files.
+    """
+    files_per_repo = Counter(entry["repo_url"] for entry in entries)
+    shards_per_repo = Counter()
+    if is_sharded():
+        files_per_prefix = Counter((entry["repo_url"], get_shard_prefix(entry["target_path"])) for entry in entries)
+        for (repo_url, _), files in files_per_prefix.items():
+            shards_per_repo[repo_url] += math.ceil(files / Context.pr_max_files) if Context.pr_max_files > 0 else 1
+    harness_calls = len(entries) if Context.fetch_mode == "api" else 0
+    github_calls = 0
+    for repo_url, files in files_per_repo.items():
+        shards = shards_per_repo[repo_url] or 1
+        github_calls += 2 + shards  # Repository and its default branch, then the pull request of every branch
+        if Context.fetch_mode == "archive":
+            github_calls += 1
+        if Context.git_backend == "local":
+            continue
+        github_calls += shards  # Branch creation
+        if Context.commit_mode == "batch":
+            github_calls += 2 * shards + 3 * max(shards, math.ceil(files / Context.commit_batch_size))
+        elif Context.tree_snapshot:
+            github_calls += 2 * shards + files
+        else:
+            github_calls += 2 * files
+    return {
+        "apply_op1_harness_calls": harness_calls,
+        "apply_op1_github_calls": github_calls,
+        "apply_op2_harness_calls": len(entries)
+    }
+
+
+def log_totals(headers):
+    totals = Counter()
+    for header in headers:
+        if header is not None:
+            totals.update(header["estimate"])
+            totals["entities"] += header["entities"]
+    logger.info("Plans written", plan_dir=Context.plan_dir, plans=sum(1 for header in headers if header is not None),
+                **totals)
+
+
+def read_plan(path):
+    with open(path) as file:
+        header = json.loads(file.readline())
+        entries = [json.loads(line) for line in file if line.strip()]
+    return header, entries
+
+
+def load_plans():
+    """Returns the (header, entries) of every plan of Context.plan_dir, keeping the entries of this machine's shard.
+
+    Plans are read in name order so that every machine of a sharded run sees them in the same order.
+    """
+    plans = []
+    for name in sorted(os.listdir(Context.plan_dir)):
+        if not name.endswith(PLAN_EXTENSION):
+            continue
+        header, entries = read_plan(os.path.join(Context.plan_dir, name))
+        if header.get("plan_version") != PLAN_VERSION:
+            logger.error("Unsupported plan version, skipping the plan", plan=name, version=header.get("plan_version"))
+            continue
+        if header["account_id"] != Context.account_id:
+            logger.error("Plan of another account, skipping it", plan=name, account=header["account_id"])
+            continue
+        entries = [entry for entry in entries if in_shard(entry)]
+        logger.info("Plan loaded", plan=name, entities=len(entries), shard=f"{Context.shard_index}/{Context.shard_count}")
+        plans.append((header, entries))
+    return plans
+
+
+def in_shard(entry):
+    # Shards split the plans by repo, so that the branch and pull request of a repo are built by a single machine
+    if Context.shard_count <= 1:
+        return True
+    return zlib.crc32(entry["repo_url"].encode()) % Context.shard_count == Context.shard_index
+
+
+def to_listing(entry):
+    """Rebuilds the scope, parent and listing item the entity specs expect from a plan entry."""
+    scope = (Context.account_id, entry["org_id"], entry["project_id"])
+    git_details = {
+        "repoName": entry["repo"],
+        "repoUrl": entry["repo_url"],
+        "filePath": entry["source_path"],
+        "branch": entry["source_branch"],
+        "fileUrl": f"{entry['repo_url']}/blob/{entry['source_branch']}/{entry['source_path']}"
+    }
+    entity = {"identifier": entry["identifier"], "versionLabel": entry["version"], "type": entry["sub_type"],
+              "storeType": "REMOTE", "gitDetails": git_details, "entityGitDetails": git_details}
+    parent = None
+    if entry["parent_id"]:
+        # The pipeline of an input set, or the environment of an infra which shares its type
+        parent = {"identifier": entry["parent_id"], "type": entry["sub_type"]}
+    return scope, parent, entity
+
+
+def fetch_entity(entry):
+    """Fetches the YAML of a planned entity, None if it is already done, can't be fetched or changed since the plan."""
+    if journal.is_done(1, entry["target_path"]):
+        return None
+    spec = ENTITY_SPECS[entry["kind"]]
+    scope, parent, entity = to_listing(entry)
+    try:
+        details = spec.archived_details(parent, entity)
+        if details is None:
+            response = get_client(Context.api_key).send(spec.details_request(scope, parent, entity))
+            if response.status_code != 200:
+                logger.failed("Failed to fetch a planned entity", response, entity_type=entry["kind"],
+                              entity=entry["identifier"])
+                return None
+            details = response.json()
+        entity_data = spec.build_entity(scope, parent, entity, details)
+    except Exception:
+        logger.exception("Failed to process a planned entity", entity_type=entry["kind"], entity=entry["identifier"])
+        return None
+    if entity_data is None:
+        logger.warning("Planned entity no longer needs to be migrated", entity_type=entry["kind"],
+                       entity=entry["identifier"])
+        return None
+    if git_blob_sha(entity_data.yaml) != entry["content_sha"]:
+        # Only the reviewed content is committed, plan again to migrate the new one
+        logger.warning("Entity changed since the plan, skipping it", entity_type=entry["kind"],
+                       entity=entry["identifier"], target_path=entry["target_path"])
+        return None
+    return entity_data
+
+
+def stream_plan(entries):
+    """Yields the EntityDetails of the entries, fetched like the listing streams of operation-1."""
+    entity_data_list = imap_concurrently(fetch_entity, entries, Context.concurrency, Context.queue_depth)
+    return (entity_data for entity_data in entity_data_list if entity_data is not None)
+
+
+def plan_updates(entries):
+    updates = []
+    for entry in entries:
+        scope, parent, entity = to_listing(entry)
+        updates.append(Update(entry["kind"], entry["org_id"], entry["project_id"], entry["identifier"],
+                              entry["target_path"], ENTITY_SPECS[entry["kind"]].update_request(scope, parent, entity)))
+    return updates
@@ -0,0 +1,67 @@
+import log
+from context import Context
+from harness_client import HarnessRequest, get_client
+from utility import is_empty, map_concurrently
+
+ENTITY_TYPES = ["PIPELINE", "INPUTSET", "TEMPLATE", "SERVICE", "ENV", "INFRA"]
+# Pipelines and input sets only exist inside a project
+PROJECT_LEVEL_ENTITY_TYPES = {"PIPELINE", "INPUTSET"}
+
+logger = log.get_logger("scopes")
+
+
+def fetch_organizations(api_key, account_id):
+    organizations, error = get_client(api_key).list_all(list_organizations_request(account_id))
+    if error is not None:
+        logger.error("Failed to list organizations", status=error.status_code, listed=len(organizations))
+        logger.payload("Organization listing error", error.text, sample=False)
+    return [element['organization'] for element in organizations]
+
+
+def fetch_projects(api_key, account_id, org_id):
+    projects, error = get_client(api_key).list_all(list_projects_request(account_id, org_id))
+    if error is not None:
+        logger.error("Failed to list projects", org=org_id, status=error.status_code, listed=len(projects))
+        logger.payload("Project listing error", error.text, sample=False, org=org_id)
+    return [element['project'] for element in projects]
+
+
+def list_scopes(api_key, account_id):
+    """Returns the (org_id, project_id) of the account, every org and every project, empty ids meaning a higher level."""
+    organizations = fetch_organizations(api_key, account_id)
+    project_lists = map_concurrently(
+        lambda organization: fetch_projects(api_key, account_id, organization['identifier']),
+        organizations, Context.concurrency)
+    return build_scopes(organizations, project_lists)
+
+
+def build_scopes(organizations, project_lists):
+    scopes = [("", "")]
+    for organization, projects in zip(organizations, project_lists):
+        scopes.append((organization['identifier'], ""))
+        for project in projects:
+            scopes.append((organization['identifier'], project['identifier']))
+    return scopes
+
+
+def is_supported(entity_type, org_id, project_id):
+    return entity_type not in PROJECT_LEVEL_ENTITY_TYPES or not (is_empty(org_id) or is_empty(project_id))
+
+
+def list_organizations_request(account_id):
+    params = {
+        "accountIdentifier": account_id,
+        "pageIndex": 0,
+        "pageSize": Context.page_size
+    }
+    return HarnessRequest("GET", "/ng/api/organizations", params=params, page_param="pageIndex")
+
+
+def list_projects_request(account_id, org_id):
+    params = {
+        "accountIdentifier": account_id,
+        "orgIdentifier": org_id,
+        "pageIndex": 0,
+        "pageSize": Context.page_size
+    }
+    return HarnessRequest("GET", "/ng/api/projects", params=params, page_param="pageIndex")
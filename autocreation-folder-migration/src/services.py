@@ -1,115 +1,139 @@
-import requests
-from utility import EntityDetails, get_repo_url, is_empty
-
-
-def fetch_services(api_key, account_identifier, org_identifier, project_identifier):
-    headers = {
-        "Content-Type": "application/json",
-        "x-api-key": api_key  # API Key for authentication
-    }
+import time
 
-    services = []
-    page = 0
-    while True:
-        try:
-            url = f"https://app.harness.io/ng/api/servicesV2?accountIdentifier={account_identifier}&orgIdentifier={org_identifier}&projectIdentifier={project_identifier}&page={page}"
-            # Send GET request to the Harness API
-            response = requests.get(url, headers=headers)
+import requests
+import log
+from context import Context
+from harness_client import HarnessRequest, get_client
+from utility import EntityDetails, get_repo_url, is_empty, imap_concurrently, skip_inline
+from archives import read_archived_file
+from journal import is_done
+from listing_cache import list_cached
+from updates import Update, run_updates
 
-            # Check if the request was successful
-            response.raise_for_status()
+logger = log.get_logger("services")
 
-            # Return the JSON response containing services
-            content = response.json()['data']['content']
-            if len(content) == 0:
-                return services
-            page += 1
-            services.extend(content)
 
-        except requests.exceptions.HTTPError as http_err:
-            print(f"HTTP error occurred: {http_err}")
-        except requests.exceptions.RequestException as req_err:
-            print(f"Request error occurred: {req_err}")
+def fetch_services(api_key, account_identifier, org_identifier, project_identifier):
+    request = list_services_request(account_identifier, org_identifier, project_identifier)
+    try:
+        # Send GET requests to the Harness API
+        services, error = list_cached(api_key, "SERVICE", account_identifier, org_identifier, project_identifier, request)
+        if error is not None:
+            logger.error("Failed to list services", org=org_identifier, project=project_identifier,
+                         status=error.status_code, listed=len(services))
+            logger.payload("Service listing error", error.text, sample=False, status=error.status_code)
+        logger.info("Listed services", org=org_identifier, project=project_identifier, count=len(services))
+        logger.payload("Service listing", services, org=org_identifier, project=project_identifier)
+        return services
 
+    except requests.exceptions.RequestException as req_err:
+        logger.error("Failed to list services", org=org_identifier, project=project_identifier, error=str(req_err))
+        return []
 
-def update_service_git_metadata(api_key, account_id, org_id, project_id, service_id):
-    url = f"https://app.harness.io/gateway/ng/api/servicesV2/{service_id}/update-git-metadata"
 
-    params = {
-        "accountIdentifier": account_id,
-        "orgIdentifier": org_id,
-        "projectIdentifier": project_id,
-        "filePath": get_target_file_path(org_id, project_id, service_id)
-    }
-    # Headers for authentication
-    headers = {
-        "Content-Type": "application/json",
-        "x-api-key": api_key  # API Key for authentication
-    }
+def update_service_file_path(api_key, account_id, org_id, project_id):
+    service_list = fetch_services(api_key, account_id, org_id, project_id)
+    updates = []
+    for element in service_list:
+        service = element['service']
+        if service['storeType'] != 'INLINE':
+            updates.append(Update("SERVICE", org_id, project_id, service['identifier'],
+                                  get_target_file_path(org_id, project_id, service['identifier']),
+                                  update_service_git_metadata_request(account_id, org_id, project_id, service['identifier'])))
+    run_updates(api_key, updates)
 
-    print(f"Updating service filepath : {params} for service id : {service_id}")
 
+def fetch_service_details(api_key, account_id, org_id, project_id, service_id):
+    started = time.monotonic()
     try:
-        response = requests.put(url, headers=headers, params=params)
+        response = get_client(api_key).send(service_details_request(account_id, org_id, project_id, service_id))
         response.raise_for_status()  # Raise an error for HTTP errors (4xx and 5xx)
+        logger.debug("Fetched service details", entity=service_id, endpoint="services.details",
+                     status=response.status_code, duration_ms=round((time.monotonic() - started) * 1000, 1))
         return response.json()
 
     except requests.exceptions.RequestException as e:
-        print(f"Error updating service Git metadata: {e}")
+        logger.error("Failed to fetch service details", entity=service_id, endpoint="services.details", error=str(e),
+                     duration_ms=round((time.monotonic() - started) * 1000, 1))
         return None
 
 
-def update_service_file_path(api_key, account_id, org_id, project_id):
+def stream_services(api_key, account_id, org_id, project_id):
     service_list = fetch_services(api_key, account_id, org_id, project_id)
-    for element in service_list:
-        service = element['service']
-        if service['storeType'] != 'INLINE':
-            update_service_git_metadata(api_key, account_id, org_id, project_id, service['identifier'])
+    entity_data_list = imap_concurrently(
+        lambda element: process_service(api_key, account_id, org_id, project_id, element['service']),
+        skip_inline(service_list, "services", lambda element: element['service']), Context.concurrency,
+        Context.queue_depth)
+    return (entity_data for entity_data in entity_data_list if entity_data is not None)
 
 
-def fetch_service_details(api_key, account_id, org_id, project_id, service_id):
-    url = f"https://app.harness.io/gateway/ng/api/servicesV2/{service_id}"
+def process_service(api_key, account_id, org_id, project_id, service):
+    if is_done(1, get_target_file_path(org_id, project_id, service["identifier"])):
+        return None
+    try:
+        service_details = read_service_details(service) or \
+            fetch_service_details(api_key, account_id, org_id, project_id, service["identifier"])
+        if service_details is None:
+            return None
+        return build_service_entity(account_id, org_id, project_id, service, service_details)
+    except Exception:
+        logger.exception("Failed to process service", entity=service["identifier"])
+    return None
+
+
+def read_service_details(service):
+    """Service details with the YAML read from the repo archive, None if it has to be fetched from Harness."""
+    yaml = read_archived_file(service.get('entityGitDetails'))
+    if yaml is None:
+        return None
+    return {"data": {"service": {"storeType": service['storeType'], "yaml": yaml,
+                                 "entityGitDetails": service['entityGitDetails']}}}
+
+
+def build_service_entity(account_id, org_id, project_id, service, service_details):
+    data = service_details['data']['service']
+    if data['storeType'] == 'INLINE':
+        return None
+    entity_data = EntityDetails(account_id, org_id, project_id, service['identifier'], data['yaml'],
+                                data['entityGitDetails']['repoName'], get_repo_url(data['entityGitDetails']['fileUrl'], data['entityGitDetails']['repoName']))
+    entity_data.target_file_path = get_target_file_path_from_entity(entity_data)
+    entity_data.source_file_path = data['entityGitDetails']['filePath']
+    entity_data.source_branch = data['entityGitDetails'].get('branch') or ""
+    if entity_data.target_file_path == entity_data.source_file_path:
+        logger.info("Ignoring the service as it is already under the conventional file path",
+                    entity=service['identifier'], file_path=entity_data.target_file_path)
+        return None
+    return entity_data
+
+
+def list_services_request(account_id, org_id, project_id):
     params = {
         "accountIdentifier": account_id,
         "orgIdentifier": org_id,
-        "projectIdentifier": project_id
-    }
-    # Headers for authentication
-    headers = {
-        "Content-Type": "application/json",
-        "x-api-key": api_key  # API Key for authentication
+        "projectIdentifier": project_id,
+        "page": 0,
+        "size": Context.page_size
     }
+    return HarnessRequest("GET", "/ng/api/servicesV2", params=params, page_param="page")
 
-    try:
-        response = requests.get(url, headers=headers, params=params)
-        response.raise_for_status()  # Raise an error for HTTP errors (4xx and 5xx)
-        return response.json()
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching service details: {e}")
-        return None
+def service_details_request(account_id, org_id, project_id, service_id):
+    params = {
+        "accountIdentifier": account_id,
+        "orgIdentifier": org_id,
+        "projectIdentifier": project_id
+    }
+    return HarnessRequest("GET", f"/ng/api/servicesV2/{service_id}", params=params)
 
 
-def process_services(api_key, account_id, org_id, project_id):
-    service_list = fetch_services(api_key, account_id, org_id, project_id)
-    entity_data_list = []
-    for element in service_list:
-        service = element['service']
-        try:
-            service_details = fetch_service_details(api_key, account_id, org_id, project_id, service["identifier"])
-            data = service_details['data']['service']
-            if data['storeType'] != 'INLINE':
-                entity_data = EntityDetails(account_id, org_id, project_id, service['identifier'], data['yaml'],
-                                            data['entityGitDetails']['repoName'], get_repo_url(data['entityGitDetails']['fileUrl'], data['entityGitDetails']['repoName']))
-                entity_data.target_file_path = get_target_file_path_from_entity(entity_data)
-                if entity_data.target_file_path == data['entityGitDetails']['filePath']:
-                    print("ignoring the service as its already under conventional filepath\nMetadata:" + str(
-                        service) + "\nDetails:" + str(data))
-                    continue
-                entity_data_list.append(entity_data)
-        except Exception as ex:
-            print(ex)
-    return entity_data_list
+def update_service_git_metadata_request(account_id, org_id, project_id, service_id):
+    params = {
+        "accountIdentifier": account_id,
+        "orgIdentifier": org_id,
+        "projectIdentifier": project_id,
+        "filePath": get_target_file_path(org_id, project_id, service_id)
+    }
+    return HarnessRequest("PUT", f"/ng/api/servicesV2/{service_id}/update-git-metadata", params=params)
 
 
 def get_target_file_path_from_entity(entity_data):
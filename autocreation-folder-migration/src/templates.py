@@ -1,133 +1,142 @@
-import requests
-from utility import EntityDetails, is_empty
+import time
+
+import log
+from context import Context
+from harness_client import HarnessRequest, get_client
+from utility import EntityDetails, is_empty, imap_concurrently, skip_inline
+from archives import read_archived_file
+from journal import is_done
+from listing_cache import list_cached
+from updates import Update, run_updates
+
+logger = log.get_logger("templates")
 
 
 def fetch_templates(harness_api_key, account_id, org_id, project_id):
-    base_url = "https://app.harness.io/gateway/template/api/templates/list-metadata"
+    request = list_templates_request(account_id, org_id, project_id)
+    templates, error = list_cached(harness_api_key, "TEMPLATE", account_id, org_id, project_id, request)
+    if error is not None:
+        logger.error("Failed to list templates", org=org_id, project=project_id, status=error.status_code,
+                     listed=len(templates))
+        logger.payload("Template listing error", error.text, sample=False, status=error.status_code)
+    logger.info("Listed templates", org=org_id, project=project_id, count=len(templates))
+    logger.payload("Template listing", templates, org=org_id, project=project_id)
+    return templates
 
-    # Construct query parameters based on the given scope
-    params = {
-        "accountIdentifier": account_id,
-        "orgIdentifier": org_id if org_id else None,
-        "projectIdentifier": project_id if project_id else None,
-        "templateListType": "LastUpdated",
-        'page': 0
-    }
 
-    # Set headers with authorization
-    headers = {
-        "Content-Type": "application/json",
-        "x-api-key": harness_api_key
-    }
+def update_template_file_path(api_key, account_id, org_id, project_id):
+    template_list = fetch_templates(api_key, account_id, org_id, project_id)
+    updates = []
+    for template in template_list:
+        if template['storeType'] != 'INLINE':
+            updates.append(Update("TEMPLATE", org_id, project_id, template['identifier'],
+                                  get_target_file_path(org_id, project_id, template['identifier'], template['versionLabel']),
+                                  update_template_git_metadata_request(account_id, org_id, project_id, template['identifier'], template['versionLabel'])))
+    run_updates(api_key, updates)
 
-    templates = []
-    while True:
-        # Make GET request
-        response = requests.post(base_url, headers=headers, params=params)
-        # Check response status
-        if response.status_code == 200:
-            print (response.json())
-            content = response.json()['data']['content']
-            if len(content) == 0:
-                return templates
-            templates.extend(content)
-            params['page'] += 1
-        else:
-            print(f"Failed to fetch templates. Status Code: {response.status_code}")
-            print(f"Response: {response.text}")
-            return None
 
+def fetch_template_details(harness_api_key, account_id, org_id, project_id, template_id, version):
+    request = template_details_request(account_id, org_id, project_id, template_id, version)
 
-def update_template_git_metadata(api_key, account_id, org_id, project_id, template_id, template_version):
-    url = f"https://app.harness.io/gateway/template/api/templates/update/git-metadata/{template_id}/{template_version}"
+    # Make GET request
+    started = time.monotonic()
+    response = get_client(harness_api_key).send(request)
+    duration_ms = round((time.monotonic() - started) * 1000, 1)
+    # Check response status
+    if response.status_code == 200:
+        logger.debug("Fetched template details", entity=template_id, version=version, endpoint="templates.details",
+                     status=response.status_code, duration_ms=duration_ms)
+        return response.json()
+    else:
+        logger.error("Failed to fetch template details", entity=template_id, version=version,
+                     endpoint="templates.details", status=response.status_code, duration_ms=duration_ms)
+        logger.payload("Template details error", response.text, sample=False, entity=template_id)
+        return None
 
-    params = {
-        "accountIdentifier": {account_id},
-        "orgIdentifier": org_id if org_id else None,
-        "projectIdentifier": project_id if project_id else None
-    }
 
-    data = {
-        "filePath": get_target_file_path(org_id, project_id, template_id, template_version)
-    }
-    # Set headers with authorization
-    headers = {
-        "Content-Type": "application/json",
-        "x-api-key": api_key
-    }
+def stream_templates(api_key, account_id, org_id, project_id):
+    template_list = fetch_templates(api_key, account_id, org_id, project_id)
+    entity_data_list = imap_concurrently(
+        lambda template: process_template(api_key, account_id, org_id, project_id, template),
+        skip_inline(template_list, "templates"), Context.concurrency, Context.queue_depth)
+    return (entity_data for entity_data in entity_data_list if entity_data is not None)
 
-    print(f"Updating template filepath : {params} for template id : {template_id} and version : {template_version}")
 
+def process_template(api_key, account_id, org_id, project_id, template):
+    if is_done(1, get_target_file_path(org_id, project_id, template["identifier"], template['versionLabel'])):
+        return None
     try:
-        response = requests.post(url, headers=headers, params=params, json=data)
-        response.raise_for_status()  # Raise an error for HTTP errors (4xx and 5xx)
-        print(response.json())
+        details = read_template_details(template) or \
+            fetch_template_details(api_key, account_id, org_id, project_id, template["identifier"], template['versionLabel'])
+        if details is None:
+            return None
+        return build_template_entity(account_id, org_id, project_id, template, details)
+    except Exception:
+        logger.exception("Failed to process template", entity=template["identifier"], version=template['versionLabel'])
+    return None
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error updating Git metadata: {e}")
-        return None
 
+def read_template_details(template):
+    """Template details with the YAML read from the repo archive, None if it has to be fetched from Harness."""
+    yaml = read_archived_file(template.get('gitDetails'))
+    if yaml is None:
+        return None
+    return {"data": {"storeType": template['storeType'], "yaml": yaml, "gitDetails": template['gitDetails']}}
 
-def update_template_file_path(api_key, account_id, org_id, project_id):
-    template_list = fetch_templates(api_key, account_id, org_id, project_id)
-    for template in template_list:
-        if template['storeType'] != 'INLINE':
-            update_template_git_metadata(api_key, account_id, org_id, project_id, template['identifier'], template['versionLabel'])
 
+def build_template_entity(account_id, org_id, project_id, template, details):
+    data = details['data']
+    if data['storeType'] == 'INLINE':
+        return None
+    entity_data = EntityDetails(account_id, org_id, project_id, template['identifier'],
+                                data['yaml'], data['gitDetails']['repoName'],
+                                data['gitDetails']['repoUrl'])
+    entity_data.version = template['versionLabel']
+    entity_data.target_file_path = get_target_file_path_from_entity(entity_data)
+    entity_data.source_file_path = data['gitDetails']['filePath']
+    entity_data.source_branch = data['gitDetails'].get('branch') or ""
+    if entity_data.target_file_path == entity_data.source_file_path:
+        logger.info("Ignoring the template as it is already under the conventional file path",
+                    entity=template['identifier'], version=template['versionLabel'],
+                    file_path=entity_data.target_file_path)
+        return None
+    return entity_data
 
-def fetch_template_details(harness_api_key, account_id, org_id, project_id, template_id, version):
-    base_url = f"https://app.harness.io/gateway/template/api/templates/{template_id}"
 
-    # Construct query parameters
+def list_templates_request(account_id, org_id, project_id):
+    # Construct query parameters based on the given scope
     params = {
         "accountIdentifier": account_id,
         "orgIdentifier": org_id if org_id else None,
         "projectIdentifier": project_id if project_id else None,
-        "versionLabel": version
+        "templateListType": "LastUpdated",
+        'page': 0,
+        'size': Context.page_size
     }
+    return HarnessRequest("POST", "/template/api/templates/list-metadata", params=params, page_param="page", idempotent=True)
 
-    # Set headers with authorization
-    headers = {
-        "Content-Type": "application/json",
-        "x-api-key": harness_api_key
-    }
 
-    print(params)
-    # Make GET request
-    response = requests.get(base_url, headers=headers, params=params)
-    # Check response status
-    if response.status_code == 200:
-        return response.json()
-    else:
-        print(f"Failed to fetch template details. Status Code: {response.status_code}")
-        print(f"Response: {response.text}")
-        return None
+def template_details_request(account_id, org_id, project_id, template_id, version):
+    params = {
+        "accountIdentifier": account_id,
+        "orgIdentifier": org_id if org_id else None,
+        "projectIdentifier": project_id if project_id else None,
+        "versionLabel": version
+    }
+    return HarnessRequest("GET", f"/template/api/templates/{template_id}", params=params)
 
 
-def process_templates(api_key, account_id, org_id, project_id):
-    template_list = fetch_templates(api_key, account_id, org_id, project_id)
-    entity_data_list = []
-    if template_list is None:
-        print("no templates found to process")
-        return entity_data_list
-    print(template_list)
-    for template in template_list:
-        try:
-            details = fetch_template_details(api_key, account_id, org_id, project_id, template["identifier"], template['versionLabel'])
-            data = details['data']
-            if data['storeType'] != 'INLINE':
-                entity_data = EntityDetails(account_id, org_id, project_id, template['identifier'],
-                                            data['yaml'], data['gitDetails']['repoName'],
-                                            data['gitDetails']['repoUrl'])
-                entity_data.version = template['versionLabel']
-                entity_data.target_file_path = get_target_file_path_from_entity(entity_data)
-                if entity_data.target_file_path == data['gitDetails']['filePath']:
-                    print("ignoring the template as its already under conventional filepath" + template + ":::" + data)
-                    continue
-                entity_data_list.append(entity_data)
-        except Exception as ex:
-            print(ex)
-    return entity_data_list
+def update_template_git_metadata_request(account_id, org_id, project_id, template_id, template_version):
+    params = {
+        "accountIdentifier": account_id,
+        "orgIdentifier": org_id if org_id else None,
+        "projectIdentifier": project_id if project_id else None
+    }
+    data = {
+        "filePath": get_target_file_path(org_id, project_id, template_id, template_version)
+    }
+    return HarnessRequest("POST", f"/template/api/templates/update/git-metadata/{template_id}/{template_version}",
+                          params=params, json=data, idempotent=True)
 
 
 def get_target_file_path_from_entity(entity_data):
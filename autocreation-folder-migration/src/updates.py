@@ -0,0 +1,110 @@
+import csv
+import json
+import threading
+import time
+
+import journal
+import log
+import metrics
+from context import Context
+from harness_client import get_client
+from utility import map_concurrently
+
+UPDATED = "updated"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+REPORT_FIELDS = ["entity_type", "org_id", "project_id", "identifier", "file_path", "status", "status_code",
+                 "latency_ms", "error"]
+
+_results = []
+_results_lock = threading.Lock()
+
+logger = log.get_logger("updates")
+
+
+class Update:
+    """One update-git-metadata call of operation-2 and its outcome."""
+
+    def __init__(self, entity_type, org_id, project_id, identifier, file_path, request):
+        self.entity_type = entity_type
+        self.org_id = org_id
+        self.project_id = project_id
+        self.identifier = identifier
+        self.file_path = file_path
+        self.request = request
+        self.status = None
+        self.status_code = None
+        self.latency_ms = None
+        self.error = ""
+
+    def endpoint(self):
+        return metrics.harness_endpoint(self.request.path)
+
+    def to_row(self):
+        return {field: getattr(self, field) for field in REPORT_FIELDS}
+
+
+def run_updates(api_key, updates):
+    """Sends the updates with up to Context.concurrency of them in flight and adds them to the report."""
+    client = get_client(api_key)
+    map_concurrently(lambda update: send_update(client, update), updates, Context.concurrency)
+
+
+def send_update(client, update):
+    if start_update(update):
+        started = time.monotonic()
+        try:
+            response = client.send(update.request)
+            finish_update(update, started, response.status_code, response.text)
+        except Exception as ex:
+            finish_update(update, started, error=str(ex))
+
+
+def start_update(update):
+    """Returns False, and reports the update as skipped, if the resumed run already did it."""
+    if journal.is_done(2, update.file_path):
+        update.status = SKIPPED
+        add_result(update)
+        return False
+    logger.debug("Updating file path", entity_type=update.entity_type, entity=update.identifier,
+                 file_path=update.file_path)
+    return True
+
+
+def finish_update(update, started, status_code=None, text="", error=""):
+    update.latency_ms = round((time.monotonic() - started) * 1000, 1)
+    update.status_code = status_code
+    if status_code == 200:
+        update.status = UPDATED
+        journal.record_entity(2, update.entity_type, update.org_id, update.project_id, update.file_path, journal.UPDATED)
+        logger.info("✅ Git metadata updated", entity_type=update.entity_type, entity=update.identifier,
+                    endpoint=update.endpoint(), status=status_code, duration_ms=update.latency_ms)
+    else:
+        update.status = FAILED
+        update.error = error or text
+        logger.error("Failed to update Git metadata", entity_type=update.entity_type, entity=update.identifier,
+                     endpoint=update.endpoint(), status=status_code or "error", duration_ms=update.latency_ms)
+        logger.payload("Git metadata update error", update.error, sample=False, entity=update.identifier)
+    add_result(update)
+
+
+def add_result(update):
+    with _results_lock:
+        _results.append(update.to_row())
+
+
+def write_report(path):
+    """Writes every update of the run to path, as CSV if it ends with .csv and as JSON otherwise."""
+    with _results_lock:
+        rows = list(_results)
+    summary = {status: sum(1 for row in rows if row["status"] == status) for status in (UPDATED, FAILED, SKIPPED)}
+    if path.endswith(".csv"):
+        with open(path, "w", newline="") as report_file:
+            writer = csv.DictWriter(report_file, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(path, "w") as report_file:
+            json.dump({"summary": summary, "entities": rows}, report_file, indent=2)
+    logger.info("Operation-2 report written", path=path, **summary)
@@ -1,17 +1,57 @@
+import sys
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import log
+from context import Context
+
+logger = log.get_logger("utility")
+
+
 class EntityDetails:
+    # Tens of thousands of these can be waiting for their commit, slots keep them small
+    __slots__ = ("project_identifier", "org_identifier", "account_identifier", "identifier", "repo", "repo_url",
+                 "target_file_path", "source_file_path", "source_branch", "sub_type", "version", "parent_id", "_yaml")
+
     def __init__(self, account_identifier, org_identifier, project_identifier, identifier, yaml, repo, repo_url):
-        self.project_identifier = project_identifier
-        self.org_identifier = org_identifier
-        self.account_identifier = account_identifier
+        # Scope and repo strings are shared by most entities, interning keeps one copy of each
+        self.project_identifier = intern(project_identifier)
+        self.org_identifier = intern(org_identifier)
+        self.account_identifier = intern(account_identifier)
         self.identifier = identifier
-        self.repo = repo
+        self.repo = intern(repo)
         self.yaml = yaml
-        self.repo_url = repo_url
+        self.repo_url = intern(repo_url)
         self.target_file_path = ""
+        self.source_file_path = ""
+        self.source_branch = ""
         self.sub_type = ""
         self.version = ""
         self.parent_id = ""
 
+    @property
+    def yaml(self):
+        if isinstance(self._yaml, YamlRef):
+            return get_yaml_store().read(self._yaml)
+        return self._yaml
+
+    @yaml.setter
+    def yaml(self, yaml):
+        if Context.spill_yaml and isinstance(yaml, str):
+            self._yaml = get_yaml_store().write(yaml)
+        else:
+            self._yaml = yaml
+
+    @property
+    def yaml_size(self):
+        """Size of the YAML in bytes once committed, without reading it back from the spill file."""
+        if isinstance(self._yaml, YamlRef):
+            return self._yaml.length
+        return len(self._yaml.encode("utf-8"))
+
     def __repr__(self):
         return (f"EntityDetails(account_identifier='{self.account_identifier}', "
                 f"org_identifier='{self.org_identifier}', "
@@ -20,23 +60,72 @@ class EntityDetails:
                 f"repo='{self.repo}', "
                 f"repo_url='{self.repo_url}', "
                 f"target_file_path='{self.target_file_path}', "
+                f"source_file_path='{self.source_file_path}', "
                 f"sub_type='{self.sub_type}', "
                 f"version='{self.version}', "
                 f"parent_id='{self.parent_id}', "
                 f"yaml='{self.yaml[:30]}...')")  # Truncated YAML for readability
 
 
+class YamlRef:
+    __slots__ = ("offset", "length")
+
+    def __init__(self, offset, length):
+        self.offset = offset
+        self.length = length
+
+
+class YamlStore:
+    """Append-only temporary file holding YAML bodies, only their offset and length stay in memory.
+
+    The file is deleted when the process exits.
+    """
+
+    def __init__(self, directory):
+        self.file = tempfile.TemporaryFile(dir=directory)
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        data = text.encode("utf-8")
+        with self.lock:
+            self.file.seek(self.size)
+            self.file.write(data)
+            ref = YamlRef(self.size, len(data))
+            self.size += len(data)
+        return ref
+
+    def read(self, ref):
+        with self.lock:
+            self.file.seek(ref.offset)
+            return self.file.read(ref.length).decode("utf-8")
+
+
+_yaml_store = None
+_yaml_store_lock = threading.Lock()
+
+
+def get_yaml_store():
+    global _yaml_store
+    with _yaml_store_lock:
+        if _yaml_store is None:
+            _yaml_store = YamlStore(Context.spill_dir or None)
+        return _yaml_store
+
+
+def intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
 def find_substring_ending_with(main_str, input_str):
-    result = []
-    for i in range(len(main_str)):
-        substring = main_str[:i+1]  # Get substring from start to i
-        if substring.endswith(input_str):  # Check if it ends with input_str
-            result.append(substring)
-    if len(result) > 0:
-        return result[0]
-    return None
+    # The shortest prefix of main_str ending with input_str ends at the first occurrence of input_str
+    index = main_str.find(input_str)
+    if index < 0:
+        return None
+    return main_str[:index + len(input_str)]
 
 
+@lru_cache(maxsize=4096)
 def get_repo_url(file_url, repo_name):
     return find_substring_ending_with(file_url, repo_name)
 
@@ -45,3 +134,76 @@ def is_empty(entity_identifier):
     if entity_identifier is None or entity_identifier == "":
         return True
     return False
+
+
+def map_concurrently(func, items, concurrency):
+    """Applies func to every item using at most `concurrency` worker threads, results keep the order of items."""
+    items = list(items)
+    if concurrency <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(items))) as executor:
+        return list(executor.map(func, items))
+
+
+def imap_concurrently(func, items, concurrency, buffer_size):
+    """Lazy map_concurrently: results are yielded in order as soon as they are ready.
+
+    At most max(buffer_size, concurrency) items are in flight or waiting to be consumed, so a slow consumer holds back
+    the workers instead of letting results pile up in memory.
+    """
+    if concurrency <= 1:
+        for item in items:
+            yield func(item)
+        return
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= max(buffer_size, concurrency):
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def fan_out(list_children, parents, concurrency, buffer_size, parent_name, child_name):
+    """Yields (parent, child) pairs, listing the children of up to `concurrency` parents at once.
+
+    The children of a parent are yielded as soon as its listing returns, in the order of parents, so that their
+    details are fetched while the next parents are still being listed.
+    """
+    child_counts = []
+    listings = imap_concurrently(lambda parent: (parent, list_children(parent)), parents, concurrency, buffer_size)
+    for parent, children in listings:
+        child_counts.append(len(children))
+        for child in children:
+            yield parent, child
+    report_fan_out(child_counts, parent_name, child_name)
+
+
+def skip_inline(items, entity_name, get_entity=lambda item: item):
+    """Yields the listed items whose entity is stored in git, dropping the INLINE ones on their listing metadata.
+
+    Their details would only show that there is nothing to migrate, skipping them first saves a details call and a
+    YAML download per inline entity.
+    """
+    inline = 0
+    for item in items:
+        if is_inline(get_entity(item)):
+            inline += 1
+            continue
+        yield item
+    report_inline(inline, entity_name)
+
+
+def is_inline(entity):
+    return entity.get('storeType') == 'INLINE'
+
+
+def report_inline(count, entity_name):
+    logger.info(f"Skipped inline {entity_name} before fetching their details", count=count)
+
+
+def report_fan_out(child_counts, parent_name, child_name):
+    empty_parents = sum(1 for count in child_counts if count == 0)
+    logger.info(f"Listed {child_name} of {parent_name}", children=sum(child_counts), parents=len(child_counts),
+                empty_parents=empty_parents)